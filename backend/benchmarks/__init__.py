@@ -0,0 +1 @@
+# Benchmark harness for OCR and PDF generation throughput
@@ -0,0 +1,111 @@
+"""Synthesize deterministic test PDFs for the benchmark harness"""
+import random
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# Field labels used on every synthesized page; values are numbered so each
+# field has a unique, searchable original text.
+FIELD_LABELS = ["Invoice No", "Order", "Customer ID", "Serial", "Ticket", "Batch", "Lot", "Ref"]
+
+# Resolution used when rasterizing "scanned" pages
+SCAN_DPI = 150
+
+
+def field_texts(page_num: int, num_fields: int) -> List[str]:
+    """Return the field values drawn on a given page"""
+    return [f"{FIELD_LABELS[i % len(FIELD_LABELS)][:3].upper()}-{page_num:02d}{i:03d}" for i in range(num_fields)]
+
+
+def _page_lines(page_num: int, num_fields: int, rng: random.Random) -> List[Dict]:
+    """Layout of label/value lines for one page, in PDF points from top-left"""
+    lines = []
+    width, height = letter
+    y = 72
+    for i, value in enumerate(field_texts(page_num, num_fields)):
+        label = FIELD_LABELS[i % len(FIELD_LABELS)]
+        # Alternate between one and two columns so grouping sees mixed layouts
+        x = 72 if i % 2 == 0 else width / 2
+        lines.append({"label": f"{label}:", "value": value, "x": x, "y": y, "size": rng.choice([10, 12, 14])})
+        if i % 2 == 1:
+            y += 28
+        if y > height - 72:
+            y = 72
+    return lines
+
+
+def _draw_text_page(c: canvas.Canvas, lines: List[Dict]):
+    """Draw a page with a real text layer"""
+    _, height = letter
+    for line in lines:
+        c.setFont("Helvetica", line["size"])
+        c.drawString(line["x"], height - line["y"], line["label"])
+        c.drawString(line["x"] + 90, height - line["y"], line["value"])
+
+
+def _draw_scanned_page(c: canvas.Canvas, lines: List[Dict]):
+    """Draw a page as a single raster image with no text layer"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    width, height = letter
+    scale = SCAN_DPI / 72.0
+    image = Image.new("L", (int(width * scale), int(height * scale)), 255)
+    draw = ImageDraw.Draw(image)
+    for line in lines:
+        try:
+            font = ImageFont.load_default(size=int(line["size"] * scale))
+        except TypeError:
+            # Older Pillow versions only ship the fixed-size bitmap font
+            font = ImageFont.load_default()
+        draw.text((line["x"] * scale, line["y"] * scale), line["label"], fill=0, font=font)
+        draw.text(((line["x"] + 90) * scale, line["y"] * scale), line["value"], fill=0, font=font)
+    c.drawImage(ImageReader(image), 0, 0, width=width, height=height)
+
+
+def make_pdf(num_pages: int, num_fields: int, scanned: bool = False, seed: int = 0) -> bytes:
+    """Build a PDF with `num_fields` label/value pairs on each of `num_pages` pages"""
+    rng = random.Random(seed)
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    for page_num in range(num_pages):
+        lines = _page_lines(page_num, num_fields, rng)
+        if scanned:
+            _draw_scanned_page(c, lines)
+        else:
+            _draw_text_page(c, lines)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def write_fixture(directory: Path, num_pages: int, num_fields: int, scanned: bool = False, seed: int = 0) -> Path:
+    """Write a synthesized PDF to `directory` and return its path"""
+    kind = "scanned" if scanned else "text"
+    path = directory / f"bench_{kind}_{num_pages}p_{num_fields}f.pdf"
+    path.write_bytes(make_pdf(num_pages, num_fields, scanned=scanned, seed=seed))
+    return path
+
+
+def rules_for_fixture(num_pages: int, num_fields: int, max_rules: int = None) -> List[Dict]:
+    """Serial replacement rules targeting the field values of a fixture"""
+    rules = []
+    for page_num in range(num_pages):
+        for i, text in enumerate(field_texts(page_num, num_fields)):
+            rules.append({
+                "section_id": f"section_{len(rules)}",
+                "original_text": text,
+                "type": "serial",
+                "start_value": 1,
+                "random_min": None,
+                "random_max": None,
+                "prefix": text.split("-")[0] + "-",
+                "suffix": "",
+                "format": "%05d",
+            })
+            if max_rules and len(rules) >= max_rules:
+                return rules
+    return rules
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Reproducible throughput benchmarks for OCR and PDF generation.
+
+Run from the backend directory:
+
+    python -m benchmarks.run_benchmarks --out bench_results.json
+    python -m benchmarks.run_benchmarks --quick --baseline bench_results.json
+
+Test PDFs are synthesized with reportlab (see fixtures.py), so runs do not
+depend on any checked-in documents. All services run inside a temporary
+working directory so uploads/outputs from the benchmark never mix with real data.
+The API benchmarks use FastAPI's TestClient, which needs `httpx` installed.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.fixtures import rules_for_fixture, write_fixture
+
+# (pages, fields per page, scanned)
+FULL_MATRIX = [
+    (1, 4, False),
+    (5, 8, False),
+    (20, 16, False),
+    (1, 4, True),
+    (5, 8, True),
+]
+QUICK_MATRIX = [
+    (1, 4, False),
+    (3, 8, False),
+    (1, 4, True),
+]
+FULL_COPIES = [1, 10, 50]
+QUICK_COPIES = [1, 5]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """Silence the services' console logging while timing"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def ocr_available() -> Optional[str]:
+    """Return a reason string if OCR cannot run here, None otherwise"""
+    if not shutil.which("tesseract"):
+        return "tesseract binary not found"
+    if not shutil.which("pdftoppm"):
+        return "poppler (pdftoppm) not found"
+    return None
+
+
+def bench_ocr(fixtures: List[Dict], quiet_output: bool) -> List[Dict]:
+    """Measure OCRService.process_pdf throughput in pages/sec"""
+    reason = ocr_available()
+    if reason:
+        print(f"Skipping OCR benchmarks: {reason}")
+        return [{"name": f"ocr/{f['name']}", "skipped": reason} for f in fixtures]
+
+    from services.ocr_service import OCRService
+
+    with quiet(quiet_output):
+        service = OCRService()
+    results = []
+    for fixture in fixtures:
+        start = time.perf_counter()
+        with quiet(quiet_output):
+            sections = asyncio.run(service.process_pdf(fixture["path"]))
+        elapsed = time.perf_counter() - start
+        result = {
+            "name": f"ocr/{fixture['name']}",
+            "pages": fixture["pages"],
+            "seconds": round(elapsed, 4),
+            "pages_per_sec": round(fixture["pages"] / elapsed, 3),
+            "sections": len(sections),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        print(f"  {result['name']}: {result['pages_per_sec']} pages/sec ({result['sections']} sections)")
+        results.append(result)
+    service.executor.shutdown(wait=False)
+    return results
+
+
+def bench_generation(fixtures: List[Dict], copies: List[int], quiet_output: bool) -> List[Dict]:
+    """Measure GeneratorService.generate_pdfs throughput in copies/sec"""
+    from services.generator_service import GeneratorService
+
+    service = GeneratorService()
+    results = []
+    for fixture in fixtures:
+        rules = rules_for_fixture(fixture["pages"], fixture["fields"])
+        for num_copies in copies:
+            start = time.perf_counter()
+            with quiet(quiet_output):
+                output_files = asyncio.run(service.generate_pdfs(fixture["path"], rules, num_copies))
+            elapsed = time.perf_counter() - start
+            result = {
+                "name": f"generate/{fixture['name']}/{num_copies}copies",
+                "copies": num_copies,
+                "rules": len(rules),
+                "seconds": round(elapsed, 4),
+                "copies_per_sec": round(len(output_files) / elapsed, 3),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            print(f"  {result['name']}: {result['copies_per_sec']} copies/sec")
+            results.append(result)
+            for path in output_files:
+                path.unlink(missing_ok=True)
+    return results
+
+
+def bench_api(fixtures: List[Dict], copies: List[int], iterations: int, quiet_output: bool) -> List[Dict]:
+    """Measure /api/generate latency (p50/p99) and peak RSS through a TestClient"""
+    from fastapi.testclient import TestClient
+
+    with quiet(quiet_output):
+        import main
+    client = TestClient(main.app)
+    results = []
+    for fixture in fixtures:
+        with open(fixture["path"], "rb") as f:
+            upload = client.post("/api/upload", files={"file": (fixture["path"].name, f, "application/pdf")})
+        upload.raise_for_status()
+        pdf_id = upload.json()["pdf_id"]
+        rules = rules_for_fixture(fixture["pages"], fixture["fields"])
+        for num_copies in copies:
+            latencies = []
+            rss_before = peak_rss_mb()
+            for _ in range(iterations):
+                start = time.perf_counter()
+                with quiet(quiet_output):
+                    response = client.post("/api/generate", json={
+                        "pdf_id": pdf_id,
+                        "rules": rules,
+                        "num_copies": num_copies,
+                    })
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+            result = {
+                "name": f"api/generate/{fixture['name']}/{num_copies}copies",
+                "copies": num_copies,
+                "iterations": iterations,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+                "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+            }
+            print(f"  {result['name']}: p50={result['p50_ms']}ms p99={result['p99_ms']}ms peak_rss={result['peak_rss_mb']}MB")
+            results.append(result)
+    return results
+
+
+def environment_info() -> Dict:
+    """Versions and host details recorded alongside results"""
+    info = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        info["git_rev"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        info["git_rev"] = None
+    for module in ("fitz", "PyPDF2", "reportlab", "pytesseract", "fastapi"):
+        try:
+            imported = __import__(module)
+            info[f"{module}_version"] = getattr(imported, "__version__", None) or getattr(imported, "VersionBind", None)
+        except ImportError:
+            info[f"{module}_version"] = None
+    return info
+
+
+# Metrics where a larger number is better; everything else is a cost
+THROUGHPUT_METRICS = ("pages_per_sec", "copies_per_sec")
+COMPARED_METRICS = THROUGHPUT_METRICS + ("p50_ms", "p99_ms", "peak_rss_mb")
+
+
+def compare(current: Dict, baseline: Dict) -> List[Dict]:
+    """Compare two result files entry by entry and print relative changes"""
+    previous = {}
+    for entries in baseline.get("results", {}).values():
+        for entry in entries:
+            previous[entry["name"]] = entry
+    changes = []
+    print("\nComparison against baseline:")
+    for entries in current["results"].values():
+        for entry in entries:
+            old = previous.get(entry["name"])
+            if not old or entry.get("skipped") or old.get("skipped"):
+                continue
+            for metric in COMPARED_METRICS:
+                if metric not in entry or not old.get(metric):
+                    continue
+                ratio = entry[metric] / old[metric]
+                improved = ratio > 1 if metric in THROUGHPUT_METRICS else ratio < 1
+                changes.append({"name": entry["name"], "metric": metric, "baseline": old[metric],
+                                "current": entry[metric], "ratio": round(ratio, 3)})
+                marker = "+" if improved else "-"
+                print(f"  [{marker}] {entry['name']} {metric}: {old[metric]} -> {entry[metric]} (x{ratio:.2f})")
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR and PDF generation throughput")
+    parser.add_argument("--out", default="bench_results.json", help="Path of the JSON results file")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    parser.add_argument("--quick", action="store_true", help="Run a reduced matrix for smoke testing")
+    parser.add_argument("--iterations", type=int, default=5, help="Requests per /api/generate measurement")
+    parser.add_argument("--only", choices=["ocr", "generate", "api"], action="append",
+                        help="Run only the given benchmark group (repeatable)")
+    parser.add_argument("--verbose", action="store_true", help="Show service logging during timed runs")
+    args = parser.parse_args()
+
+    matrix = QUICK_MATRIX if args.quick else FULL_MATRIX
+    copies = QUICK_COPIES if args.quick else FULL_COPIES
+    groups = args.only or ["ocr", "generate", "api"]
+    out_path = Path(args.out).resolve()
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+    quiet_output = not args.verbose
+
+    workdir = Path(tempfile.mkdtemp(prefix="pdf_bench_"))
+    fixture_dir = workdir / "fixtures"
+    fixture_dir.mkdir()
+    original_cwd = os.getcwd()
+    # Services create uploads/ and outputs/ relative to the working directory
+    os.chdir(workdir)
+    try:
+        print(f"Synthesizing {len(matrix)} fixture PDFs in {fixture_dir}")
+        fixtures = []
+        for pages, fields, scanned in matrix:
+            path = write_fixture(fixture_dir, pages, fields, scanned=scanned)
+            fixtures.append({
+                "name": path.stem.replace("bench_", ""),
+                "path": path,
+                "pages": pages,
+                "fields": fields,
+                "scanned": scanned,
+            })
+        text_fixtures = [f for f in fixtures if not f["scanned"]]
+
+        results = {}
+        if "ocr" in groups:
+            print("OCR benchmarks:")
+            results["ocr"] = bench_ocr(fixtures, quiet_output)
+        if "generate" in groups:
+            print("Generation benchmarks:")
+            results["generation"] = bench_generation(text_fixtures, copies, quiet_output)
+        if "api" in groups:
+            print("API benchmarks:")
+            results["api"] = bench_api(text_fixtures, copies, args.iterations, quiet_output)
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": environment_info(),
+        "config": {"quick": args.quick, "iterations": args.iterations, "matrix": matrix, "copies": copies},
+        "results": results,
+    }
+    if baseline_path and baseline_path.exists():
+        report["comparison"] = compare(report, json.loads(baseline_path.read_text()))
+
+    out_path.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,42 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from starlette.background import BackgroundTask
+from typing import List, Optional, Dict, Any, Union
 import os
 import uuid
 import json
+import random
+import asyncio
+import contextvars
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from services.ocr_service import OCRService
 from services.pdf_service import PDFService
 from services.generator_service import GeneratorService
+from services.section_store import SectionStore
+from services.dataset_service import DatasetService
+from services.compiled_job import CompiledJob
+from services.job_checkpoint import GENERATION_CHUNK_SIZE, JobCheckpoint, is_valid_job_id
+from services.job_queue import create_job_queue
+from services.archive_service import ShardedArchive
+from services.download_service import file_download
+from services.page_render_service import PageRenderService
+from services.output_retention import OUTPUT_RETENTION_HOURS, OUTPUT_SWEEP_INTERVAL, sweep_outputs
+from services.coordinates import pixels_to_points
+from services.admission_service import AdmissionController, AdmissionRejected
+from services import shared_store, startup
+from services.startup import LazyService
+from services.tesseract_engine import import_bindings
+from services.profiling_service import (
+    PROFILING_ENABLED,
+    start_request_profile,
+    finish_request_profile,
+    profile_artifact_path,
+)
 
 app = FastAPI(title="Programmable PDF Editor API")
 
@@ -42,34 +68,35 @@ OUTPUT_DIR = Path("outputs")
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-# Initialize services
-print("Initializing services...")
-try:
-    ocr_service = OCRService()
-    print("OCR service initialized")
-except Exception as e:
-    print(f"Error initializing OCR service: {e}")
-    import traceback
-    traceback.print_exc()
-    raise
-
-try:
-    pdf_service = PDFService()
-    print("PDF service initialized")
-except Exception as e:
-    print(f"Error initializing PDF service: {e}")
-    import traceback
-    traceback.print_exc()
-    raise
-
-try:
-    generator_service = GeneratorService()
-    print("Generator service initialized")
-except Exception as e:
-    print(f"Error initializing Generator service: {e}")
-    import traceback
-    traceback.print_exc()
-    raise
+# Services are created on first use (or by the warm-up after startup), so the
+# app starts accepting requests before PyMuPDF, Tesseract etc. are loaded
+def _create_ocr_service() -> OCRService:
+    service = OCRService()
+    # OCR page rasters are kept for page previews
+    service.raster_cache = page_render_service.get()
+    return service
+
+
+pdf_service = LazyService("pdf_service", PDFService)
+# Generation shares the PDF service and with it the replacement plan cache
+generator_service = LazyService("generator_service", lambda: GeneratorService(pdf_service.get()))
+page_render_service = LazyService("page_render_service", PageRenderService)
+ocr_service = LazyService("ocr_service", _create_ocr_service)
+# Chunks of distributed generation jobs, rendered by worker.py processes
+job_queue = LazyService("job_queue", create_job_queue)
+section_store = SectionStore(UPLOAD_DIR)
+dataset_service = DatasetService(UPLOAD_DIR)
+# Global memory/CPU budget shared by OCR and generation requests
+admission = AdmissionController()
+# Construct the services in the background right after startup (set to false to defer them to the first request)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+# Queue generation requests for worker.py processes by default instead of rendering in this process
+DISTRIBUTED_GENERATION = os.getenv("DISTRIBUTED_GENERATION", "false").lower() in ("1", "true", "yes")
+
+# Generation jobs running in the background, by job id
+background_jobs: Dict[str, asyncio.Task] = {}
+# Periodic deletion of expired generation outputs (see OUTPUT_RETENTION_HOURS)
+output_sweeper: Optional[asyncio.Task] = None
 
 # Log all registered routes
 print("Registered routes:")
@@ -79,31 +106,55 @@ for route in app.routes:
 
 
 class TextSection(BaseModel):
+    id: Optional[str] = None
     text: str
     x: float
     y: float
     width: float
     height: float
     page: int
+    dpi: Optional[float] = None  # DPI the pixel coordinates were measured at (200 if omitted)
+    page_width: Optional[float] = None  # Page size in PDF points
+    page_height: Optional[float] = None
 
 
 class ReplacementRule(BaseModel):
     section_id: str
     original_text: str  # The text to replace
-    type: str  # "serial", "random", "custom"
+    type: str  # "serial", "random", "custom", "dataset"
     start_value: Optional[int] = None
     random_min: Optional[int] = None
     random_max: Optional[int] = None
     prefix: Optional[str] = ""
     suffix: Optional[str] = ""
     format: Optional[str] = None  # e.g., "%04d" for zero-padded numbers
+    column: Optional[str] = None  # Dataset column supplying the value, for type "dataset"
+    field: Optional[str] = None  # Random rules with the same field get the same value in every template of a batch
+
+
+class RegionRequest(BaseModel):
+    page: int
+    x: float
+    y: float
+    width: float
+    height: float
+    coordinate_dpi: Optional[float] = None  # If set, x/y/width/height are pixels at this DPI (as in a section); otherwise PDF points
+    dpi: Optional[int] = None  # Rasterization DPI for the re-scan (defaults to OCR_REGION_DPI)
 
 
 class GenerationRequest(BaseModel):
     pdf_id: str
     rules: List[ReplacementRule]
-    num_copies: int
+    num_copies: int  # With a dataset: maximum number of rows to use (0 = all rows)
     ocr_sections: Optional[List[TextSection]] = None  # Include OCR sections for coordinate-based replacement
+    dataset_id: Optional[str] = None  # Uploaded CSV/JSONL dataset for "dataset" rules, one row per copy
+    job_id: Optional[str] = None  # Reuse the X-Job-Id of a failed or interrupted request to resume it
+    seed: Optional[int] = None  # Seed for random rules (chosen automatically if omitted)
+    shard: bool = False  # Split the output into several ZIP archives listed in a manifest
+    shard_max_copies: Optional[int] = None  # Copies per archive (defaults to ZIP_SHARD_MAX_COPIES, 0 = no limit)
+    shard_max_bytes: Optional[int] = None  # PDF bytes per archive (defaults to ZIP_SHARD_MAX_BYTES, 0 = no limit)
+    background: bool = False  # Return 202 immediately and build shards while generating (implies shard)
+    distributed: Optional[bool] = None  # Queue chunks for worker.py processes and return 202 (defaults to DISTRIBUTED_GENERATION)
 
 
 @app.get("/")
@@ -114,12 +165,94 @@ async def root():
         "routes": [{"path": route.path, "methods": list(route.methods) if hasattr(route, 'methods') else []} for route in app.routes if hasattr(route, 'path')]
     }
 
+
+async def _sweep_outputs():
+    """Delete generation outputs older than OUTPUT_RETENTION_HOURS, every OUTPUT_SWEEP_INTERVAL seconds"""
+    loop = asyncio.get_event_loop()
+    while True:
+        active_jobs = set(background_jobs)
+        try:
+            await loop.run_in_executor(
+                None, sweep_outputs, OUTPUT_DIR, OUTPUT_RETENTION_HOURS * 3600, active_jobs
+            )
+        except Exception as e:
+            import traceback
+            print(f"Output sweep failed: {e}")
+            print(traceback.format_exc())
+        await asyncio.sleep(OUTPUT_SWEEP_INTERVAL)
+
+
+@app.on_event("startup")
+async def report_startup():
+    startup.mark_ready()
+    startup.print_report()
+    # Must happen on the main thread, before OCRService is built on another one
+    import_bindings()
+    global output_sweeper
+    if OUTPUT_RETENTION_HOURS > 0 and output_sweeper is None:
+        output_sweeper = asyncio.create_task(_sweep_outputs())
+    if STARTUP_WARMUP:
+        threading.Thread(
+            target=startup.warm_up,
+            args=([pdf_service, generator_service, page_render_service, ocr_service],),
+            name="warm-up",
+            daemon=True
+        ).start()
+
+
+@app.on_event("shutdown")
+async def stop_output_sweeper():
+    global output_sweeper
+    if output_sweeper is not None:
+        output_sweeper.cancel()
+        output_sweeper = None
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {"status": "ok", "service": "Programmable PDF Editor API"}
 
 
+@app.get("/api/admission")
+async def admission_stats():
+    """Admission control: budget in use, running and queued requests, queue wait times"""
+    return admission.stats()
+
+
+def _busy(error: Union[AdmissionRejected, shared_store.LeaseTimeout]) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+@asynccontextmanager
+async def _admitted(kind: str, cost, **kwargs):
+    """Run the block once the request's estimated cost fits the budget; 503 if it does not in time"""
+    try:
+        reservation = await admission.acquire(kind, cost, **kwargs)
+    except AdmissionRejected as e:
+        raise _busy(e)
+    try:
+        yield reservation
+    finally:
+        admission.release(reservation)
+
+
+@asynccontextmanager
+async def _ocr_lease(pdf_id: str):
+    """Hold the cross-process OCR lease of a PDF for the block; 503 if another request keeps it too long"""
+    try:
+        async with shared_store.lease(f"ocr:{pdf_id}"):
+            yield
+    except shared_store.LeaseTimeout as e:
+        raise _busy(e)
+
+
+@app.get("/api/startup")
+async def startup_report():
+    """Startup timing: time until ready, import and service construction times, and what is still deferred"""
+    return startup.report()
+
+
 @app.post("/api/upload")
 async def upload_pdf(file: UploadFile = File(...)):
     """Upload a PDF file and return its ID"""
@@ -136,18 +269,84 @@ async def upload_pdf(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _profile_info(summary: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Short description of a saved request profile, with its download URLs"""
+    if not summary:
+        return None
+    profile_id = summary["profile_id"]
+    return {
+        "profile_id": profile_id,
+        "wall_ms": summary["wall_ms"],
+        "stages": summary["stages"],
+        "url": f"/api/profiles/{profile_id}",
+        "artifacts": {kind: f"/api/profiles/{profile_id}/{kind}" for kind in summary["artifacts"]},
+    }
+
+
+@app.post("/api/datasets")
+async def upload_dataset(file: UploadFile = File(...)):
+    """Upload a CSV (with header row) or JSONL dataset for mail-merge generation"""
+    try:
+        return await dataset_service.save_upload(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/api/ocr/{pdf_id}")
-async def process_ocr(pdf_id: str):
-    """Process PDF with OCR to detect text sections"""
+async def process_ocr(pdf_id: str, dpi: Optional[int] = None, previous_pdf_id: Optional[str] = None,
+                      profile: Optional[str] = None, x_profile: Optional[str] = Header(None)):
+    """
+    Process PDF with OCR to detect text sections.
+    ?dpi= fixes the rasterization resolution; by default it is chosen per page.
+    Pages whose content is unchanged since the last OCR of this PDF, or of the
+    revision given as ?previous_pdf_id=, reuse those results; sections of re-OCR'd
+    pages keep the ids of matching sections in that version.
+    Pass ?profile=1 (or the X-Profile header) to profile this request when ENABLE_PROFILING is set;
+    use "sample" instead of "1" for a sampling profile.
+    """
+    profiler = start_request_profile("/api/ocr", pdf_id, profile or x_profile)
+    try:
+        result = await _process_ocr(pdf_id, dpi, previous_pdf_id)
+    finally:
+        summary = finish_request_profile(profiler)
+    if summary:
+        result["profile"] = _profile_info(summary)
+    return result
+
+
+async def _process_ocr(pdf_id: str, dpi: Optional[int] = None, previous_pdf_id: Optional[str] = None):
     try:
         file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="PDF not found")
+        if previous_pdf_id and not is_valid_job_id(previous_pdf_id):
+            raise HTTPException(status_code=400, detail="Invalid previous_pdf_id")
         
-        print(f"Processing OCR for PDF: {pdf_id}")
-        sections = await ocr_service.process_pdf(file_path)
-        print(f"OCR completed. Found {len(sections)} sections")
-        return {"sections": sections}
+        # One OCR of a PDF at a time across all server processes; a request that had to wait
+        # loads the results the other one just saved and only OCRs what is still missing
+        async with _ocr_lease(pdf_id):
+            source_id = previous_pdf_id or pdf_id
+            previous_sections = section_store.load(source_id)
+            if previous_pdf_id and previous_sections is None:
+                raise HTTPException(status_code=404, detail="No OCR results for the previous PDF")
+            
+            print(f"Processing OCR for PDF: {pdf_id}" + (f" (revision of {previous_pdf_id})" if previous_pdf_id else ""))
+            cost = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: ocr_service.estimate_cost(file_path, dpi)
+            )
+            async with _admitted("ocr", cost):
+                result = await ocr_service.process_pdf_incremental(
+                    file_path,
+                    dpi=dpi,
+                    previous_sections=previous_sections,
+                    previous_hashes=section_store.load_page_hashes(source_id)
+                )
+            sections = result["sections"]
+            print(f"OCR completed. Found {len(sections)} sections")
+            section_store.save(pdf_id, sections, result["page_hashes"])
+        return {"sections": sections, "reused_pages": result["reused_pages"], "ocr_pages": result["ocr_pages"]}
     except HTTPException:
         raise
     except Exception as e:
@@ -158,9 +357,244 @@ async def process_ocr(pdf_id: str):
         raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
 
+@app.post("/api/ocr/{pdf_id}/stream")
+async def stream_ocr(pdf_id: str, http_request: Request, dpi: Optional[int] = None,
+                     previous_pdf_id: Optional[str] = None, format: Optional[str] = None):
+    """
+    Like /api/ocr/{pdf_id}, but each page's sections are sent as soon as that page is done.
+    Responds with NDJSON (one JSON object per line), or server-sent events with
+    ?format=sse or an "Accept: text/event-stream" header. Events:
+      start - {"pages", "reused_pages", "ocr_pages"}
+      page  - {"page", "sections", "reused", "completed", "total"}; reused pages come first
+      done  - {"sections" (count), "reused_pages", "ocr_pages"}, after the results are saved
+      error - {"detail"}; the stream ends
+    """
+    file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if previous_pdf_id and not is_valid_job_id(previous_pdf_id):
+        raise HTTPException(status_code=400, detail="Invalid previous_pdf_id")
+    source_id = previous_pdf_id or pdf_id
+    if previous_pdf_id and section_store.load(source_id) is None:
+        raise HTTPException(status_code=404, detail="No OCR results for the previous PDF")
+    
+    if format is None:
+        format = "sse" if "text/event-stream" in http_request.headers.get("accept", "") else "ndjson"
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'sse' or 'ndjson'")
+    
+    cost = await asyncio.get_event_loop().run_in_executor(
+        None, lambda: ocr_service.estimate_cost(file_path, dpi)
+    )
+    try:
+        # Held until the stream ends; admission is decided before any bytes are sent
+        reservation = await admission.acquire("ocr", cost)
+    except AdmissionRejected as e:
+        raise _busy(e)
+    
+    def encode(event: Dict[str, Any]) -> bytes:
+        if format == "sse":
+            data = {key: value for key, value in event.items() if key != "event"}
+            return f"event: {event['event']}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+        return (json.dumps(event) + "\n").encode("utf-8")
+    
+    async def events():
+        try:
+            print(f"Streaming OCR for PDF: {pdf_id}" + (f" (revision of {previous_pdf_id})" if previous_pdf_id else ""))
+            sections = []
+            # Same per-PDF lease as /api/ocr; results are loaded once it is held
+            async with shared_store.lease(f"ocr:{pdf_id}"):
+                async for event in ocr_service.iter_incremental(
+                    file_path,
+                    dpi=dpi,
+                    previous_sections=section_store.load(source_id),
+                    previous_hashes=section_store.load_page_hashes(source_id)
+                ):
+                    if event["event"] == "start":
+                        start = event
+                        yield encode({key: value for key, value in event.items() if key != "page_hashes"})
+                        continue
+                    sections.extend(event["sections"])
+                    yield encode(event)
+                sections.sort(key=lambda section: section.get("page", 0))
+                section_store.save(pdf_id, sections, start["page_hashes"])
+            print(f"Streamed OCR completed. Found {len(sections)} sections")
+            yield encode({"event": "done", "sections": len(sections),
+                          "reused_pages": start["reused_pages"], "ocr_pages": start["ocr_pages"]})
+        except Exception as e:
+            import traceback
+            print(f"OCR Error: {str(e)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            yield encode({"event": "error", "detail": f"OCR processing failed: {str(e)}"})
+        finally:
+            admission.release(reservation)
+    
+    async def release():
+        admission.release(reservation)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        # Also released here in case the client disconnects before the stream starts (release is idempotent)
+        background=BackgroundTask(release),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/ocr/{pdf_id}/region")
+async def process_ocr_region(pdf_id: str, region: RegionRequest):
+    """
+    Re-scan a single page rectangle at high DPI and merge the result into the
+    cached section list, replacing the sections that were inside the rectangle.
+    """
+    try:
+        file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
+        if not file_path.exists():
+            raise HTTPException(status_code=404, detail="PDF not found")
+        if region.width <= 0 or region.height <= 0:
+            raise HTTPException(status_code=400, detail="Region width and height must be positive")
+        
+        rect = (region.x, region.y, region.x + region.width, region.y + region.height)
+        if region.coordinate_dpi:
+            rect = tuple(pixels_to_points(v, region.coordinate_dpi) for v in rect)
+        
+        try:
+            new_sections = await ocr_service.process_region(file_path, region.page, rect, dpi=region.dpi)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # The merge reads and rewrites the saved sections, so it must not interleave with a full OCR
+        async with _ocr_lease(pdf_id):
+            all_sections, added = section_store.merge_region(pdf_id, region.page, rect, new_sections)
+        return {"sections": added, "all_sections": all_sections}
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Region OCR Error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Region OCR failed: {str(e)}")
+
+
+@app.get("/api/ocr/{pdf_id}/sections")
+async def get_sections(pdf_id: str):
+    """Return the cached OCR sections of a PDF, including region re-scans"""
+    sections = section_store.load(pdf_id)
+    if sections is None:
+        raise HTTPException(status_code=404, detail="No OCR results for this PDF")
+    return {"sections": sections}
+
+
+@app.get("/api/pages/{pdf_id}/{page}")
+async def render_page(pdf_id: str, page: int, http_request: Request, zoom: float = 1.0, format: str = "png"):
+    """
+    Render a page (0-based, as in sections) to PNG or WebP for previews.
+    zoom: scale relative to 72 DPI; a section's pixel coordinates map onto the image by zoom * 72 / section dpi.
+    """
+    file_path = UPLOAD_DIR / f"{pdf_id}.pdf"
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="PDF not found")
+    format = format.lower()
+    try:
+        loop = asyncio.get_event_loop()
+        image_path, media_type = await loop.run_in_executor(
+            None, lambda: page_render_service.render(file_path, page, zoom, format)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        print(f"Page render error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Page rendering failed: {str(e)}")
+    # Uploads never change under the same pdf_id, so renders can be cached indefinitely
+    return await file_download(
+        http_request.headers,
+        image_path,
+        media_type=media_type,
+        filename=f"page_{page + 1}.{format}",
+        immutable=True,
+        disposition="inline"
+    )
+
+
+class PreviewRequest(BaseModel):
+    # "copy" on the wire; the attribute is renamed because BaseModel.copy exists
+    model_config = ConfigDict(populate_by_name=True)
+
+    pdf_id: str
+    rules: List[ReplacementRule]
+    ocr_sections: Optional[List[TextSection]] = None
+    dataset_id: Optional[str] = None
+    seed: Optional[int] = None  # Pass the returned seed to /api/generate to get the same random values
+    copy_number: int = Field(1, alias="copy")  # 1-based copy to preview
+    zoom: float = 1.0  # Scale of the rendered pages relative to 72 DPI
+
+
+@app.post("/api/generate/preview")
+async def preview_generation(request: PreviewRequest):
+    """
+    Dry run of one copy: which search strategy located each rule, the matched rects
+    (PDF points) and fonts, unmatched rules, and PNG renders of the pages that change.
+    The resolved plan is cached, so a following /api/generate with the same rules skips the search.
+    """
+    file_path = UPLOAD_DIR / f"{request.pdf_id}.pdf"
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if request.copy_number < 1:
+        raise HTTPException(status_code=400, detail="copy must be 1 or greater")
+    
+    rules_dict = [rule.model_dump() for rule in request.rules]
+    ocr_sections_dict = [section.model_dump() for section in request.ocr_sections] if request.ocr_sections else None
+    dataset_path = None
+    if request.dataset_id:
+        dataset_path = dataset_service.get_path(request.dataset_id)
+        if not dataset_path:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+    try:
+        CompiledJob(rules_dict).validate_dataset(dataset_service.columns(dataset_path) if dataset_path else None)
+        loop = asyncio.get_event_loop()
+        rows = dataset_service.iter_rows(dataset_path) if dataset_path else None
+        return await loop.run_in_executor(
+            None,
+            lambda: generator_service.preview_copy(
+                file_path,
+                rules_dict,
+                request.copy_number,
+                ocr_sections_dict,
+                rows,
+                request.seed,
+                PageRenderService.normalize_zoom(request.zoom)
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        print(f"Preview Error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Preview failed: {str(e)}")
+
+
 @app.post("/api/generate")
-async def generate_pdfs(request: GenerationRequest):
-    """Generate multiple PDF copies with specified replacements"""
+async def generate_pdfs(request: GenerationRequest, profile: Optional[str] = None, x_profile: Optional[str] = Header(None)):
+    """
+    Generate multiple PDF copies with specified replacements.
+    Supports the same opt-in profiling as /api/ocr; the profile location is
+    returned in the X-Profile-Id and X-Profile-Url response headers.
+    """
+    profiler = start_request_profile("/api/generate", request.pdf_id, profile or x_profile)
+    try:
+        response = await _generate_pdfs(request)
+    finally:
+        summary = finish_request_profile(profiler)
+    if summary:
+        response.headers["X-Profile-Id"] = summary["profile_id"]
+        response.headers["X-Profile-Url"] = f"/api/profiles/{summary['profile_id']}"
+    return response
+
+
+async def _generate_pdfs(request: GenerationRequest):
     try:
         print(f"Generating {request.num_copies} PDF copies for {request.pdf_id}")
         print(f"Rules: {len(request.rules)} replacement rules")
@@ -189,37 +623,110 @@ async def generate_pdfs(request: GenerationRequest):
                 print(f"Error converting OCR sections to dict: {e}")
                 ocr_sections_dict = [section.dict() for section in request.ocr_sections] if request.ocr_sections else None
         
-        # Generate PDFs
-        print("Starting PDF generation...")
-        output_files = await generator_service.generate_pdfs(
-            file_path,
-            rules_dict,
-            request.num_copies,
-            ocr_sections_dict
+        # Resolve the mail-merge dataset, if any; rows are streamed during generation
+        num_copies = request.num_copies
+        dataset_rows = None
+        dataset_path = None
+        if request.dataset_id:
+            dataset_path = dataset_service.get_path(request.dataset_id)
+            if not dataset_path:
+                raise HTTPException(status_code=404, detail="Dataset not found")
+        try:
+            CompiledJob(rules_dict).validate_dataset(dataset_service.columns(dataset_path) if dataset_path else None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if dataset_path:
+            if num_copies <= 0:
+                num_copies = sum(1 for _ in dataset_service.iter_rows(dataset_path))
+            dataset_rows = dataset_service.iter_rows(dataset_path)
+            print(f"Using dataset {request.dataset_id} for up to {num_copies} copies")
+        
+        if request.job_id and not is_valid_job_id(request.job_id):
+            raise HTTPException(status_code=400, detail="job_id may only contain letters, digits, '-' and '_'")
+        
+        job_id = request.job_id or str(uuid.uuid4())
+        if request.distributed if request.distributed is not None else DISTRIBUTED_GENERATION:
+            return _enqueue_job(request, job_id, file_path, rules_dict, ocr_sections_dict, num_copies, dataset_path)
+        cost = generator_service.estimate_cost([file_path], num_copies, len(rules_dict))
+        job_args = dict(
+            pdf_path=file_path,
+            rules=rules_dict,
+            num_copies=num_copies,
+            ocr_sections=ocr_sections_dict,
+            dataset_rows=dataset_rows,
+            job_id=job_id,
+            seed=request.seed,
+            dataset_key=request.dataset_id
         )
-        print(f"Generated {len(output_files)} PDF files")
         
-        # If only 1 copy, return the PDF directly instead of creating a zip
-        if request.num_copies == 1 and len(output_files) == 1:
-            print(f"Only 1 copy generated, returning PDF directly (no zip): {output_files[0]}")
-            if not output_files[0].exists():
-                raise HTTPException(status_code=500, detail=f"Generated PDF file not found: {output_files[0]}")
-            return FileResponse(
-                str(output_files[0]),
-                media_type="application/pdf",
-                filename=f"generated_{request.pdf_id}_copy_1.pdf"
-            )
+        if request.shard or request.background:
+            if job_id in background_jobs:
+                raise HTTPException(status_code=409, detail=f"Job {job_id} is already running")
+            if request.background:
+                try:
+                    admission.check_queue()
+                except AdmissionRejected as e:
+                    # Background jobs queue without a timeout once accepted, so only a full queue turns them away
+                    raise _busy(e)
+            archive = ShardedArchive(OUTPUT_DIR, job_id, request.pdf_id, request.shard_max_copies, request.shard_max_bytes)
+            if request.background:
+                # Run outside the request context so the job is not tied to this request's profile
+                task = asyncio.create_task(_run_background_job(archive, job_args, cost), context=contextvars.Context())
+                background_jobs[job_id] = task
+                task.add_done_callback(lambda _: background_jobs.pop(job_id, None))
+                print(f"Started background job {job_id}")
+                return JSONResponse(status_code=202, content={
+                    "job_id": job_id,
+                    "status": "running",
+                    "status_url": f"/api/jobs/{job_id}",
+                    "manifest_url": f"/api/jobs/{job_id}/manifest",
+                })
+            async with _admitted("generate", cost):
+                manifest = await _run_sharded_job(archive, job_args)
+            if manifest["status"] == "failed" and not manifest["shards"]:
+                raise HTTPException(status_code=500, detail=f"PDF generation failed: {manifest.get('error')}. Resume with job_id={job_id}.")
+            return JSONResponse(content=_manifest_response(manifest))
         
-        # Create zip file with all generated PDFs (for 2+ copies)
-        print("Creating ZIP file...")
-        zip_path = await generator_service.create_zip(output_files, request.pdf_id)
-        print(f"ZIP file created: {zip_path}")
+        async with _admitted("generate", cost):
+            # Generate PDFs
+            print("Starting PDF generation...")
+            result = await generator_service.run_job(**job_args)
+            output_files = result["output_files"]
+            print(f"Generated {len(output_files)} PDF files")
+            job_headers = {"X-Job-Id": result["job_id"], "X-Failed-Copies": str(len(result["errors"]))}
+            if not output_files:
+                detail = result["errors"][0]["error"] if result["errors"] else "no copies were generated"
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"PDF generation failed: {detail}. Resume with job_id={result['job_id']}.",
+                    headers=job_headers
+                )
         
-        return FileResponse(
-            zip_path,
-            media_type="application/zip",
-            filename=f"generated_pdfs_{request.pdf_id}.zip"
-        )
+            # If only 1 copy, return the PDF directly instead of creating a zip
+            if num_copies == 1 and len(output_files) == 1:
+                print(f"Only 1 copy generated, returning PDF directly (no zip): {output_files[0]}")
+                if not output_files[0].exists():
+                    raise HTTPException(status_code=500, detail=f"Generated PDF file not found: {output_files[0]}")
+                return FileResponse(
+                    str(output_files[0]),
+                    media_type="application/pdf",
+                    filename=f"generated_{request.pdf_id}_copy_1.pdf",
+                    headers=job_headers
+                )
+        
+            # Create zip file with all generated PDFs (for 2+ copies)
+            print("Creating ZIP file...")
+            zip_path = await generator_service.create_zip(output_files, request.pdf_id)
+            print(f"ZIP file created: {zip_path}")
+        
+            # The same ZIP can be re-fetched (and resumed with Range) from the GET download endpoint
+            job_headers["Content-Location"] = f"/api/download/{request.pdf_id}/zip"
+            return FileResponse(
+                zip_path,
+                media_type="application/zip",
+                filename=f"generated_pdfs_{request.pdf_id}.zip",
+                headers=job_headers
+            )
     except HTTPException:
         raise
     except Exception as e:
@@ -235,19 +742,318 @@ async def generate_pdfs(request: GenerationRequest):
         )
 
 
-@app.get("/api/download/{pdf_id}/{copy_number}")
-async def download_pdf(pdf_id: str, copy_number: int):
-    """Download a specific generated PDF copy"""
+async def _run_background_job(archive: ShardedArchive, job_args: Dict[str, Any], cost) -> Dict[str, Any]:
+    """A background job was already accepted: it waits for capacity without a timeout"""
+    async with admission.admit("generate", cost, timeout=None, queue_limit=False):
+        return await _run_sharded_job(archive, job_args)
+
+
+async def _run_sharded_job(archive: ShardedArchive, job_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate a job, archiving each chunk into shards as it completes"""
     try:
-        file_path = OUTPUT_DIR / f"{pdf_id}_copy_{copy_number}.pdf"
+        print("Starting sharded PDF generation...")
+        result = await generator_service.run_job(**job_args, on_chunk=archive.add)
+    except Exception as e:
+        import traceback
+        print(f"PDF Generation Error in job {archive.job_id}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return await archive.close(failure=str(e))
+    failure = None
+    if not result["output_files"]:
+        failure = result["errors"][0]["error"] if result["errors"] else "no copies were generated"
+    return await archive.close(result["errors"], failure)
+
+
+def _enqueue_job(request: GenerationRequest, job_id: str, file_path: Path, rules: List[Dict[str, Any]],
+                 ocr_sections: Optional[List[Dict[str, Any]]], num_copies: int, dataset_path: Optional[Path]) -> JSONResponse:
+    """Queue a generation job in chunks for worker.py processes; this process only tracks it"""
+    if num_copies <= 0:
+        raise HTTPException(status_code=400, detail="num_copies must be 1 or greater")
+    spec = {
+        "job_id": job_id,
+        "pdf_id": request.pdf_id,
+        "pdf_path": str(file_path),
+        "rules": rules,
+        "ocr_sections": ocr_sections,
+        "num_copies": num_copies,
+        "seed": request.seed if request.seed is not None else random.SystemRandom().getrandbits(63),
+        "dataset_path": str(dataset_path) if dataset_path else None,
+    }
+    chunks = [
+        (start, min(start + GENERATION_CHUNK_SIZE, num_copies))
+        for start in range(0, num_copies, GENERATION_CHUNK_SIZE)
+    ]
+    if not job_queue.create_job(job_id, spec, chunks):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has already been queued")
+    print(f"Queued job {job_id}: {num_copies} copies in {len(chunks)} chunks")
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": "queued",
+        "chunks": len(chunks),
+        "seed": spec["seed"],
+        "status_url": f"/api/jobs/{job_id}",
+        "manifest_url": f"/api/jobs/{job_id}/manifest",
+    })
+
+
+def _read_manifest(job_id: str) -> Optional[Dict[str, Any]]:
+    """Manifest of a sharded job run here, or of a distributed job assembled from its queued chunks"""
+    manifest = ShardedArchive.read(OUTPUT_DIR, job_id)
+    if manifest is None:
+        manifest = job_queue.manifest(job_id)
+    return manifest
+
+
+def _manifest_response(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Manifest with download links for the shards that are ready"""
+    job_id = manifest["job_id"]
+    shards = [
+        {**shard, "url": f"/api/jobs/{job_id}/shards/{shard['number']}" if shard["status"] == "ready" else None}
+        for shard in manifest["shards"]
+    ]
+    if manifest.get("distributed") or startup.SERVER_WORKERS > 1:
+        # The job may be running in another process
+        running = manifest["status"] == "running"
+    else:
+        running = job_id in background_jobs
+    return {**manifest, "shards": shards, "running": running}
+
+
+class BatchTemplate(BaseModel):
+    pdf_id: str
+    rules: List[ReplacementRule]
+    ocr_sections: Optional[List[TextSection]] = None
+    name: Optional[str] = None  # Folder of this template's copies in the ZIP (defaults to pdf_id)
+
+
+class BatchGenerationRequest(BaseModel):
+    templates: List[BatchTemplate]
+    num_copies: int  # With a dataset: maximum number of rows to use (0 = all rows)
+    dataset_id: Optional[str] = None  # One row per copy, shared by every template
+    seed: Optional[int] = None
+
+
+@app.post("/api/generate/batch")
+async def generate_batch(request: BatchGenerationRequest):
+    """
+    Generate copies of several templates from the same records into a single ZIP.
+    Copy N of every template uses dataset row N, the same serial numbers and, for
+    random rules with a "field", the same random value, so the documents of one
+    record match. Each template's copies go into their own folder of the archive.
+    """
+    if not request.templates:
+        raise HTTPException(status_code=400, detail="At least one template is required")
+    
+    dataset_path = None
+    if request.dataset_id:
+        dataset_path = dataset_service.get_path(request.dataset_id)
+        if not dataset_path:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+    available_columns = dataset_service.columns(dataset_path) if dataset_path else None
+    
+    templates = []
+    names = set()
+    for template in request.templates:
+        file_path = UPLOAD_DIR / f"{template.pdf_id}.pdf"
         if not file_path.exists():
+            raise HTTPException(status_code=404, detail=f"PDF not found: {template.pdf_id}")
+        rules_dict = [rule.model_dump() for rule in template.rules]
+        try:
+            CompiledJob(rules_dict).validate_dataset(available_columns)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Template {template.pdf_id}: {str(e)}")
+        # Folder names must be unique and safe inside the archive
+        base_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in (template.name or template.pdf_id)).strip(".") or "template"
+        name = base_name
+        suffix = 2
+        while name in names:
+            name = f"{base_name}_{suffix}"
+            suffix += 1
+        names.add(name)
+        templates.append({
+            "name": name,
+            "pdf_path": file_path,
+            "rules": rules_dict,
+            "ocr_sections": [section.model_dump() for section in template.ocr_sections] if template.ocr_sections else None,
+        })
+    
+    num_copies = request.num_copies
+    dataset_rows = None
+    if dataset_path:
+        if num_copies <= 0:
+            num_copies = sum(1 for _ in dataset_service.iter_rows(dataset_path))
+        dataset_rows = dataset_service.iter_rows(dataset_path)
+    if num_copies <= 0:
+        raise HTTPException(status_code=400, detail="num_copies must be 1 or greater")
+    
+    cost = generator_service.estimate_cost(
+        [template["pdf_path"] for template in templates], num_copies,
+        sum(len(template["rules"]) for template in templates), batch=True
+    )
+    async with _admitted("batch", cost):
+        try:
+            result = await generator_service.generate_batch(templates, num_copies, dataset_rows, request.seed)
+        except Exception as e:
+            import traceback
+            print(f"Batch Generation Error: {str(e)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail=f"Batch generation failed: {str(e)}")
+    
+    headers = {
+        "X-Batch-Id": result["batch_id"],
+        "X-Failed-Copies": str(len(result["errors"])),
+        "X-Seed": str(result["seed"]),
+    }
+    if not result["files"]:
+        detail = result["errors"][0]["error"] if result["errors"] else "no copies were generated"
+        raise HTTPException(status_code=500, detail=f"Batch generation failed: {detail}", headers=headers)
+    return FileResponse(
+        result["zip_path"],
+        media_type="application/zip",
+        filename=f"batch_{result['batch_id']}.zip",
+        headers=headers
+    )
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Progress of a generation job: completed copy ranges and per-copy errors"""
+    if not is_valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+    data = JobCheckpoint.read(OUTPUT_DIR, job_id)
+    if data is None:
+        # Distributed jobs have no checkpoint; their progress is aggregated over the queued chunks
+        data = job_queue.summary(job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Only errors inside completed ranges were counted there; failed chunks (distributed jobs)
+    # and the chunk still in progress list their copies as errors without completing them
+    failed_in_completed = sum(
+        1 for copy in data["errors"] if any(start <= int(copy) < stop for start, stop in data["completed"])
+    )
+    completed = sum(stop - start for start, stop in data["completed"]) - failed_in_completed
+    response = {
+        "job_id": job_id,
+        "status": data["status"],
+        "num_copies": data["num_copies"],
+        "completed_copies": completed,
+        "completed_ranges": [[start + 1, stop] for start, stop in data["completed"]],
+        "errors": [{"copy": int(copy) + 1, "error": error} for copy, error in sorted(data["errors"].items(), key=lambda e: int(e[0]))],
+        "resumed": data.get("resumed", 0),
+    }
+    if "chunks" in data:
+        response["chunks"] = data["chunks"]
+        response["workers"] = data["workers"]
+    return response
+
+
+@app.get("/api/jobs/{job_id}/manifest")
+async def get_job_manifest(job_id: str):
+    """Shards of a sharded job; poll it to download shards as soon as they are ready"""
+    if not is_valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+    manifest = _read_manifest(job_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No sharded output for this job")
+    return _manifest_response(manifest)
+
+
+@app.get("/api/jobs/{job_id}/shards/{shard_number}")
+async def download_shard(job_id: str, shard_number: int, http_request: Request):
+    """Download one ZIP shard of a sharded job (resumable, immutable once the job has completed)"""
+    if not is_valid_job_id(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+    manifest = _read_manifest(job_id)
+    shard = next((s for s in (manifest or {}).get("shards", []) if s["number"] == shard_number), None)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="Shard not found")
+    if shard["status"] != "ready":
+        raise HTTPException(status_code=409, detail=f"Shard {shard_number} is {shard['status']}")
+    if not (OUTPUT_DIR / shard["file"]).exists():
+        raise HTTPException(status_code=410, detail=f"Shard {shard_number} has expired")
+    return await file_download(
+        http_request.headers,
+        OUTPUT_DIR / shard["file"],
+        media_type="application/zip",
+        filename=f"generated_pdfs_{manifest['pdf_id']}_part_{shard_number}.zip",
+        immutable=manifest["status"] == "completed"
+    )
+
+
+@app.get("/api/download/{pdf_id}/zip")
+async def download_zip(pdf_id: str, http_request: Request):
+    """Download (or resume downloading) the ZIP of the last /api/generate run for a PDF"""
+    try:
+        zip_path = OUTPUT_DIR / f"generated_{pdf_id}.zip"
+        if not zip_path.exists():
+            raise HTTPException(status_code=404, detail="ZIP not found")
+        
+        return await file_download(
+            http_request.headers,
+            zip_path,
+            media_type="application/zip",
+            filename=f"generated_pdfs_{pdf_id}.zip"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/download/{pdf_id}/{copy_number}")
+async def download_pdf(pdf_id: str, copy_number: int, http_request: Request, job_id: Optional[str] = None):
+    """
+    Download a specific generated PDF copy.
+    Copies are stored per job; pass job_id (the X-Job-Id of the generate response)
+    to pick a job, otherwise the copy from the latest job on this PDF that has it is returned.
+    """
+    try:
+        if job_id is not None and not is_valid_job_id(job_id):
+            raise HTTPException(status_code=400, detail="Invalid job_id")
+        if not is_valid_job_id(pdf_id):
+            raise HTTPException(status_code=404, detail="PDF copy not found")
+        if job_id is not None:
+            file_path = generator_service.job_dir(job_id) / f"{pdf_id}_copy_{copy_number}.pdf"
+        else:
+            file_path = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: generator_service.latest_copy(pdf_id, copy_number)
+            )
+        if file_path is None or not file_path.exists():
             raise HTTPException(status_code=404, detail="PDF copy not found")
         
-        return FileResponse(
+        return await file_download(
+            http_request.headers,
             file_path,
             media_type="application/pdf",
             filename=f"copy_{copy_number}.pdf"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """Return the summary (stage timings and hottest functions) of a saved request profile"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    summary_path = profile_artifact_path(profile_id, "json")
+    if not summary_path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return JSONResponse(json.loads(summary_path.read_text()))
+
+
+@app.get("/api/profiles/{profile_id}/{artifact}")
+async def download_profile(profile_id: str, artifact: str):
+    """Download a profile artifact: prof (pstats), txt (report), collapsed (flamegraph stacks) or json"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    artifact_path = profile_artifact_path(profile_id, artifact)
+    if not artifact_path:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(
+        artifact_path,
+        media_type="application/json" if artifact == "json" else "application/octet-stream",
+        filename=f"profile_{profile_id}.{artifact}"
+    )
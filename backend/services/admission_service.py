@@ -0,0 +1,356 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from services.shared_store import cached, digest
+from services.startup import lazy_module, SERVER_WORKERS
+
+fitz = lazy_module("fitz")
+PYMUPDF_AVAILABLE = fitz is not None
+PyPDF2 = lazy_module("PyPDF2")
+
+MB = 1024 * 1024
+
+# Set to false to run every request immediately, as before
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+# Fraction of the container (or machine) memory that admitted requests may reserve together
+ADMISSION_MEMORY_FRACTION = float(os.getenv("ADMISSION_MEMORY_FRACTION", "0.6"))
+# Requests waiting for capacity beyond this are rejected with 503 straight away
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "16"))
+# Seconds a request may wait for capacity before it is rejected with 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "60"))
+# Wait times kept for the percentiles in stats()
+ADMISSION_WAIT_SAMPLES = 200
+
+# Rough per-request costs beyond the page rasters and parsed templates
+OCR_BASE_BYTES = 64 * MB          # Tesseract model and working set
+GENERATION_BASE_BYTES = 32 * MB
+# Tesseract's own buffers for the page being recognized, per raster pixel
+TESSERACT_BYTES_PER_PIXEL = 4
+# A parsed PDF (PyMuPDF document, fonts, text dictionaries) relative to its file size
+PDF_PARSE_FACTOR = 6
+# Memory of one generation worker process (interpreter plus PyMuPDF)
+WORKER_PROCESS_BYTES = 80 * MB
+# Value columns held per copy of a chunk, per rule
+VALUE_BYTES_PER_RULE = 128
+# US Letter, used when page sizes cannot be read
+DEFAULT_PAGE_POINTS = (612.0, 792.0)
+# Bytes per pixel of a page raster by OCR raster mode ("binary" is thresholded from a grayscale render)
+RASTER_BYTES_PER_PIXEL = {"rgb": 3, "gray": 1, "binary": 1.125}
+
+
+def _container_memory() -> Optional[int]:
+    """The cgroup memory limit (v2 or v1), or the machine's physical memory"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            value = Path(path).read_text().strip()
+        except OSError:
+            continue
+        # "max" or a huge number means no limit is set
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_memory_budget() -> int:
+    """This process's share of the memory budget (ADMISSION_MEMORY_MB is per process)"""
+    configured = os.getenv("ADMISSION_MEMORY_MB")
+    if configured:
+        return int(float(configured) * MB)
+    total = _container_memory()
+    return int(total * ADMISSION_MEMORY_FRACTION / SERVER_WORKERS) if total else 2048 * MB // SERVER_WORKERS
+
+
+def default_cpu_budget() -> float:
+    """This process's share of the CPU slots (ADMISSION_CPU_SLOTS is per process)"""
+    configured = os.getenv("ADMISSION_CPU_SLOTS")
+    if configured:
+        return float(configured)
+    # Requests spend part of their time in I/O and the tesseract subprocess, so allow some overlap
+    return float(max(2, 2 * (os.cpu_count() or 1) // SERVER_WORKERS))
+
+
+class Cost:
+    """What a request is expected to hold while it runs: bytes of memory and CPU slots"""
+
+    __slots__ = ("memory", "cpu", "detail")
+
+    def __init__(self, memory: int, cpu: float, detail: Optional[Dict] = None):
+        self.memory = int(memory)
+        self.cpu = float(cpu)
+        self.detail = detail or {}
+
+    def to_dict(self) -> Dict:
+        return {"memory_mb": round(self.memory / MB, 1), "cpu": self.cpu, **self.detail}
+
+
+def page_sizes(pdf_path: Path) -> List[Tuple[float, float]]:
+    """Page sizes in PDF points, read once per file version for all server processes"""
+    sizes, _ = cached(
+        "page_sizes", digest(str(pdf_path)), Path(pdf_path), lambda: _read_page_sizes(pdf_path),
+        decode=lambda sizes: [tuple(size) for size in sizes]
+    )
+    return sizes
+
+
+def _read_page_sizes(pdf_path: Path) -> List[Tuple[float, float]]:
+    """Reads only the page tree, not the content"""
+    try:
+        if PYMUPDF_AVAILABLE:
+            doc = fitz.open(str(pdf_path))
+            try:
+                return [(page.rect.width, page.rect.height) for page in doc]
+            finally:
+                doc.close()
+        reader = PyPDF2.PdfReader(str(pdf_path))
+        return [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages]
+    except Exception as e:
+        print(f"Could not read page sizes of {pdf_path}: {e}")
+        return [DEFAULT_PAGE_POINTS]
+
+
+def estimate_ocr(pdf_path: Path, base_dpi: int, peak_dpi: int, raster_mode: str, workers: int,
+                 pages_in_memory: Optional[int] = None) -> Cost:
+    """
+    OCR holds up to `pages_in_memory` pages (all if None) rendered at `base_dpi`, plus one
+    page re-rendered at up to `peak_dpi` (small text, low-confidence retries) with
+    Tesseract's buffers for it.
+    """
+    sizes = page_sizes(pdf_path)
+    bytes_per_pixel = RASTER_BYTES_PER_PIXEL.get(raster_mode, 3)
+
+    def pixels(size, dpi):
+        return (size[0] / 72.0 * dpi) * (size[1] / 72.0 * dpi)
+
+    held = sorted((pixels(size, base_dpi) for size in sizes), reverse=True)[:pages_in_memory]
+    rasters = sum(held) * bytes_per_pixel
+    largest = max(sizes, key=lambda size: size[0] * size[1])
+    peak = pixels(largest, peak_dpi) * (bytes_per_pixel + TESSERACT_BYTES_PER_PIXEL)
+    return Cost(
+        OCR_BASE_BYTES + rasters + peak,
+        min(max(1, workers), len(sizes)),
+        {"pages": len(sizes), "dpi": base_dpi},
+    )
+
+
+def estimate_generation(template_paths: List[Path], num_copies: int, num_rules: int,
+                        workers: int, chunk_size: int) -> Cost:
+    """
+    Generation holds each parsed template (once per worker process when rendering on a
+    pool), a few rendered copies in flight and the value columns of one chunk of copies.
+    """
+    template_bytes = sum(Path(path).stat().st_size for path in template_paths)
+    largest = max(Path(path).stat().st_size for path in template_paths)
+    processes = max(0, workers)
+    copies_in_memory = min(num_copies, chunk_size)
+    memory = (
+        GENERATION_BASE_BYTES
+        + template_bytes * PDF_PARSE_FACTOR * max(1, processes)
+        + processes * WORKER_PROCESS_BYTES
+        + largest * 2 * max(2, 2 * processes)
+        + copies_in_memory * num_rules * VALUE_BYTES_PER_RULE
+    )
+    return Cost(memory, max(1, processes), {"templates": len(template_paths), "copies": num_copies})
+
+
+class AdmissionRejected(Exception):
+    """No capacity for a request: the queue is full or it waited too long"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    __slots__ = ("kind", "memory", "cpu", "requested_memory", "queued_at", "admitted_at")
+
+    def __init__(self, kind: str, cost: Cost, memory: int, cpu: float):
+        self.kind = kind
+        self.requested_memory = cost.memory
+        self.memory = memory
+        self.cpu = cpu
+        self.queued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+
+    @property
+    def waited(self) -> float:
+        return (self.admitted_at or time.monotonic()) - self.queued_at
+
+
+class AdmissionController:
+    """
+    Reserves each OCR or generation request's estimated memory and CPU from a global
+    budget before it runs.
+
+    Requests that do not fit wait in a FIFO queue; only the head of the queue is admitted
+    as capacity frees up, so a large request is not starved by a stream of small ones.
+    A request larger than the whole budget is clamped to it, i.e. it runs alone.
+    When ADMISSION_MAX_QUEUE requests are already waiting, or a request waits longer than
+    its timeout, AdmissionRejected is raised (served as 503 with Retry-After).
+    All methods run on the event loop thread.
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None, cpu_budget: Optional[float] = None,
+                 max_queue: int = ADMISSION_MAX_QUEUE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 enabled: bool = ADMISSION_CONTROL):
+        self.memory_budget = memory_budget or default_memory_budget()
+        self.cpu_budget = cpu_budget or default_cpu_budget()
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self.memory_in_use = 0
+        self.cpu_in_use = 0.0
+        self._running: List[Reservation] = []
+        self._waiters: Deque[Tuple[Reservation, asyncio.Future]] = deque()
+        self._waits: Deque[float] = deque(maxlen=ADMISSION_WAIT_SAMPLES)
+        self._counts = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        print(f"Admission control {'enabled' if enabled else 'disabled'}: "
+              f"{self.memory_budget / MB:.0f} MB, {self.cpu_budget:g} CPU slots, queue of {max_queue}")
+
+    def _fits(self, reservation: Reservation) -> bool:
+        if not self._running:
+            return True
+        return (self.memory_in_use + reservation.memory <= self.memory_budget
+                and self.cpu_in_use + reservation.cpu <= self.cpu_budget)
+
+    def _start(self, reservation: Reservation):
+        reservation.admitted_at = time.monotonic()
+        self.memory_in_use += reservation.memory
+        self.cpu_in_use += reservation.cpu
+        self._running.append(reservation)
+        self._counts["admitted"] += 1
+        self._waits.append(reservation.waited)
+
+    def _admit_waiters(self):
+        while self._waiters:
+            reservation, future = self._waiters[0]
+            if future.done():
+                # Gave up (timeout or cancelled) while queued
+                self._waiters.popleft()
+                continue
+            if not self._fits(reservation):
+                return
+            self._waiters.popleft()
+            self._start(reservation)
+            future.set_result(reservation)
+
+    def check_queue(self):
+        """Raise AdmissionRejected if a new request could not even be queued"""
+        if self.enabled and len(self._waiters) >= self.max_queue:
+            self._counts["rejected_queue_full"] += 1
+            raise AdmissionRejected(
+                f"Server is busy: {len(self._waiters)} requests already waiting", self._retry_after()
+            )
+
+    async def acquire(self, kind: str, cost: Cost, timeout: Optional[float] = -1.0,
+                      queue_limit: bool = True) -> Reservation:
+        """
+        Reserve `cost`, waiting in the queue if needed.
+        timeout: seconds to wait (default ADMISSION_QUEUE_TIMEOUT, None to wait indefinitely)
+        queue_limit: False to queue even when ADMISSION_MAX_QUEUE requests are waiting
+                     (for work that was already accepted, like background jobs)
+        """
+        reservation = Reservation(
+            kind, cost, min(cost.memory, self.memory_budget), min(cost.cpu, self.cpu_budget)
+        )
+        if not self.enabled:
+            reservation.admitted_at = reservation.queued_at
+            return reservation
+        if not self._waiters and self._fits(reservation):
+            self._start(reservation)
+            return reservation
+        if queue_limit:
+            self.check_queue()
+        if timeout is not None and timeout < 0:
+            timeout = self.queue_timeout
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((reservation, future))
+        self._counts["queued"] += 1
+        print(f"Admission: queued {kind} request ({cost.memory / MB:.0f} MB, {cost.cpu:g} CPU); "
+              f"{len(self._waiters)} waiting, {self.memory_in_use / MB:.0f}/{self.memory_budget / MB:.0f} MB in use")
+        try:
+            done, _pending = await asyncio.wait({future}, timeout=timeout)
+        except BaseException:
+            # Cancelled while queued (e.g. the client went away)
+            if future.done() and not future.cancelled():
+                self.release(reservation)
+            else:
+                future.cancel()
+                self._admit_waiters()
+            raise
+        if not done:
+            future.cancel()
+            self._counts["rejected_timeout"] += 1
+            # The head may have been this request: let the next one in if it fits
+            self._admit_waiters()
+            raise AdmissionRejected(
+                f"Server is busy: no capacity within {timeout:g}s", self._retry_after()
+            )
+        print(f"Admission: started {kind} request after waiting {reservation.waited:.2f}s")
+        return reservation
+
+    def release(self, reservation: Reservation):
+        if reservation not in self._running:
+            return
+        self._running.remove(reservation)
+        self.memory_in_use -= reservation.memory
+        self.cpu_in_use -= reservation.cpu
+        self._admit_waiters()
+
+    @asynccontextmanager
+    async def admit(self, kind: str, cost: Cost, timeout: Optional[float] = -1.0, queue_limit: bool = True):
+        """Hold a reservation for the duration of the block"""
+        reservation = await self.acquire(kind, cost, timeout, queue_limit)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+    def _retry_after(self) -> int:
+        """Seconds a rejected client should wait: the median recent wait, at least 1"""
+        waits = sorted(self._waits)
+        return max(1, int(round(waits[len(waits) // 2]))) if waits else 5
+
+    def stats(self) -> Dict:
+        """Budget usage, queue depth and wait times"""
+        waits = sorted(self._waits)
+
+        def percentile(fraction):
+            return round(waits[min(len(waits) - 1, int(len(waits) * fraction))], 3) if waits else None
+
+        now = time.monotonic()
+        queued = [reservation for reservation, future in self._waiters if not future.done()]
+        return {
+            "enabled": self.enabled,
+            "memory_budget_mb": round(self.memory_budget / MB, 1),
+            "memory_in_use_mb": round(self.memory_in_use / MB, 1),
+            "cpu_budget": self.cpu_budget,
+            "cpu_in_use": self.cpu_in_use,
+            "running": [
+                {"kind": r.kind, "memory_mb": round(r.memory / MB, 1), "cpu": r.cpu,
+                 "seconds": round(now - r.admitted_at, 3)}
+                for r in self._running
+            ],
+            "queue_depth": len(queued),
+            "queue": [
+                {"kind": r.kind, "memory_mb": round(r.requested_memory / MB, 1), "cpu": r.cpu,
+                 "waiting_seconds": round(now - r.queued_at, 3)}
+                for r in queued
+            ],
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "wait_seconds": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(waits[-1], 3) if waits else None,
+                "samples": len(waits),
+            },
+            **self._counts,
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from services import profiling_service
+from services.download_service import content_etag
+
+# Limits for one archive of a sharded job; a shard is closed when either is reached (0 = no limit)
+ZIP_SHARD_MAX_COPIES = int(os.getenv("ZIP_SHARD_MAX_COPIES", "1000"))
+ZIP_SHARD_MAX_BYTES = int(os.getenv("ZIP_SHARD_MAX_BYTES", str(512 * 1024 * 1024)))
+# Shards are compressed concurrently; zlib releases the GIL, so threads scale
+ZIP_SHARD_WORKERS = int(os.getenv("ZIP_SHARD_WORKERS", "4"))
+
+_shard_executor = ThreadPoolExecutor(max_workers=max(1, ZIP_SHARD_WORKERS), thread_name_prefix="zip-shard")
+
+
+def write_zip(zip_path: Path, pdf_files: List[Path]) -> Path:
+    """Write PDFs into a ZIP file, replacing it atomically once complete"""
+    # Unique per writer: two jobs may build the same "last ZIP" of a template at once
+    tmp_path = zip_path.with_name(f"{zip_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for pdf_file in pdf_files:
+                if pdf_file.exists():
+                    zipf.write(pdf_file, pdf_file.name)
+                else:
+                    print(f"  Warning: File not found: {pdf_file}")
+        os.replace(tmp_path, zip_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return zip_path
+
+
+class ShardedArchive:
+    """
+    Splits the output of a generation job into several ZIP archives.
+
+    Copies are added in order as chunks finish. A shard is closed once it holds
+    `max_copies` copies or its PDFs exceed `max_bytes`, and is then compressed in
+    a worker thread while generation continues, so early shards can be
+    downloaded before the job is done. The manifest (`{job_id}.manifest.json`)
+    is rewritten whenever a shard changes state.
+    """
+
+    def __init__(self, directory: Path, job_id: str, pdf_id: str,
+                 max_copies: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.directory = Path(directory)
+        self.job_id = job_id
+        self.max_copies = ZIP_SHARD_MAX_COPIES if max_copies is None else max_copies
+        self.max_bytes = ZIP_SHARD_MAX_BYTES if max_bytes is None else max_bytes
+        self.path = self.directory / f"{job_id}.manifest.json"
+        self.manifest = {
+            "job_id": job_id,
+            "pdf_id": pdf_id,
+            "status": "running",
+            "max_copies": self.max_copies,
+            "max_bytes": self.max_bytes,
+            "shards": [],
+            "errors": [],
+            "created_at": time.time(),
+        }
+        self._open: List[Tuple[int, Path]] = []
+        self._open_bytes = 0
+        self._builds = []
+        self._lock = threading.Lock()
+        self.save()
+
+    @classmethod
+    def read(cls, directory: Path, job_id: str) -> Optional[Dict]:
+        """Manifest of a job, or None if it was not sharded"""
+        path = Path(directory) / f"{job_id}.manifest.json"
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    @classmethod
+    def shard_path(cls, directory: Path, job_id: str, number: int) -> Path:
+        return Path(directory) / f"{job_id}_part_{number:04d}.zip"
+
+    def add(self, files: List[Tuple[int, Path]]):
+        """Add generated copies as (0-based copy index, path), closing shards as limits are reached"""
+        for copy_num, path in files:
+            size = path.stat().st_size
+            if self._open and (
+                (self.max_copies and len(self._open) >= self.max_copies)
+                or (self.max_bytes and self._open_bytes + size > self.max_bytes)
+            ):
+                self._seal()
+            self._open.append((copy_num, path))
+            self._open_bytes += size
+        if self.max_copies and len(self._open) >= self.max_copies:
+            self._seal()
+
+    def _seal(self):
+        """Close the open shard and start compressing it in the background"""
+        files = self._open
+        number = len(self.manifest["shards"]) + 1
+        shard = {
+            "number": number,
+            "file": self.shard_path(self.directory, self.job_id, number).name,
+            "first_copy": files[0][0] + 1,
+            "last_copy": files[-1][0] + 1,
+            "copies": len(files),
+            "pdf_bytes": self._open_bytes,
+            "size": None,
+            "status": "building",
+        }
+        with self._lock:
+            self.manifest["shards"].append(shard)
+        self.save()
+        self._open = []
+        self._open_bytes = 0
+        print(f"Building shard {number} of job {self.job_id}: copies {shard['first_copy']}-{shard['last_copy']}")
+        loop = asyncio.get_event_loop()
+        self._builds.append(loop.run_in_executor(
+            _shard_executor,
+            profiling_service.bind(self._build),
+            shard,
+            [path for _, path in files]
+        ))
+
+    def _build(self, shard: Dict, pdf_files: List[Path]):
+        zip_path = self.directory / shard["file"]
+        try:
+            with profiling_service.stage("generate.zip"):
+                write_zip(zip_path, pdf_files)
+                # Hash now so the first download does not have to
+                content_etag(zip_path)
+            with self._lock:
+                shard["size"] = zip_path.stat().st_size
+                shard["status"] = "ready"
+            print(f"Shard {shard['number']} of job {self.job_id} ready: {zip_path} ({shard['size']} bytes)")
+        except Exception as e:
+            import traceback
+            print(f"Error building shard {shard['number']} of job {self.job_id}: {str(e)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            with self._lock:
+                shard["status"] = "failed"
+                shard["error"] = str(e)
+        self.save()
+
+    async def close(self, errors: Optional[List[Dict]] = None, failure: Optional[str] = None) -> Dict:
+        """Seal the last shard, wait for all shards to be written and finalize the manifest"""
+        if self._open:
+            self._seal()
+        if self._builds:
+            await asyncio.gather(*self._builds)
+        with self._lock:
+            self.manifest["errors"] = errors or []
+            if failure:
+                self.manifest["status"] = "failed"
+                self.manifest["error"] = failure
+            elif any(shard["status"] != "ready" for shard in self.manifest["shards"]):
+                self.manifest["status"] = "failed"
+            else:
+                self.manifest["status"] = "completed_with_errors" if errors else "completed"
+            self.manifest["updated_at"] = time.time()
+        self.save()
+        return self.manifest
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.manifest, f)
+            # Atomic rename so manifest readers never see a partial file
+            os.replace(tmp_path, self.path)
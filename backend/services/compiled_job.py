@@ -0,0 +1,203 @@
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _make_formatter(fmt: Optional[str], prefix: Optional[str], suffix: Optional[str]) -> Callable[[int], str]:
+    """Build the value -> text function for a rule once, instead of re-reading the rule per value"""
+    prefix = prefix or ""
+    suffix = suffix or ""
+    if not fmt:
+        return lambda value: f"{prefix}{value}{suffix}"
+
+    def format_value(value: int) -> str:
+        try:
+            formatted = fmt % value
+        except Exception:
+            formatted = str(value)
+        return f"{prefix}{formatted}{suffix}"
+
+    return format_value
+
+
+def _make_text_formatter(fmt: Optional[str], prefix: Optional[str], suffix: Optional[str]) -> Callable[[str], str]:
+    """Like _make_formatter, for text values from a dataset; numeric formats apply to numeric text"""
+    prefix = prefix or ""
+    suffix = suffix or ""
+    if not fmt:
+        return lambda value: f"{prefix}{value}{suffix}"
+
+    def format_value(value: str) -> str:
+        try:
+            formatted = fmt % value
+        except Exception:
+            try:
+                formatted = fmt % int(value)
+            except Exception:
+                try:
+                    formatted = fmt % float(value)
+                except Exception:
+                    formatted = value
+        return f"{prefix}{formatted}{suffix}"
+
+    return format_value
+
+
+class CompiledRule:
+    """A replacement rule resolved once per job: defaults applied and value generator chosen"""
+
+    __slots__ = ("index", "section_id", "original_text", "rule_type", "start_value",
+                 "random_min", "random_max", "dataset_column", "field", "format_value", "column")
+
+    def __init__(self, index: int, rule: Dict):
+        self.index = index
+        self.section_id = rule.get("section_id") or ""
+        self.original_text = rule.get("original_text") or ""
+        self.rule_type = rule.get("type") or "serial"
+        # Explicit nulls from the API mean "use the default" just like missing keys
+        start_value = rule.get("start_value")
+        self.start_value = 1 if start_value is None else start_value
+        random_min = rule.get("random_min")
+        random_max = rule.get("random_max")
+        self.random_min = 1 if random_min is None else random_min
+        self.random_max = 100 if random_max is None else random_max
+        self.dataset_column = rule.get("column")
+        # Rules naming the same field share one random value per copy (across templates in a batch)
+        self.field = rule.get("field") or None
+        make_formatter = _make_text_formatter if self.rule_type == "dataset" else _make_formatter
+        self.format_value = make_formatter(rule.get("format"), rule.get("prefix"), rule.get("suffix"))
+        # Dispatch on rule type happens here, once, rather than for every copy
+        if self.rule_type == "dataset":
+            self.column = self._dataset_column
+        elif self.rule_type == "random":
+            self.column = self._random_column
+        elif self.rule_type == "serial":
+            self.column = self._serial_column
+        elif self.rule_type == "custom":
+            # Custom rules have no generator of their own yet and number copies like serial rules
+            print(f"  Rule {index} ('{self.original_text}'): type 'custom' falls back to serial values from {self.start_value}")
+            self.column = self._serial_column
+        else:
+            print(f"  Rule {index} ('{self.original_text}'): unknown type '{self.rule_type}', leaving the text unchanged")
+            self.column = self._empty_column
+
+    def _serial_column(self, start: int, stop: int, rng: random.Random, rows: Optional[List[Dict]]) -> List[str]:
+        format_value = self.format_value
+        first = self.start_value
+        return [format_value(first + copy_index) for copy_index in range(start, stop)]
+
+    def _random_column(self, start: int, stop: int, rng: random.Random, rows: Optional[List[Dict]]) -> List[str]:
+        format_value = self.format_value
+        randint = rng.randint
+        low, high = self.random_min, self.random_max
+        return [format_value(randint(low, high)) for _ in range(start, stop)]
+
+    def random_values(self, start: int, stop: int, rng: random.Random) -> List[int]:
+        """Unformatted random values, for sharing between rules of the same field"""
+        randint = rng.randint
+        low, high = self.random_min, self.random_max
+        return [randint(low, high) for _ in range(start, stop)]
+
+    def _dataset_column(self, start: int, stop: int, rng: random.Random, rows: Optional[List[Dict]]) -> List[str]:
+        # Empty cells produce no replacement, leaving the original text in place
+        format_value = self.format_value
+        column = self.dataset_column
+        values = []
+        for row in rows or ():
+            value = row.get(column, "")
+            values.append(format_value(value) if value != "" else "")
+        return values
+
+    def _empty_column(self, start: int, stop: int, rng: random.Random, rows: Optional[List[Dict]]) -> List[str]:
+        return [""] * (stop - start)
+
+
+class CompiledJob:
+    """
+    A generation request compiled once per batch.
+
+    Rules become CompiledRule objects, OCR coordinates are matched to rules once
+    instead of for every copy, and per-copy values are produced as columns
+    (one list per rule over a range of copies) rather than per-copy dicts.
+    """
+
+    def __init__(self, rules: List[Dict], ocr_sections: Optional[List[Dict]] = None):
+        self.rules = [CompiledRule(i, rule) for i, rule in enumerate(rules)]
+        # Rules without a target text can never produce a replacement
+        self.active_rules = [rule for rule in self.rules if rule.original_text]
+        self.texts: Tuple[str, ...] = tuple(rule.original_text for rule in self.active_rules)
+        self.ocr_coords = self._match_sections(ocr_sections) if ocr_sections else None
+
+    def _match_sections(self, ocr_sections: List[Dict]) -> Dict[str, Dict]:
+        """Map each rule's original text to the bounding box of its OCR section"""
+        by_id = {}
+        by_text = {}
+        for section in ocr_sections:
+            if section.get("id") is not None:
+                by_id.setdefault(section["id"], section)
+            by_text.setdefault(section.get("text", "").strip(), section)
+
+        ocr_coords = {}
+        for rule in self.rules:
+            original_text = rule.original_text
+            # Find matching OCR section
+            section = by_id.get(rule.section_id) if rule.section_id else None
+            if section is None:
+                section = by_text.get(original_text.strip())
+            if section is None:
+                continue
+            ocr_coords[original_text] = {
+                "x": section.get("x", 0),
+                "y": section.get("y", 0),
+                "width": section.get("width", 100),
+                "height": section.get("height", 20),
+                "page": section.get("page", 0),
+                "dpi": section.get("dpi")
+            }
+            print(f"  Found OCR coordinates for '{original_text}': page {section.get('page', 0)}, ({section.get('x', 0)}, {section.get('y', 0)})")
+        return ocr_coords
+
+    @property
+    def dataset_columns(self) -> List[str]:
+        """Dataset columns referenced by "dataset" rules"""
+        return [rule.dataset_column for rule in self.rules if rule.rule_type == "dataset"]
+
+    def validate_dataset(self, available_columns: Optional[List[str]]):
+        """Raise ValueError if dataset rules cannot be satisfied by a dataset with these columns"""
+        needed = self.dataset_columns
+        if not needed:
+            return
+        if available_columns is None:
+            raise ValueError("Rules of type 'dataset' require a dataset_id")
+        missing = [column for column in needed if not column or column not in available_columns]
+        if missing:
+            raise ValueError(f"Dataset has no column(s) {missing}. Available columns: {available_columns}")
+
+    def value_columns(self, start: int, stop: int, rng: random.Random, rows: Optional[List[Dict]] = None,
+                      shared: Optional[Dict[str, List[int]]] = None) -> List[List[str]]:
+        """
+        Values for copies [start, stop): one column per active rule.
+        rows: the dataset rows of those copies, for "dataset" rules
+        shared: raw values of random rules with a "field", by field name; pass the same
+                dict for every template of a batch so they all get the same values
+        """
+        if shared is None:
+            shared = {}
+        columns = []
+        for rule in self.active_rules:
+            if rule.field and rule.rule_type == "random":
+                values = shared.get(rule.field)
+                if values is None:
+                    values = shared[rule.field] = rule.random_values(start, stop, rng)
+                columns.append([rule.format_value(value) for value in values])
+            else:
+                columns.append(rule.column(start, stop, rng, rows))
+        return columns
+
+    def replacements(self, columns: List[List[str]], offset: int) -> Dict[str, str]:
+        """Replacement map of one copy, `offset` rows into a value_columns() batch"""
+        replacements = {}
+        for text, column in zip(self.texts, columns):
+            value = column[offset]
+            if value:
+                replacements[text] = value
+        return replacements
@@ -0,0 +1,571 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Patch simple text operators in the page content stream instead of redacting and re-inserting
+CONTENT_STREAM_REWRITE = os.getenv("CONTENT_STREAM_REWRITE", "true").lower() in ("1", "true", "yes")
+# Parsed content streams kept in memory, keyed by their bytes (every copy of a template parses the same pages)
+CONTENT_PARSE_CACHE_SIZE = 64
+
+# Search strategies whose match is the literal text, so it can be found in the content stream as-is
+REWRITE_STRATEGIES = ("exact", "ocr_coordinates")
+
+_TOKEN = re.compile(
+    rb"(?P<ws>[ \t\r\n\f\x00]+)"
+    rb"|(?P<comment>%[^\r\n]*)"
+    rb"|(?P<name>/[^ \t\r\n\f\x00()<>\[\]{}/%]*)"
+    rb"|(?P<dict><<|>>)"
+    rb"|(?P<hex><[0-9A-Fa-f \t\r\n\f\x00]*>)"
+    rb"|(?P<delim>[\[\]{}])"
+    rb"|(?P<word>[^ \t\r\n\f\x00()<>\[\]{}/%]+)"
+    rb"|(?P<string>\()"
+)
+_NUMBER = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+_STRING_SPECIAL = re.compile(rb"[()\\]")
+_INLINE_IMAGE_END = re.compile(rb"[ \t\r\n\f\x00]EI(?=[ \t\r\n\f\x00]|$)")
+_NAME_ESCAPE = re.compile(rb"#([0-9A-Fa-f]{2})")
+_OCTAL = re.compile(rb"[0-7]{1,3}")
+_LITERAL_ESCAPES = {
+    ord("n"): 0x0A, ord("r"): 0x0D, ord("t"): 0x09, ord("b"): 0x08, ord("f"): 0x0C,
+    ord("("): 0x28, ord(")"): 0x29, ord("\\"): 0x5C,
+}
+
+# Base-14 text fonts: without /Encoding they use StandardEncoding and every viewer has their glyphs
+STANDARD_14_TEXT_FONTS = {
+    "Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique",
+    "Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic",
+    "Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique",
+}
+# PDF base encodings -> Python codecs for the single-byte codes of simple fonts
+_ENCODINGS = {
+    "WinAnsiEncoding": "cp1252",
+    "MacRomanEncoding": "mac_roman",
+    "StandardEncoding": "standard",
+}
+_SYMBOLIC_FLAG = 4
+
+
+def tokenize(data: bytes) -> List[Tuple[str, int, int]]:
+    """
+    Split a content stream into (kind, start, end) tokens. Kinds: "string", "hex",
+    "name", "number" (also true/false/null), "op", "[", "]", "<<", ">>", "{", "}",
+    "inline" (inline image data) and "other" for stray bytes. Whitespace and
+    comments are skipped.
+    """
+    tokens = []
+    pos = 0
+    size = len(data)
+    match = _TOKEN.match
+    while pos < size:
+        m = match(data, pos)
+        if m is None:
+            tokens.append(("other", pos, pos + 1))
+            pos += 1
+            continue
+        kind = m.lastgroup
+        start, end = m.span()
+        if kind == "string":
+            end = _string_end(data, start)
+            tokens.append(("string", start, end))
+        elif kind == "word":
+            word = data[start:end]
+            if _NUMBER.fullmatch(word) or word in (b"true", b"false", b"null"):
+                tokens.append(("number", start, end))
+            else:
+                tokens.append(("op", start, end))
+                if word == b"ID":
+                    # Binary image data follows a single whitespace byte, up to "EI"
+                    found = _INLINE_IMAGE_END.search(data, end + 1)
+                    stop = found.start() if found else size
+                    tokens.append(("inline", end + 1, stop))
+                    end = stop
+        elif kind in ("name", "hex"):
+            tokens.append((kind, start, end))
+        elif kind in ("dict", "delim"):
+            tokens.append((data[start:end].decode("latin-1"), start, end))
+        pos = end
+    return tokens
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """End offset of the literal string starting at `start` (balanced parentheses, backslash escapes)"""
+    depth = 0
+    pos = start
+    search = _STRING_SPECIAL.search
+    while True:
+        m = search(data, pos)
+        if m is None:
+            return len(data)
+        char = data[m.start()]
+        if char == 0x5C:
+            pos = m.start() + 2
+            continue
+        depth += 1 if char == 0x28 else -1
+        pos = m.start() + 1
+        if depth == 0:
+            return pos
+
+
+def literal_value(raw: bytes) -> bytes:
+    """Bytes of a literal string token, "(...)" included"""
+    body = raw[1:-1] if raw.endswith(b")") else raw[1:]
+    if b"\\" not in body and b"\r" not in body:
+        return body
+    out = bytearray()
+    i = 0
+    size = len(body)
+    while i < size:
+        char = body[i]
+        if char == 0x5C:
+            i += 1
+            if i >= size:
+                break
+            char = body[i]
+            if char in _LITERAL_ESCAPES:
+                out.append(_LITERAL_ESCAPES[char])
+                i += 1
+            elif 0x30 <= char <= 0x37:
+                digits = _OCTAL.match(body, i).group()
+                out.append(int(digits, 8) & 0xFF)
+                i += len(digits)
+            elif char == 0x0D:
+                # Line continuation
+                i += 2 if body[i + 1:i + 2] == b"\n" else 1
+            elif char == 0x0A:
+                i += 1
+            else:
+                # Unknown escapes drop the backslash
+                out.append(char)
+                i += 1
+        elif char == 0x0D:
+            # End-of-line in a string reads as \n
+            out.append(0x0A)
+            i += 2 if body[i + 1:i + 2] == b"\n" else 1
+        else:
+            out.append(char)
+            i += 1
+    return bytes(out)
+
+
+def hex_value(raw: bytes) -> bytes:
+    """Bytes of a hex string token, "<...>" included"""
+    digits = re.sub(rb"[^0-9A-Fa-f]", b"", raw)
+    if len(digits) % 2:
+        digits += b"0"
+    return bytes.fromhex(digits.decode("ascii"))
+
+
+def literal_token(value: bytes) -> bytes:
+    escaped = value.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"\\r")
+    return b"(" + escaped + b")"
+
+
+def hex_token(value: bytes) -> bytes:
+    return b"<" + value.hex().upper().encode("ascii") + b">"
+
+
+def _name(raw: bytes) -> str:
+    """Resource name of a /Name token, with #xx escapes decoded"""
+    return _NAME_ESCAPE.sub(lambda m: bytes([int(m.group(1), 16)]), raw[1:]).decode("latin-1")
+
+
+class SimpleFontCodec:
+    """
+    Maps text to the one-byte codes of a simple font with a standard encoding,
+    and tells whether the font can show a text at all.
+    widths: (FirstChar, Widths) from the font dictionary; codes outside the range or
+            with zero width have no glyph (typical of subset fonts)
+    glyph_check: optional text -> bool test against the embedded font program
+    """
+
+    def __init__(self, encoding: str, widths: Optional[Tuple[int, List[float]]] = None,
+                 glyph_check: Optional[Callable[[str], bool]] = None):
+        self.encoding = encoding
+        self.widths = widths
+        self.glyph_check = glyph_check
+        self._supported: Dict[str, bool] = {}
+
+    def decode(self, data: bytes) -> str:
+        """Text of `data`, one character per byte; codes without a known character become U+FFFD"""
+        if self.encoding == "standard":
+            # StandardEncoding matches ASCII except for the quote characters
+            return "".join(
+                chr(code) if 0x20 <= code < 0x7F and code not in (0x27, 0x60) else "\ufffd"
+                for code in data
+            )
+        return data.decode(self.encoding, errors="replace")
+
+    def encode(self, text: str) -> Optional[bytes]:
+        """Codes for `text`, or None if a character is not in the encoding"""
+        if self.encoding == "standard":
+            if all(0x20 <= ord(char) < 0x7F and char not in "'`" for char in text):
+                return text.encode("ascii")
+            return None
+        try:
+            return text.encode(self.encoding)
+        except UnicodeEncodeError:
+            return None
+
+    def supports(self, text: str) -> bool:
+        """Whether `text` can be encoded and every character has a glyph in the font"""
+        supported = self._supported.get(text)
+        if supported is None:
+            codes = self.encode(text)
+            supported = codes is not None and self._has_widths(codes)
+            if supported and self.glyph_check is not None:
+                supported = self.glyph_check(text)
+            self._supported[text] = supported
+        return supported
+
+    def _has_widths(self, codes: bytes) -> bool:
+        if self.widths is None:
+            return True
+        first_char, widths = self.widths
+        for code in set(codes):
+            index = code - first_char
+            if code != 0x20 and not (0 <= index < len(widths) and widths[index] > 0):
+                return False
+        return True
+
+
+def codec_for_font(subtype: Optional[str], base_font: Optional[str], encoding: Optional[str],
+                   has_differences: bool, flags: Optional[int], embedded: bool,
+                   widths: Optional[Tuple[int, List[float]]] = None,
+                   glyph_check: Optional[Callable[[str], bool]] = None) -> Optional[SimpleFontCodec]:
+    """
+    A codec for a font dictionary's properties, or None if its codes cannot be
+    rewritten safely: composite (Type0) and Type3 fonts, symbolic fonts, custom
+    /Differences and built-in encodings of embedded or non-standard fonts.
+    encoding: the /Encoding name, or its /BaseEncoding when /Encoding is a dictionary
+    """
+    if subtype not in ("Type1", "TrueType", "MMType1"):
+        return None
+    if has_differences or (flags is not None and flags & _SYMBOLIC_FLAG):
+        return None
+    if encoding is None:
+        base_name = (base_font or "").split("+", 1)[-1]
+        if subtype != "TrueType" and not embedded and base_name in STANDARD_14_TEXT_FONTS:
+            encoding = "StandardEncoding"
+        else:
+            return None
+    python_encoding = _ENCODINGS.get(encoding)
+    if python_encoding is None:
+        return None
+    return SimpleFontCodec(python_encoding, widths, glyph_check)
+
+
+def fitz_font_codec(doc, holder: Optional[int], resource_name: str, font_cache=None) -> Optional[SimpleFontCodec]:
+    """codec_for_font() for the font `resource_name` in the /Resources of PyMuPDF object `holder`"""
+    if holder is None:
+        return None
+    kind, value = doc.xref_get_key(holder, f"Resources/Font/{resource_name}")
+    if kind != "xref":
+        return None
+    xref = int(value.split()[0])
+
+    def key(path):
+        kind, value = doc.xref_get_key(xref, path)
+        return None if kind == "null" else (kind, value)
+
+    subtype = key("Subtype")
+    base_font = key("BaseFont")
+    encoding = key("Encoding")
+    has_differences = False
+    if encoding is not None and encoding[0] == "name":
+        encoding_name = encoding[1].lstrip("/")
+    elif encoding is not None:
+        base_encoding = key("Encoding/BaseEncoding")
+        encoding_name = base_encoding[1].lstrip("/") if base_encoding else None
+        has_differences = key("Encoding/Differences") is not None
+    else:
+        encoding_name = None
+    flags = key("FontDescriptor/Flags")
+    embedded = any(key(f"FontDescriptor/{entry}") for entry in ("FontFile", "FontFile2", "FontFile3"))
+    widths = None
+    first_char = key("FirstChar")
+    width_array = key("Widths")
+    if first_char and width_array:
+        source = width_array[1]
+        if width_array[0] == "xref":
+            source = doc.xref_object(int(source.split()[0]), compressed=True)
+        widths = (int(first_char[1]), [float(w) for w in _NUMBER.findall(source.encode("latin-1"))])
+    glyph_check = None
+    if embedded:
+        if font_cache is None:
+            return None
+        glyph_check = lambda text: font_cache.embedded_has_glyphs(xref, text)
+    return codec_for_font(
+        subtype[1].lstrip("/") if subtype else None,
+        base_font[1].lstrip("/") if base_font else None,
+        encoding_name,
+        has_differences,
+        int(flags[1]) if flags else None,
+        embedded,
+        widths,
+        glyph_check,
+    )
+
+
+def pypdf2_font_codec(font) -> Optional[SimpleFontCodec]:
+    """codec_for_font() for a PyPDF2 font dictionary; without a font program loader only /Widths are checked"""
+    if font is None:
+        return None
+    font = font.get_object()
+    encoding = font.get("/Encoding")
+    has_differences = False
+    encoding_name = None
+    if encoding is not None:
+        encoding = encoding.get_object()
+        if isinstance(encoding, str):
+            encoding_name = encoding.lstrip("/")
+        else:
+            base_encoding = encoding.get("/BaseEncoding")
+            encoding_name = str(base_encoding).lstrip("/") if base_encoding else None
+            has_differences = "/Differences" in encoding
+    descriptor = font.get("/FontDescriptor")
+    descriptor = descriptor.get_object() if descriptor is not None else {}
+    flags = descriptor.get("/Flags")
+    embedded = any(entry in descriptor for entry in ("/FontFile", "/FontFile2", "/FontFile3"))
+    widths = None
+    if "/FirstChar" in font and "/Widths" in font:
+        widths = (int(font["/FirstChar"]), [float(w) for w in font["/Widths"].get_object()])
+    if embedded and widths is None:
+        return None
+    subtype = font.get("/Subtype")
+    base_font = font.get("/BaseFont")
+    return codec_for_font(
+        str(subtype).lstrip("/") if subtype else None,
+        str(base_font).lstrip("/") if base_font else None,
+        encoding_name,
+        has_differences,
+        int(flags) if flags is not None else None,
+        embedded,
+        widths,
+    )
+
+
+class _Show:
+    """One text-showing operator: its operand's location and string/kerning items"""
+
+    __slots__ = ("part", "start", "end", "font", "array", "items", "dirty")
+
+    def __init__(self, part: int, start: int, end: int, font: Optional[str], array: bool, items):
+        self.part = part
+        self.start = start
+        self.end = end
+        self.font = font
+        self.array = array
+        # [kind, value]: kind "string"/"hex" with the string's bytes, or "number" with the raw token
+        self.items = [list(item) for item in items]
+        self.dirty = False
+
+    def find(self, codec: SimpleFontCodec, old_text: str) -> List[Tuple[int, int, int, int]]:
+        """
+        Occurrences of `old_text` in the shown text as (first item, offset, last item, end offset),
+        including ones that span several strings of a TJ array
+        """
+        text = []
+        owners = []
+        for index, (kind, value) in enumerate(self.items):
+            if kind == "number":
+                continue
+            text.append(codec.decode(value))
+            owners.extend((index, offset) for offset in range(len(value)))
+        text = "".join(text)
+        occurrences = []
+        pos = text.find(old_text)
+        while pos != -1:
+            first, offset = owners[pos]
+            last, end_offset = owners[pos + len(old_text) - 1]
+            occurrences.append((first, offset, last, end_offset + 1))
+            pos = text.find(old_text, pos + len(old_text))
+        return occurrences
+
+    def replace(self, occurrences: List[Tuple[int, int, int, int]], codes: bytes):
+        # Right to left, so earlier item indices stay valid
+        for first, offset, last, end_offset in reversed(occurrences):
+            head = self.items[first][1][:offset]
+            tail = self.items[last][1][end_offset:]
+            self.items[first][1] = head + codes + tail
+            # Strings and kerning inside the occurrence collapse into the first string
+            del self.items[first + 1:last + 1]
+        self.dirty = True
+
+    def serialize(self) -> bytes:
+        tokens = []
+        for kind, value in self.items:
+            if kind == "number":
+                tokens.append(value)
+            elif kind == "hex":
+                tokens.append(hex_token(value))
+            else:
+                tokens.append(literal_token(value))
+        if self.array:
+            return b"[" + b" ".join(tokens) + b"]"
+        return tokens[0]
+
+
+def _parse(parts: Tuple[bytes, ...]) -> List[Tuple]:
+    """Text-showing operators of a page's content streams, with the font selected for each"""
+    shows = []
+    font = None
+    saved = []
+    for part_index, data in enumerate(parts):
+        operands = []
+        for token in tokenize(data):
+            kind, start, end = token
+            if kind != "op":
+                operands.append(token)
+                continue
+            op = data[start:end]
+            if op == b"Tf":
+                if len(operands) >= 2 and operands[-2][0] == "name":
+                    font = _name(data[operands[-2][1]:operands[-2][2]])
+            elif op == b"q":
+                saved.append(font)
+            elif op == b"Q":
+                if saved:
+                    font = saved.pop()
+            elif op in (b"Tj", b"'", b'"'):
+                if operands and operands[-1][0] in ("string", "hex"):
+                    kind, start, end = operands[-1]
+                    shows.append((part_index, start, end, font, False, (_item(data, kind, start, end),)))
+            elif op == b"TJ":
+                show = _parse_array(data, operands)
+                if show is not None:
+                    start, end, items = show
+                    shows.append((part_index, start, end, font, True, items))
+            operands = []
+    return shows
+
+
+def _parse_array(data: bytes, operands: List[Tuple[str, int, int]]) -> Optional[Tuple[int, int, Tuple]]:
+    if not operands or operands[-1][0] != "]":
+        return None
+    for open_index in range(len(operands) - 1, -1, -1):
+        if operands[open_index][0] == "[":
+            break
+    else:
+        return None
+    elements = operands[open_index + 1:-1]
+    if any(kind not in ("string", "hex", "number") for kind, _start, _end in elements):
+        return None
+    items = tuple(_item(data, kind, start, end) for kind, start, end in elements)
+    return operands[open_index][1], operands[-1][2], items
+
+
+def _item(data: bytes, kind: str, start: int, end: int) -> Tuple[str, bytes]:
+    raw = data[start:end]
+    if kind == "string":
+        return kind, literal_value(raw)
+    if kind == "hex":
+        return kind, hex_value(raw)
+    return kind, raw
+
+
+_parse_cache: "OrderedDict[Tuple[bytes, ...], List[Tuple]]" = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+
+def parse_shows(parts: Tuple[bytes, ...]) -> List[Tuple]:
+    """_parse() with a small cache: each copy of a template has the same content streams"""
+    with _parse_cache_lock:
+        shows = _parse_cache.get(parts)
+        if shows is not None:
+            _parse_cache.move_to_end(parts)
+            return shows
+    shows = _parse(parts)
+    with _parse_cache_lock:
+        _parse_cache[parts] = shows
+        while len(_parse_cache) > CONTENT_PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return shows
+
+
+class TextRewriter:
+    """
+    Replaces text by editing the string operands of Tj, TJ, ' and " operators in a
+    page's content streams. The original font, size, position and colour stay as
+    they are. Only simple fonts with a standard encoding are handled (see
+    codec_for_font), and only when the font has glyphs for the new text;
+    anything else is left for redaction.
+
+    parts: the page's decoded content streams, in order
+    codec_for: resource name of a font -> SimpleFontCodec, or None if it cannot be rewritten
+    """
+
+    def __init__(self, parts: List[bytes], codec_for: Callable[[str], Optional[SimpleFontCodec]]):
+        self.parts = list(parts)
+        self._codec_for = codec_for
+        self._codecs: Dict[Optional[str], Optional[SimpleFontCodec]] = {}
+        self._shows = [_Show(*show) for show in parse_shows(tuple(self.parts))]
+
+    def _codec(self, font: Optional[str]) -> Optional[SimpleFontCodec]:
+        if font not in self._codecs:
+            codec = None
+            if font is not None:
+                try:
+                    codec = self._codec_for(font)
+                except Exception as e:
+                    print(f"    Could not read font /{font}: {e}")
+            self._codecs[font] = codec
+        return self._codecs[font]
+
+    def replace(self, old_text: str, new_text: str, expected: Optional[int] = None) -> int:
+        """
+        Replace `old_text` wherever it is shown in a rewritable font; returns the number of
+        occurrences replaced. With `expected`, nothing is changed (and 0 returned) unless
+        exactly that many occurrences are found and all of them can be rewritten.
+        """
+        if not old_text:
+            return 0
+        found = []
+        unsupported = 0
+        for show in self._shows:
+            codec = self._codec(show.font)
+            if codec is None:
+                continue
+            occurrences = show.find(codec, old_text)
+            if not occurrences:
+                continue
+            if codec.supports(new_text):
+                found.append((show, occurrences, codec.encode(new_text)))
+            else:
+                unsupported += len(occurrences)
+        count = sum(len(occurrences) for _show, occurrences, _codes in found)
+        if expected is not None and (unsupported or count != expected):
+            return 0
+        for show, occurrences, codes in found:
+            show.replace(occurrences, codes)
+        return count
+
+    def changed_parts(self) -> Dict[int, bytes]:
+        """New bytes of each content stream that has replaced text, by position in `parts`"""
+        changed = {}
+        for part_index, data in enumerate(self.parts):
+            shows = [show for show in self._shows if show.part == part_index and show.dirty]
+            if not shows:
+                continue
+            pieces = []
+            pos = 0
+            for show in shows:
+                pieces.append(data[pos:show.start])
+                pieces.append(show.serialize())
+                pos = show.end
+            pieces.append(data[pos:])
+            changed[part_index] = b"".join(pieces)
+        return changed
+
+
+def shared_content_streams(doc) -> set:
+    """Content stream xrefs used by more than one page of a PyMuPDF document; editing those would change other pages"""
+    seen = set()
+    shared = set()
+    for page in doc:
+        for xref in page.get_contents():
+            if xref in seen:
+                shared.add(xref)
+            seen.add(xref)
+    return shared
@@ -0,0 +1,35 @@
+from typing import Dict, Tuple
+
+# Rasterization DPI assumed for sections that do not record their own (older clients)
+DEFAULT_OCR_DPI = 200
+
+# PDF user space is 72 points per inch
+POINTS_PER_INCH = 72.0
+
+
+def pixels_to_points(value: float, dpi: float) -> float:
+    """Convert a length in OCR pixels at `dpi` to PDF points"""
+    return value * POINTS_PER_INCH / dpi
+
+
+def points_to_pixels(value: float, dpi: float) -> float:
+    """Convert a length in PDF points to pixels at `dpi`"""
+    return value * dpi / POINTS_PER_INCH
+
+
+def section_dpi(section: Dict) -> float:
+    """DPI a section's pixel coordinates were measured at"""
+    return section.get("dpi") or DEFAULT_OCR_DPI
+
+
+def section_rect_points(section: Dict) -> Tuple[float, float, float, float]:
+    """
+    Bounding box of an OCR section as (x0, top, x1, bottom) in PDF points,
+    measured from the top-left corner of the page like the OCR pixels are.
+    """
+    scale = POINTS_PER_INCH / section_dpi(section)
+    x0 = section.get("x", 0) * scale
+    top = section.get("y", 0) * scale
+    x1 = x0 + section.get("width", 100) * scale
+    bottom = top + section.get("height", 20) * scale
+    return x0, top, x1, bottom
@@ -0,0 +1,107 @@
+import csv
+import json
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Supported dataset formats, by file extension
+DATASET_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+# Bytes copied per read when saving an upload
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class DatasetService:
+    """Stores uploaded CSV/JSONL datasets and streams their rows for mail-merge generation"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+
+    async def save_upload(self, upload) -> Dict:
+        """Stream an UploadFile to disk without holding it in memory"""
+        suffix = Path(upload.filename or "").suffix.lower()
+        if suffix not in DATASET_FORMATS:
+            raise ValueError(f"Unsupported dataset type '{suffix}'. Use one of: {', '.join(DATASET_FORMATS)}")
+        dataset_id = str(uuid.uuid4())
+        path = self.directory / f"{dataset_id}{'.csv' if DATASET_FORMATS[suffix] == 'csv' else '.jsonl'}"
+        with open(path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+        try:
+            columns = self.columns(path)
+            if DATASET_FORMATS[path.suffix] == "jsonl":
+                # Every record is checked now, so a bad one fails the upload instead of a generation job
+                for _row in self.iter_rows(path):
+                    pass
+        except Exception:
+            path.unlink(missing_ok=True)
+            raise
+        print(f"Saved dataset {dataset_id} ({path.stat().st_size} bytes, columns: {columns})")
+        return {"dataset_id": dataset_id, "format": DATASET_FORMATS[path.suffix], "columns": columns}
+
+    def get_path(self, dataset_id: str) -> Optional[Path]:
+        """Locate a saved dataset by id; ids are UUIDs, anything else is rejected before touching the filesystem"""
+        try:
+            if str(uuid.UUID(dataset_id)) != dataset_id:
+                return None
+        except (ValueError, TypeError, AttributeError):
+            return None
+        for suffix in (".csv", ".jsonl"):
+            path = self.directory / f"{dataset_id}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def columns(self, path: Path) -> List[str]:
+        """Column names: the CSV header, or the keys of the first JSONL record"""
+        if DATASET_FORMATS[path.suffix] == "csv":
+            with open(path, "r", newline="", encoding="utf-8-sig") as f:
+                header = next(csv.reader(f), None)
+            if not header:
+                raise ValueError("CSV dataset has no header row")
+            return [name.strip() for name in header]
+        for row in self.iter_rows(path):
+            return list(row.keys())
+        raise ValueError("JSONL dataset has no records")
+
+    def iter_rows(self, path: Path) -> Iterator[Dict[str, str]]:
+        """
+        Yield dataset rows one at a time as column -> string value dicts.
+        The file is read lazily, so memory use does not depend on its size.
+        The first JSONL record's keys are the columns: later records may leave some
+        out (they read as ""), but a key the first record lacks raises ValueError.
+        """
+        if DATASET_FORMATS[path.suffix] == "csv":
+            with open(path, "r", newline="", encoding="utf-8-sig") as f:
+                reader = csv.reader(f)
+                header = [name.strip() for name in next(reader, [])]
+                for values in reader:
+                    if not any(values):
+                        continue
+                    yield dict(zip(header, values))
+            return
+        columns = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON on line {line_number} of dataset: {e}")
+                if not isinstance(record, dict):
+                    raise ValueError(f"Line {line_number} of dataset is not a JSON object")
+                if columns is None:
+                    columns = list(record.keys())
+                else:
+                    unknown = [key for key in record if key not in columns]
+                    if unknown:
+                        raise ValueError(
+                            f"Line {line_number} of dataset has key(s) {unknown} that the first record does not have. "
+                            f"Every record must use the first record's keys: {columns}"
+                        )
+                yield {key: "" if record.get(key) is None else str(record[key]) for key in columns}
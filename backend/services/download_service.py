@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+# Cache-Control for outputs that never change once written (e.g. shards of a completed job)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Outputs that may be regenerated under the same URL: cacheable, but revalidated with the ETag
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag_sidecar(path: Path) -> Path:
+    return path.with_name(path.name + ".etag")
+
+
+def content_etag(path: Path) -> str:
+    """
+    Strong ETag from the SHA-256 of a file's content.
+    The hash is cached in a sidecar file and reused while the size and mtime are unchanged,
+    so large archives are only hashed once.
+    """
+    path = Path(path)
+    stat = path.stat()
+    sidecar = _etag_sidecar(path)
+    try:
+        with open(sidecar, "r") as f:
+            cached = json.load(f)
+        if cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+            return cached["etag"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()}"'
+    try:
+        tmp_path = sidecar.with_name(sidecar.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "etag": etag}, f)
+        os.replace(tmp_path, sidecar)
+    except OSError as e:
+        print(f"Warning: Could not cache ETag for {path.name}: {e}")
+    return etag
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Match an If-None-Match (weak comparison) or If-Range (strong comparison) header"""
+    if not weak:
+        # If-Range holds one entity tag (or a date, which never matches); weak tags never match strongly
+        return header.strip() == etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header into an inclusive (start, end) pair.
+    Returns None when the header is absent, malformed or asks for several ranges
+    (the whole file is sent then), and raises ValueError when it is unsatisfiable.
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = size - 1 if last == "" else min(int(last), size - 1)
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _content_disposition(filename: str, disposition: str = "attachment") -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+def _iter_file_range(path: Path, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def file_download(
+    request_headers,
+    path: Path,
+    media_type: str,
+    filename: str,
+    immutable: bool = False,
+    headers: Optional[Dict[str, str]] = None,
+    disposition: str = "attachment"
+) -> Response:
+    """
+    FileResponse with HTTP caching and resumable downloads:
+    - strong ETag from the content hash, 304 for a matching If-None-Match
+    - Accept-Ranges with single byte ranges (206/416), honouring If-Range
+    - Cache-Control: immutable for outputs that never change, revalidate otherwise
+    """
+    path = Path(path)
+    loop = asyncio.get_event_loop()
+    etag = await loop.run_in_executor(None, content_etag, path)
+    stat = path.stat()
+    response_headers = dict(headers or {})
+    response_headers.update({
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+    })
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag, weak=True):
+        return Response(status_code=304, headers=response_headers)
+
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and if_range and not _etag_matches(if_range, etag, weak=False):
+        # The client's partial copy is stale: send the whole new file
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except ValueError:
+        response_headers["Content-Range"] = f"bytes */{stat.st_size}"
+        return Response(status_code=416, headers=response_headers)
+
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, filename=filename, headers=response_headers,
+                            content_disposition_type=disposition)
+
+    start, end = byte_range
+    response_headers.update({
+        "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": _content_disposition(filename, disposition),
+    })
+    return StreamingResponse(
+        _iter_file_range(path, start, end),
+        status_code=206,
+        media_type=media_type,
+        headers=response_headers
+    )
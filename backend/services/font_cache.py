@@ -0,0 +1,195 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.startup import lazy_module
+
+fitz = lazy_module("fitz")
+PYMUPDF_AVAILABLE = fitz is not None
+
+# Base-14 fallbacks keyed by (family, bold, italic)
+BASE14_FONTS = {
+    ("helv", False, False): "helv",
+    ("helv", True, False): "hebo",
+    ("helv", False, True): "heit",
+    ("helv", True, True): "hebi",
+    ("tiro", False, False): "tiro",
+    ("tiro", True, False): "tibo",
+    ("tiro", False, True): "tiit",
+    ("tiro", True, True): "tibi",
+    ("cour", False, False): "cour",
+    ("cour", True, False): "cobo",
+    ("cour", False, True): "coit",
+    ("cour", True, True): "cobi",
+}
+BASE14_NAMES = set(BASE14_FONTS.values())
+
+# Font program formats that fitz.Font can load for glyph checks and re-embedding
+EMBEDDABLE_EXTENSIONS = ("ttf", "otf", "cff", "cid", "pfa", "pfb")
+
+
+def _normalize_font_name(name: str) -> str:
+    """Compare font names without subset tags ("ABCDEF+"), spacing or punctuation"""
+    if "+" in name:
+        name = name.split("+", 1)[1]
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def base14_for(font_name: str) -> str:
+    """Closest Base-14 font for an arbitrary font name"""
+    name = font_name.lower()
+    if name in BASE14_NAMES:
+        return name
+    bold = any(tag in name for tag in ("bold", "black", "heavy", "semibold", "demi"))
+    italic = any(tag in name for tag in ("italic", "oblique"))
+    if any(tag in name for tag in ("courier", "mono", "consol", "typewriter")):
+        family = "cour"
+    elif any(tag in name for tag in ("times", "roman", "serif", "georgia", "garamond", "cambria", "minion")) and "sans" not in name:
+        family = "tiro"
+    else:
+        family = "helv"
+    return BASE14_FONTS[(family, bold, italic)]
+
+
+class FontCache:
+    """
+    Per-document font bookkeeping for inserted text.
+
+    - The text dictionary of each page (used to find the original span fonts)
+      is extracted once per page instead of once per replacement instance.
+    - Original span fonts are mapped to the font used for the new text: the
+      document's own embedded font when it has glyphs for the new text
+      (subset fonts often do not), otherwise the closest Base-14 font.
+      Embedded Type0 fonts are used through the page's existing resource.
+    - Each inserted font is added to the document once; other pages get a
+      reference to the same font object in their resources instead of a copy.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._text_dicts: Dict[int, Dict] = {}
+        self._page_fonts: Dict[int, Dict[str, Tuple[int, str, str]]] = {}
+        self._font_programs: Dict[int, Optional["fitz.Font"]] = {}
+        self._font_buffers: Dict[int, bytes] = {}
+        self._glyphs: Dict[Tuple[int, str], bool] = {}
+        self._registered: Dict[str, int] = {}
+        self._linked: Set[Tuple[int, str]] = set()
+
+    def text_dict(self, page) -> Dict:
+        """page.get_text("dict") computed once per page"""
+        if page.number not in self._text_dicts:
+            self._text_dicts[page.number] = page.get_text("dict")
+        return self._text_dicts[page.number]
+
+    def spans(self, page) -> List[Dict]:
+        """All text spans of a page, from the cached text dictionary"""
+        return [
+            span
+            for block in self.text_dict(page).get("blocks", [])
+            for line in block.get("lines", [])
+            for span in line.get("spans", [])
+        ]
+
+    def _fonts_on_page(self, page) -> Dict[str, Tuple[int, str, str]]:
+        """Normalized base font name -> (xref, font type, resource name) for fonts used by a page"""
+        if page.number not in self._page_fonts:
+            fonts = {}
+            for xref, _ext, font_type, basefont, refname, _encoding in page.get_fonts():
+                fonts.setdefault(_normalize_font_name(basefont), (xref, font_type, refname))
+            self._page_fonts[page.number] = fonts
+        return self._page_fonts[page.number]
+
+    def _font_program(self, xref: int) -> Optional["fitz.Font"]:
+        """Load an embedded font program once per document"""
+        if xref not in self._font_programs:
+            font = None
+            try:
+                _name, ext, _type, buffer = self.doc.extract_font(xref)
+                if buffer and ext in EMBEDDABLE_EXTENSIONS:
+                    font = fitz.Font(fontbuffer=buffer)
+                    self._font_buffers[xref] = buffer
+            except Exception as e:
+                print(f"    Could not load embedded font {xref}: {e}")
+            self._font_programs[xref] = font
+        return self._font_programs[xref]
+
+    def _has_glyphs(self, xref: int, font: "fitz.Font", text: str) -> bool:
+        for char in set(text):
+            key = (xref, char)
+            if key not in self._glyphs:
+                self._glyphs[key] = char.isspace() or bool(font.has_glyph(ord(char)))
+            if not self._glyphs[key]:
+                return False
+        return True
+
+    def embedded_has_glyphs(self, xref: int, text: str) -> bool:
+        """Whether the embedded program of font `xref` has glyphs for `text` (False if it cannot be loaded)"""
+        font = self._font_program(xref)
+        return font is not None and self._has_glyphs(xref, font, text)
+
+    def fontname_for(self, page, span_font: Optional[str], text: str) -> str:
+        """
+        Return a font name usable with page.insert_text for `text`, replacing
+        text originally set in `span_font`, and make sure it is available on the page.
+        """
+        span_font = span_font or "helv"
+        if span_font.lower() not in BASE14_NAMES:
+            embedded = self._fonts_on_page(page).get(_normalize_font_name(span_font))
+            if embedded:
+                xref, font_type, refname = embedded
+                font = self._font_program(xref)
+                if font is not None and self._has_glyphs(xref, font, text):
+                    if font_type == "Type0":
+                        # Identity-H fonts address glyphs directly, so the page's own
+                        # font resource can be written with directly: no new objects at all
+                        return refname
+                    # Simple fonts are tied to their encoding: embed the program once as a new font
+                    alias = f"R{xref}"
+                    self._ensure(page, alias, fontbuffer=self._font_buffers[xref])
+                    return alias
+                print(f"    Embedded font '{span_font}' lacks glyphs for '{text}', using Base-14 fallback")
+        alias = base14_for(span_font)
+        self._ensure(page, alias)
+        return alias
+
+    def _ensure(self, page, alias: str, fontbuffer: Optional[bytes] = None):
+        """Insert a font into the document once, then reference it from other pages"""
+        if (page.number, alias) in self._linked:
+            return
+        xref = self._registered.get(alias)
+        if xref is None:
+            if fontbuffer is not None:
+                xref = page.insert_font(fontname=alias, fontbuffer=fontbuffer)
+            else:
+                xref = page.insert_font(fontname=alias)
+            self._registered[alias] = xref
+        elif not self._link_font(page, alias, xref):
+            # Resources are inherited or unusual: let PyMuPDF add the font to this page
+            if fontbuffer is not None:
+                page.insert_font(fontname=alias, fontbuffer=fontbuffer)
+            else:
+                page.insert_font(fontname=alias)
+        self._linked.add((page.number, alias))
+
+    def _link_font(self, page, alias: str, xref: int) -> bool:
+        """Add an existing font object to a page's /Font resources"""
+        doc = self.doc
+        try:
+            kind, value = doc.xref_get_key(page.xref, "Resources")
+            if kind == "xref":
+                owner, path = int(value.split()[0]), "Font"
+            elif kind == "dict":
+                owner, path = page.xref, "Resources/Font"
+            else:
+                return False
+            kind, value = doc.xref_get_key(owner, path)
+            if kind == "xref":
+                owner, key = int(value.split()[0]), alias
+            elif kind in ("dict", "null"):
+                key = f"{path}/{alias}"
+            else:
+                return False
+            doc.xref_set_key(owner, key, f"{xref} 0 R")
+            return True
+        except Exception as e:
+            print(f"    Could not link font {alias} to page {page.number + 1}: {e}")
+            return False
@@ -1,131 +1,521 @@
-import random
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Iterator, Optional, Tuple
+from itertools import islice
+import hashlib
+import json
+import base64
+import os
+import random
+import uuid
 import zipfile
 import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from services.pdf_service import PDFService
+from services.admission_service import Cost, estimate_generation
+from services.compiled_job import CompiledJob
+from services.job_checkpoint import GENERATION_CHUNK_SIZE, JobCheckpoint, chunk_rng
+from services.archive_service import ShardedArchive, write_zip
+from services.download_service import content_etag
+from services import profiling_service
+from services.startup import lazy_module, SERVER_WORKERS
+
+fitz = lazy_module("fitz")  # Renders preview pages
+PYMUPDF_AVAILABLE = fitz is not None
+
+# Worker processes for multi-template batches (0 = render in threads of this process);
+# by default the CPUs are split between the server processes
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", str(max(1, min(4, os.cpu_count() or 1) // SERVER_WORKERS))))
+
+# Latest jobs remembered per template, for copy downloads that do not name a job
+RECENT_JOBS_PER_PDF = 20
+
+# PDFService of a batch worker process, created on its first task
+_worker_pdf_service = None
+
+
+def _render_copy(pdf_path: str, replacements: Dict[str, str], ocr_coords: Optional[Dict], plan: Optional[Dict]) -> bytes:
+    """Render one copy in a batch worker; module level so process pools can pickle it"""
+    global _worker_pdf_service
+    if _worker_pdf_service is None:
+        _worker_pdf_service = PDFService()
+    return _worker_pdf_service.replace_text_in_pdf(Path(pdf_path), replacements, ocr_coords, plan=plan)
+
 
 class GeneratorService:
-    def __init__(self):
-        self.pdf_service = PDFService()
+    def __init__(self, pdf_service: Optional[PDFService] = None):
+        # Share the app's PDFService so both use one replacement plan cache
+        self.pdf_service = pdf_service or PDFService()
         self.output_dir = Path("outputs")
         self.output_dir.mkdir(exist_ok=True)
+        self._worker_pool = None
+        self._index_lock = threading.Lock()
     
-    def _format_value(self, value: int, rule: Dict) -> str:
-        """Format a numeric value according to rule"""
-        # Apply format if specified
-        if rule.get("format"):
-            try:
-                formatted = rule["format"] % value
-            except:
-                formatted = str(value)
-        else:
-            formatted = str(value)
-        
-        # Add prefix and suffix
-        prefix = rule.get("prefix", "")
-        suffix = rule.get("suffix", "")
-        
-        return f"{prefix}{formatted}{suffix}"
-    
-    def _generate_value(self, rule: Dict, copy_index: int) -> str:
-        """Generate a value based on rule type"""
-        rule_type = rule.get("type", "serial")
-        
-        if rule_type == "serial":
-            start_value = rule.get("start_value", 1)
-            value = start_value + copy_index
-            return self._format_value(value, rule)
-        
-        elif rule_type == "random":
-            min_val = rule.get("random_min", 1)
-            max_val = rule.get("random_max", 100)
-            value = random.randint(min_val, max_val)
-            return self._format_value(value, rule)
-        
-        elif rule_type == "custom":
-            # For custom, we might need more complex logic
-            # For now, treat as serial
-            start_value = rule.get("start_value", 1)
-            value = start_value + copy_index
-            return self._format_value(value, rule)
-        
-        return ""
+    def _batch_pool(self):
+        """Process pool shared by all batches, created on first use"""
+        if GENERATION_WORKERS <= 0:
+            return None
+        if self._worker_pool is None:
+            print(f"Starting {GENERATION_WORKERS} generation worker processes")
+            self._worker_pool = ProcessPoolExecutor(max_workers=GENERATION_WORKERS)
+        return self._worker_pool
+    
+    def compile_job(self, rules: List[Dict], ocr_sections: Optional[List[Dict]] = None) -> CompiledJob:
+        """Compile rules and OCR sections once for a whole batch"""
+        return CompiledJob(rules, ocr_sections)
+    
+    def estimate_cost(self, pdf_paths: List[Path], num_copies: int, num_rules: int, batch: bool = False) -> Cost:
+        """
+        Memory and CPU a generation request is expected to hold, for admission control.
+        Single-template jobs render one copy at a time on a thread; batches use the worker pool.
+        """
+        workers = GENERATION_WORKERS if batch else 0
+        return estimate_generation(pdf_paths, num_copies, num_rules, workers, GENERATION_CHUNK_SIZE)
     
     async def generate_pdfs(
         self,
         pdf_path: Path,
         rules: List[Dict],
         num_copies: int,
-        ocr_sections: Optional[List[Dict]] = None
+        ocr_sections: Optional[List[Dict]] = None,
+        dataset_rows: Optional[Iterator[Dict]] = None
     ) -> List[Path]:
-        """Generate multiple PDF copies with replacements"""
+        """
+        Generate multiple PDF copies with replacements.
+        dataset_rows: optional row iterator for "dataset" rules (mail merge); one
+                      row is consumed per copy and generation stops when it runs out.
+        Raises if no copy could be generated; see run_job for per-copy errors and resuming.
+        """
+        result = await self.run_job(pdf_path, rules, num_copies, ocr_sections, dataset_rows)
+        if result["errors"] and not result["output_files"]:
+            first = result["errors"][0]
+            raise Exception(f"Failed to generate copy {first['copy']}: {first['error']}")
+        return result["output_files"]
+    
+    def _job_fingerprint(self, pdf_path: Path, rules: List[Dict], ocr_sections: Optional[List[Dict]], dataset_key: Optional[str]) -> str:
+        """Identifies a request, so a checkpoint is only resumed by the same job"""
+        stat = pdf_path.stat()
+        payload = json.dumps({
+            "pdf": [pdf_path.name, stat.st_size, stat.st_mtime_ns],
+            "rules": rules,
+            "ocr_sections": ocr_sections,
+            "dataset": dataset_key,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    async def run_job(
+        self,
+        pdf_path: Path,
+        rules: List[Dict],
+        num_copies: int,
+        ocr_sections: Optional[List[Dict]] = None,
+        dataset_rows: Optional[Iterator[Dict]] = None,
+        job_id: Optional[str] = None,
+        seed: Optional[int] = None,
+        dataset_key: Optional[str] = None,
+        on_chunk: Optional[Callable[[List[Tuple[int, Path]]], None]] = None
+    ) -> Dict:
+        """
+        Generate copies in checkpointed chunks.
+        Progress (completed copy ranges, failed copies and the RNG seed) is saved
+        after every chunk; calling again with the same job_id and request resumes
+        after the last completed chunk and retries only the copies that failed.
+        A failing copy is recorded and skipped instead of aborting the batch.
+        on_chunk: called with the (copy index, path) pairs of each finished chunk,
+                  e.g. to archive outputs while later chunks are generated.
+        Returns {"job_id", "output_files", "errors", "resumed"}.
+        """
+        job_id = job_id or str(uuid.uuid4())
+        job = self.compile_job(rules, ocr_sections)
+        checkpoint = JobCheckpoint.load_or_create(
+            self.output_dir, job_id,
+            self._job_fingerprint(pdf_path, rules, ocr_sections, dataset_key),
+            num_copies, seed
+        )
+        # Saved up front so the job is visible to status requests before its first chunk finishes
+        checkpoint.save()
+        self._record_job(pdf_path.stem, job_id)
+        chunk_size = checkpoint.chunk_size
         output_files = []
+        loop = asyncio.get_event_loop()
+        # Locate every rule once for the whole job (or reuse the plan of a preview)
+        plan = await loop.run_in_executor(None, profiling_service.bind(self._job_plan), pdf_path, job)
         
-        print(f"Generating {num_copies} copies with {len(rules)} rules")
+        print(f"Generating {num_copies} copies with {len(rules)} rules (job {job_id}, chunks of {chunk_size}){' from dataset rows' if dataset_rows is not None else ''}")
         
-        for copy_num in range(num_copies):
-            try:
-                print(f"Generating copy {copy_num + 1}/{num_copies}")
-                replacements = {}
-                
-                # Generate replacement values for each rule
-                for rule in rules:
-                    original_text = rule.get("original_text", "")
-                    new_value = self._generate_value(rule, copy_num)
-                    
-                    if original_text and new_value:
-                        replacements[original_text] = new_value
-                        print(f"  Rule: '{original_text}' -> '{new_value}'")
-                
-                if not replacements:
-                    print(f"Warning: No replacements generated for copy {copy_num + 1}")
-                
-                # Build OCR coordinates map if available
-                ocr_coords = None
-                if ocr_sections:
-                    ocr_coords = {}
-                    for rule in rules:
-                        original_text = rule.get("original_text", "")
-                        section_id = rule.get("section_id", "")
-                        # Find matching OCR section
-                        for section in ocr_sections:
-                            if section.get("id") == section_id or section.get("text", "").strip() == original_text.strip():
-                                ocr_coords[original_text] = {
-                                    "x": section.get("x", 0),
-                                    "y": section.get("y", 0),
-                                    "width": section.get("width", 100),
-                                    "height": section.get("height", 20),
-                                    "page": section.get("page", 0)
-                                }
-                                print(f"  Found OCR coordinates for '{original_text}': page {section.get('page', 0)}, ({section.get('x', 0)}, {section.get('y', 0)})")
-                                break
-                
-                # Generate PDF with replacements
-                print(f"  Replacing text in PDF...")
-                try:
-                    pdf_bytes = self.pdf_service.replace_text_in_pdf(pdf_path, replacements, ocr_coords)
-                except Exception as pdf_error:
-                    import traceback
-                    print(f"  ERROR in replace_text_in_pdf: {pdf_error}")
-                    print(f"  Traceback: {traceback.format_exc()}")
-                    raise Exception(f"PDF text replacement failed: {pdf_error}")
-                
-                # Save to file
-                output_path = self.output_dir / f"{pdf_path.stem}_copy_{copy_num + 1}.pdf"
-                with open(output_path, "wb") as f:
-                    f.write(pdf_bytes)
+        chunk_start = 0
+        while chunk_start < num_copies:
+            chunk_stop = min(chunk_start + chunk_size, num_copies)
+            rows = None
+            if dataset_rows is not None:
+                # Only one chunk of rows is held in memory at a time
+                rows = list(islice(dataset_rows, chunk_stop - chunk_start))
+                if not rows:
+                    print(f"Dataset exhausted after {chunk_start} rows")
+                    break
+                chunk_stop = chunk_start + len(rows)
+            
+            todo = range(chunk_start, chunk_stop)
+            if checkpoint.is_completed(chunk_start):
+                # Only redo copies that failed or whose output has gone missing
+                failed = set(checkpoint.failed_copies(chunk_start, chunk_stop))
+                todo = [c for c in todo if c in failed or not self._output_path(job_id, pdf_path, c).exists()]
+                if todo:
+                    print(f"Chunk {chunk_start + 1}-{chunk_stop}: retrying {len(todo)} copies")
+            
+            if todo:
+                # Generate replacement values for every rule over the whole chunk
+                with profiling_service.stage("generate.values"):
+                    columns = job.value_columns(chunk_start, chunk_stop, checkpoint.chunk_rng(chunk_start), rows)
                 
-                print(f"  Saved: {output_path}")
-                output_files.append(output_path)
+                for copy_num in todo:
+                    try:
+                        # Rendering runs off the event loop so other requests (e.g. shard downloads) are served meanwhile
+                        await loop.run_in_executor(
+                            None,
+                            profiling_service.bind(self._generate_copy),
+                            job_id, pdf_path, job, columns, copy_num, chunk_start, num_copies, plan
+                        )
+                        checkpoint.clear_error(copy_num)
+                    except Exception as e:
+                        import traceback
+                        print(f"Error generating copy {copy_num + 1}: {str(e)}")
+                        print(f"Traceback: {traceback.format_exc()}")
+                        checkpoint.record_error(copy_num, str(e))
+                checkpoint.mark_completed(chunk_start, chunk_stop)
+            
+            chunk_files = []
+            for copy_num in range(chunk_start, chunk_stop):
+                output_path = self._output_path(job_id, pdf_path, copy_num)
+                if str(copy_num) not in checkpoint.data["errors"] and output_path.exists():
+                    chunk_files.append((copy_num, output_path))
+            output_files.extend(path for _, path in chunk_files)
+            if on_chunk is not None and chunk_files:
+                on_chunk(chunk_files)
+            chunk_start = chunk_stop
+        
+        checkpoint.finish()
+        errors = checkpoint.errors
+        print(f"Successfully generated {len(output_files)} PDF copies ({len(errors)} failed)")
+        return {
+            "job_id": job_id,
+            "output_files": output_files,
+            "errors": errors,
+            "resumed": checkpoint.data["resumed"] > 0,
+        }
+    
+    def run_chunk(
+        self,
+        spec: Dict,
+        position: int,
+        chunk_start: int,
+        chunk_stop: int,
+        dataset_rows: Optional[Iterator[Dict]] = None,
+        heartbeat: Optional[Callable[[], None]] = None
+    ) -> Dict:
+        """
+        Render copies [chunk_start, chunk_stop) of a queued job (see job_queue) and
+        archive them as shard `position + 1` of the job. Values come from the same
+        per-chunk RNG run_job uses, so a chunk renders the same copies on any worker.
+        spec: {"job_id", "pdf_path", "rules", "ocr_sections", "seed", "num_copies"}
+        dataset_rows: the job's dataset rows, from the first row; this chunk's slice is taken from it.
+        heartbeat: called between copies to keep the chunk's lease.
+        Returns {"copies", "errors", "file", "size", "pdf_bytes"}.
+        """
+        pdf_path = Path(spec["pdf_path"])
+        job = self.compile_job(spec["rules"], spec.get("ocr_sections"))
+        plan = self._job_plan(pdf_path, job)
+        self._record_job(pdf_path.stem, spec["job_id"])
+        rows = None
+        if dataset_rows is not None:
+            rows = list(islice(dataset_rows, chunk_start, chunk_stop))
+            chunk_stop = chunk_start + len(rows)
+        
+        print(f"Job {spec['job_id']}: generating copies {chunk_start + 1}-{chunk_stop}")
+        with profiling_service.stage("generate.values"):
+            columns = job.value_columns(chunk_start, chunk_stop, chunk_rng(spec["seed"], chunk_start), rows)
+        files = []
+        errors = {}
+        for copy_num in range(chunk_start, chunk_stop):
+            try:
+                self._generate_copy(spec["job_id"], pdf_path, job, columns, copy_num, chunk_start, spec["num_copies"], plan)
+                files.append(self._output_path(spec["job_id"], pdf_path, copy_num))
             except Exception as e:
                 import traceback
                 print(f"Error generating copy {copy_num + 1}: {str(e)}")
                 print(f"Traceback: {traceback.format_exc()}")
-                raise Exception(f"Failed to generate copy {copy_num + 1}: {str(e)}")
+                errors[str(copy_num)] = str(e)
+            if heartbeat is not None:
+                heartbeat()
+        
+        result = {"copies": len(files), "errors": errors, "file": None, "size": 0,
+                  "pdf_bytes": sum(path.stat().st_size for path in files)}
+        if files:
+            zip_path = ShardedArchive.shard_path(self.output_dir, spec["job_id"], position + 1)
+            with profiling_service.stage("generate.zip"):
+                write_zip(zip_path, files)
+                # Hash now so the first download does not have to
+                content_etag(zip_path)
+            result["file"] = zip_path.name
+            result["size"] = zip_path.stat().st_size
+        print(f"Job {spec['job_id']}: copies {chunk_start + 1}-{chunk_stop} done ({len(errors)} failed)")
+        return result
+    
+    def job_dir(self, job_id: str) -> Path:
+        """Directory holding the copies of one job, so jobs on the same template never share files"""
+        return self.output_dir / job_id
+    
+    def _output_path(self, job_id: str, pdf_path: Path, copy_num: int) -> Path:
+        return self.job_dir(job_id) / f"{pdf_path.stem}_copy_{copy_num + 1}.pdf"
+    
+    def _jobs_index_path(self, pdf_id: str) -> Path:
+        return self.output_dir / f"{pdf_id}.jobs.json"
+    
+    def recent_jobs(self, pdf_id: str) -> List[str]:
+        """Ids of the latest jobs on a template, newest first"""
+        try:
+            with open(self._jobs_index_path(pdf_id), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+    
+    def _record_job(self, pdf_id: str, job_id: str):
+        """Put a job at the front of its template's recent-job index"""
+        with self._index_lock:
+            jobs = self.recent_jobs(pdf_id)
+            if jobs[:1] == [job_id]:
+                return
+            jobs = [job_id] + [other for other in jobs if other != job_id][:RECENT_JOBS_PER_PDF - 1]
+            path = self._jobs_index_path(pdf_id)
+            try:
+                # Unique per writer: worker processes index their jobs too
+                tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+                with open(tmp_path, "w") as f:
+                    json.dump(jobs, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Warning: Could not index job {job_id} of {pdf_id}: {e}")
+    
+    def latest_copy(self, pdf_id: str, copy_number: int) -> Optional[Path]:
+        """The 1-based copy from the most recent job on a template that has it, or None"""
+        name = f"{pdf_id}_copy_{copy_number}.pdf"
+        for job_id in self.recent_jobs(pdf_id):
+            path = self.job_dir(job_id) / name
+            if path.is_file():
+                return path
+        return None
+    
+    def _job_plan(self, pdf_path: Path, job: CompiledJob) -> Optional[Dict]:
+        """Replacement plan for a job, or None to search per copy if it cannot be resolved"""
+        if not job.texts:
+            return None
+        try:
+            return self.pdf_service.get_plan(pdf_path, job.texts, job.ocr_coords)
+        except Exception as e:
+            print(f"Could not resolve replacement plan, searching per copy instead: {e}")
+            return None
+    
+    def _generate_copy(self, job_id: str, pdf_path: Path, job: CompiledJob, columns: List[List[str]], copy_num: int, chunk_start: int, num_copies: int, plan: Optional[Dict] = None):
+        """Render and save one copy from its row of the chunk's value columns"""
+        print(f"Generating copy {copy_num + 1}/{num_copies}")
+        replacements = job.replacements(columns, copy_num - chunk_start)
+        
+        if not replacements:
+            print(f"Warning: No replacements generated for copy {copy_num + 1}")
+        elif copy_num == 0:
+            for original_text, new_value in replacements.items():
+                print(f"  Rule: '{original_text}' -> '{new_value}'")
+        
+        # Generate PDF with replacements
+        print(f"  Replacing text in PDF...")
+        try:
+            with profiling_service.stage("generate.replace"):
+                pdf_bytes = self.pdf_service.replace_text_in_pdf(pdf_path, replacements, job.ocr_coords, plan=plan)
+        except Exception as pdf_error:
+            import traceback
+            print(f"  ERROR in replace_text_in_pdf: {pdf_error}")
+            print(f"  Traceback: {traceback.format_exc()}")
+            raise Exception(f"PDF text replacement failed: {pdf_error}")
+        
+        # Save to file
+        output_path = self._output_path(job_id, pdf_path, copy_num)
+        output_path.parent.mkdir(exist_ok=True)
+        with profiling_service.stage("generate.write"):
+            with open(output_path, "wb") as f:
+                f.write(pdf_bytes)
+        
+        print(f"  Saved: {output_path}")
+    
+    def preview_copy(
+        self,
+        pdf_path: Path,
+        rules: List[Dict],
+        copy_number: int = 1,
+        ocr_sections: Optional[List[Dict]] = None,
+        dataset_rows: Optional[Iterator[Dict]] = None,
+        seed: Optional[int] = None,
+        zoom: float = 1.0
+    ) -> Dict:
+        """
+        Dry run of one copy: resolve every rule, report where and how it matched,
+        and render only the pages of copy `copy_number` (1-based) that change.
+        Values are those the batch produces for that copy with the same seed.
+        The resolved plan stays cached, so the batch that follows skips the search.
+        """
+        job = self.compile_job(rules, ocr_sections)
+        plan = self.pdf_service.get_plan(pdf_path, job.texts, job.ocr_coords)
+        seed = seed if seed is not None else random.SystemRandom().getrandbits(63)
+        
+        # Rebuild the chunk RNG exactly as run_job would for this copy
+        copy_index = copy_number - 1
+        chunk_start = copy_index - copy_index % GENERATION_CHUNK_SIZE
+        rows = None
+        if dataset_rows is not None:
+            rows = list(islice(dataset_rows, chunk_start, copy_index + 1))
+            if len(rows) < copy_index + 1 - chunk_start:
+                raise ValueError(f"Dataset has fewer than {copy_number} rows")
+        columns = job.value_columns(chunk_start, copy_index + 1, chunk_rng(seed, chunk_start), rows)
+        replacements = job.replacements(columns, copy_index - chunk_start)
+        
+        rule_reports = []
+        affected_pages = set()
+        for rule in job.rules:
+            matches = []
+            for page_key, entries in plan["pages"].items():
+                entry = entries.get(rule.original_text)
+                if entry:
+                    matches.extend({"page": int(page_key), "strategy": entry["strategy"], **match} for match in entry["matches"])
+                    if rule.original_text in replacements:
+                        affected_pages.add(int(page_key))
+            rule_reports.append({
+                "section_id": rule.section_id,
+                "original_text": rule.original_text,
+                "type": rule.rule_type,
+                "value": replacements.get(rule.original_text),
+                "matched": bool(matches),
+                "matches": sorted(matches, key=lambda m: m["page"]),
+            })
+        
+        with profiling_service.stage("generate.replace"):
+            pdf_bytes = self.pdf_service.replace_text_in_pdf(pdf_path, replacements, job.ocr_coords, plan=plan)
+        pages = []
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            for page_num in sorted(affected_pages):
+                pix = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                pages.append({
+                    "page": page_num,
+                    "width": pix.width,
+                    "height": pix.height,
+                    "image": "data:image/png;base64," + base64.b64encode(pix.tobytes("png")).decode("ascii"),
+                })
+        finally:
+            doc.close()
+        
+        print(f"Preview of copy {copy_number}: {len(replacements)} replacements on pages {sorted(p + 1 for p in affected_pages)}")
+        return {
+            "copy": copy_number,
+            "seed": seed,
+            "page_count": plan["page_count"],
+            "replacements": replacements,
+            "rules": rule_reports,
+            "unmatched": [report["original_text"] for report in rule_reports if not report["matched"]],
+            "pages": pages,
+        }
+    
+    async def generate_batch(
+        self,
+        templates: List[Dict],
+        num_copies: int,
+        dataset_rows: Optional[Iterator[Dict]] = None,
+        seed: Optional[int] = None,
+        batch_id: Optional[str] = None
+    ) -> Dict:
+        """
+        Render each record onto several templates and stream every output into one ZIP.
+        templates: [{"name", "pdf_path", "rules", "ocr_sections"}]; all templates share the
+                   value columns of each copy (dataset row, serials, random rules with a "field").
+        Copies of all templates are interleaved on the shared worker pool, and finished PDFs
+        are written to the archive as they arrive instead of to intermediate files.
+        Returns {"batch_id", "zip_path", "seed", "files", "errors"}.
+        """
+        batch_id = batch_id or str(uuid.uuid4())
+        seed = seed if seed is not None else random.SystemRandom().getrandbits(63)
+        loop = asyncio.get_event_loop()
+        jobs = [self.compile_job(template["rules"], template.get("ocr_sections")) for template in templates]
+        plans = []
+        for template, job in zip(templates, jobs):
+            plans.append(await loop.run_in_executor(None, profiling_service.bind(self._job_plan), template["pdf_path"], job))
+        
+        pool = self._batch_pool()
+        # Bound the copies in flight so finished PDFs never pile up in memory
+        in_flight = asyncio.Semaphore(max(2, 2 * max(1, GENERATION_WORKERS)))
+        # ZipFile is not thread-safe: a single writer thread appends entries in completion order
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-zip")
+        zip_path = self.output_dir / f"batch_{batch_id}.zip"
+        tmp_path = zip_path.with_name(zip_path.name + ".tmp")
+        errors = []
+        written = []
+        
+        print(f"Batch {batch_id}: {num_copies} copies x {len(templates)} templates on {GENERATION_WORKERS or 'thread'} workers")
+        
+        async def render_and_store(template_index: int, copy_num: int, replacements: Dict[str, str]):
+            template = templates[template_index]
+            try:
+                with profiling_service.stage("generate.replace"):
+                    pdf_bytes = await loop.run_in_executor(
+                        pool, _render_copy,
+                        str(template["pdf_path"]), replacements, jobs[template_index].ocr_coords, plans[template_index]
+                    )
+                arcname = f"{template['name']}/{template['name']}_copy_{copy_num + 1}.pdf"
+                with profiling_service.stage("generate.zip"):
+                    await loop.run_in_executor(writer, zipf.writestr, arcname, pdf_bytes)
+                written.append(arcname)
+            except Exception as e:
+                import traceback
+                print(f"Error generating {template['name']} copy {copy_num + 1}: {str(e)}")
+                print(f"Traceback: {traceback.format_exc()}")
+                errors.append({"template": template["name"], "copy": copy_num + 1, "error": str(e)})
+                if isinstance(e, BrokenProcessPool):
+                    # A worker died; start a fresh pool for the next batch
+                    self._worker_pool = None
+            finally:
+                in_flight.release()
+        
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+                tasks = []
+                chunk_start = 0
+                while chunk_start < num_copies:
+                    chunk_stop = min(chunk_start + GENERATION_CHUNK_SIZE, num_copies)
+                    rows = None
+                    if dataset_rows is not None:
+                        rows = list(islice(dataset_rows, chunk_stop - chunk_start))
+                        if not rows:
+                            print(f"Dataset exhausted after {chunk_start} rows")
+                            break
+                        chunk_stop = chunk_start + len(rows)
+                    # One RNG and one set of shared values per chunk, consumed template by template
+                    rng = chunk_rng(seed, chunk_start)
+                    shared = {}
+                    with profiling_service.stage("generate.values"):
+                        columns = [job.value_columns(chunk_start, chunk_stop, rng, rows, shared) for job in jobs]
+                    for copy_num in range(chunk_start, chunk_stop):
+                        for template_index, job in enumerate(jobs):
+                            replacements = job.replacements(columns[template_index], copy_num - chunk_start)
+                            await in_flight.acquire()
+                            tasks.append(asyncio.ensure_future(render_and_store(template_index, copy_num, replacements)))
+                    chunk_start = chunk_stop
+                await asyncio.gather(*tasks)
+            os.replace(tmp_path, zip_path)
+        finally:
+            writer.shutdown(wait=False)
+            if tmp_path.exists():
+                tmp_path.unlink()
         
-        print(f"Successfully generated {len(output_files)} PDF copies")
-        return output_files
+        print(f"Batch {batch_id} complete: {len(written)} PDFs in {zip_path} ({len(errors)} failed)")
+        return {"batch_id": batch_id, "zip_path": zip_path, "seed": seed, "files": len(written), "errors": errors}
     
     async def create_zip(self, pdf_files: List[Path], pdf_id: str) -> Path:
         """Create a zip file containing all generated PDFs"""
@@ -133,13 +523,8 @@ class GeneratorService:
         
         print(f"Creating ZIP file with {len(pdf_files)} PDFs")
         try:
-            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-                for pdf_file in pdf_files:
-                    if pdf_file.exists():
-                        zipf.write(pdf_file, pdf_file.name)
-                        print(f"  Added to ZIP: {pdf_file.name}")
-                    else:
-                        print(f"  Warning: File not found: {pdf_file}")
+            with profiling_service.stage("generate.zip"):
+                write_zip(zip_path, pdf_files)
             
             print(f"ZIP file created: {zip_path} ({zip_path.stat().st_size} bytes)")
             return zip_path
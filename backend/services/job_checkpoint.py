@@ -0,0 +1,126 @@
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Copies generated between checkpoint writes
+GENERATION_CHUNK_SIZE = int(os.getenv("GENERATION_CHUNK_SIZE", "250"))
+
+# Job ids end up in file names
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def is_valid_job_id(job_id: str) -> bool:
+    return bool(JOB_ID_PATTERN.match(job_id or ""))
+
+
+def chunk_rng(seed: int, chunk_start: int) -> random.Random:
+    """RNG for the random rules of the chunk of a job starting at copy index `chunk_start`"""
+    return random.Random(f"{seed}:{chunk_start}")
+
+
+class JobCheckpoint:
+    """
+    Persistent progress of a generation job, saved after every chunk of copies.
+
+    Random values are drawn from a per-chunk RNG seeded from the job seed and the
+    chunk start, so the RNG state of any chunk can be rebuilt exactly on resume,
+    and a resumed job produces the same values it would have without failing.
+    """
+
+    def __init__(self, path: Path, data: Dict):
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def load_or_create(cls, directory: Path, job_id: str, fingerprint: str, num_copies: int,
+                       seed: Optional[int] = None, chunk_size: int = GENERATION_CHUNK_SIZE) -> "JobCheckpoint":
+        """Resume the checkpoint of `job_id` if it belongs to the same request, else start a new one"""
+        path = Path(directory) / f"{job_id}.checkpoint.json"
+        if path.exists():
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("fingerprint") == fingerprint:
+                    completed = sum(stop - start for start, stop in data["completed"])
+                    print(f"Resuming job {job_id}: {completed} copies already completed, {len(data['errors'])} failed")
+                    data["num_copies"] = num_copies
+                    data["status"] = "running"
+                    data["resumed"] = data.get("resumed", 0) + 1
+                    return cls(path, data)
+                print(f"Job {job_id} has a checkpoint for a different request, starting over")
+            except Exception as e:
+                print(f"Warning: Could not read checkpoint for job {job_id}, starting over: {e}")
+        data = {
+            "job_id": job_id,
+            "fingerprint": fingerprint,
+            "num_copies": num_copies,
+            "chunk_size": max(1, chunk_size),
+            "seed": seed if seed is not None else random.SystemRandom().getrandbits(63),
+            "completed": [],
+            "errors": {},
+            "status": "running",
+            "resumed": 0,
+            "created_at": time.time(),
+        }
+        return cls(path, data)
+
+    @classmethod
+    def read(cls, directory: Path, job_id: str) -> Optional[Dict]:
+        """Checkpoint contents of a job, for status reporting"""
+        path = Path(directory) / f"{job_id}.checkpoint.json"
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    @property
+    def chunk_size(self) -> int:
+        return self.data["chunk_size"]
+
+    def chunk_rng(self, chunk_start: int) -> random.Random:
+        """RNG for the random rules of the chunk starting at `chunk_start`"""
+        return chunk_rng(self.data["seed"], chunk_start)
+
+    def is_completed(self, chunk_start: int) -> bool:
+        return any(start == chunk_start for start, _ in self.data["completed"])
+
+    def failed_copies(self, start: int, stop: int) -> List[int]:
+        """0-based copy indexes in [start, stop) that failed in an earlier attempt"""
+        return sorted(int(copy) for copy in self.data["errors"] if start <= int(copy) < stop)
+
+    def record_error(self, copy_index: int, error: str):
+        self.data["errors"][str(copy_index)] = error
+
+    def clear_error(self, copy_index: int):
+        self.data["errors"].pop(str(copy_index), None)
+
+    def mark_completed(self, start: int, stop: int):
+        if not self.is_completed(start):
+            self.data["completed"].append([start, stop])
+            self.data["completed"].sort()
+        self.data["updated_at"] = time.time()
+        self.save()
+
+    def finish(self):
+        self.data["status"] = "completed_with_errors" if self.data["errors"] else "completed"
+        self.data["updated_at"] = time.time()
+        self.save()
+
+    @property
+    def completed_ranges(self) -> List[Tuple[int, int]]:
+        return [tuple(r) for r in self.data["completed"]]
+
+    @property
+    def errors(self) -> List[Dict]:
+        return [{"copy": int(copy) + 1, "error": error} for copy, error in sorted(self.data["errors"].items(), key=lambda e: int(e[0]))]
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        # Atomic rename so a crash never leaves a truncated checkpoint
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,477 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from services.startup import lazy_module
+
+redis = lazy_module("redis")  # Only needed for redis:// queues
+
+# Where distributed generation jobs are queued:
+#   sqlite:///outputs/job_queue.db  - a SQLite file; workers on this host or a volume with working file locks
+#   redis://host:6379/0             - any Redis-compatible server, for workers on several nodes
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "sqlite:///outputs/job_queue.db")
+# Seconds a claimed chunk stays leased to its worker without a heartbeat before another worker may take it
+JOB_QUEUE_LEASE = float(os.getenv("JOB_QUEUE_LEASE", "300"))
+# Claims of one chunk (including ones lost to crashed workers) before it is given up
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3"))
+# Key prefix of redis:// queues, so several deployments can share a server
+JOB_QUEUE_PREFIX = os.getenv("JOB_QUEUE_PREFIX", "pdfgen")
+
+TASK_STATUSES = ("pending", "running", "done", "failed")
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class TaskLost(Exception):
+    """The worker's claim on a task ended (its lease ran out and another worker took it)"""
+
+
+class JobQueue(ABC):
+    """
+    Chunks of generation jobs waiting for worker processes.
+
+    A job is its spec (template, rules, seed, ...) plus one task per copy range.
+    Workers claim a task, renew its lease while rendering and report the result;
+    a task whose lease runs out (the worker died) is handed to the next claimant,
+    up to JOB_QUEUE_MAX_ATTEMPTS times. Rendering a chunk twice is harmless: its
+    values come from the per-chunk RNG, so both runs write the same copies.
+    """
+
+    @abstractmethod
+    def create_job(self, job_id: str, spec: Dict, chunks: List[Tuple[int, int]]) -> bool:
+        """Queue a job's chunks in order; False if a job with this id already exists"""
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[Dict]:
+        """
+        Lease the oldest runnable task to `worker`, or None if there is none.
+        Returns {"task_id", "job_id", "position", "chunk_start", "chunk_stop", "attempts", "job": spec}.
+        """
+
+    # heartbeat, complete and fail only act for the claim that still owns the task: the
+    # `worker` and `attempt` returned by claim. A worker whose lease ran out and whose task
+    # was claimed again gets False back and must drop the chunk.
+
+    @abstractmethod
+    def heartbeat(self, task_id: str, worker: str, attempt: int) -> bool:
+        """Extend the lease of a running task"""
+
+    @abstractmethod
+    def complete(self, task_id: str, worker: str, attempt: int, result: Dict) -> bool:
+        """Record the result of a finished task: {"copies", "errors", "file", "size", "pdf_bytes"}"""
+
+    @abstractmethod
+    def fail(self, task_id: str, worker: str, attempt: int, error: str) -> bool:
+        """Give a task back after an error; it is retried until it runs out of attempts"""
+
+    @abstractmethod
+    def job(self, job_id: str) -> Optional[Dict]:
+        """Spec of a job, or None if it is unknown"""
+
+    @abstractmethod
+    def tasks(self, job_id: str) -> List[Dict]:
+        """Tasks of a job in copy order: {"position", "chunk_start", "chunk_stop", "status", "attempts", "worker", "result", "error"}"""
+
+    def summary(self, job_id: str) -> Optional[Dict]:
+        """
+        Progress of a job aggregated over its tasks, in the shape of a JobCheckpoint
+        ("status", "num_copies", "completed", "errors", "resumed") plus chunk counts.
+        """
+        spec = self.job(job_id)
+        if spec is None:
+            return None
+        tasks = self.tasks(job_id)
+        completed = []
+        errors = {}
+        counts = {status: 0 for status in TASK_STATUSES}
+        for task in tasks:
+            counts[task["status"]] += 1
+            if task["status"] == "done":
+                completed.append([task["chunk_start"], task["chunk_stop"]])
+                errors.update((task["result"] or {}).get("errors", {}))
+            elif task["status"] == "failed":
+                for copy_num in range(task["chunk_start"], task["chunk_stop"]):
+                    errors[str(copy_num)] = f"Chunk failed: {task['error']}"
+        if counts["pending"] or counts["running"]:
+            status = "running"
+        elif not counts["done"]:
+            status = "failed"
+        else:
+            status = "completed_with_errors" if errors else "completed"
+        return {
+            "job_id": job_id,
+            "status": status,
+            "num_copies": spec["num_copies"],
+            "seed": spec["seed"],
+            "completed": completed,
+            "errors": errors,
+            "resumed": sum(max(0, task["attempts"] - 1) for task in tasks),
+            "chunks": counts,
+            "workers": sorted({task["worker"] for task in tasks if task["worker"] and task["status"] == "running"}),
+        }
+
+    def manifest(self, job_id: str) -> Optional[Dict]:
+        """ShardedArchive-style manifest of a job: every finished chunk is one shard"""
+        summary = self.summary(job_id)
+        if summary is None:
+            return None
+        spec = self.job(job_id)
+        shards = []
+        for task in self.tasks(job_id):
+            result = task["result"] or {}
+            if task["status"] != "done" or not result.get("file"):
+                continue
+            shards.append({
+                "number": task["position"] + 1,
+                "file": result["file"],
+                "first_copy": task["chunk_start"] + 1,
+                "last_copy": task["chunk_stop"],
+                "copies": result["copies"],
+                "pdf_bytes": result["pdf_bytes"],
+                "size": result["size"],
+                "status": "ready",
+            })
+        return {
+            "job_id": job_id,
+            "pdf_id": spec["pdf_id"],
+            "status": summary["status"],
+            "distributed": True,
+            "shards": shards,
+            "errors": [{"copy": int(copy) + 1, "error": error} for copy, error in sorted(summary["errors"].items(), key=lambda e: int(e[0]))],
+            "chunks": summary["chunks"],
+            "created_at": spec["created_at"],
+        }
+
+
+class SQLiteJobQueue(JobQueue):
+    """Queue in a SQLite file; claims take the database write lock, so each task goes to one worker"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    spec TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    chunk_start INTEGER NOT NULL,
+                    chunk_stop INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    leased_until REAL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS tasks_by_job ON tasks (job_id, position);
+                CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, created_at, position);
+            """)
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: the API calls from several threads and workers from several processes
+        db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def create_job(self, job_id: str, spec: Dict, chunks: List[Tuple[int, int]]) -> bool:
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone():
+                db.execute("ROLLBACK")
+                return False
+            db.execute("INSERT INTO jobs VALUES (?, ?, ?)", (job_id, json.dumps(spec), now))
+            db.executemany(
+                "INSERT INTO tasks (task_id, job_id, position, chunk_start, chunk_stop, status, created_at) VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                [(str(uuid.uuid4()), job_id, position, start, stop, now) for position, (start, stop) in enumerate(chunks)]
+            )
+            db.execute("COMMIT")
+            return True
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Leases of dead workers run out; those chunks are retried or given up
+            db.execute(
+                "UPDATE tasks SET status = 'failed', error = 'Worker lease expired ' || attempts || ' times' "
+                "WHERE status = 'running' AND leased_until < ? AND attempts >= ?",
+                (now, JOB_QUEUE_MAX_ATTEMPTS)
+            )
+            row = db.execute(
+                "SELECT * FROM tasks WHERE status = 'pending' OR (status = 'running' AND leased_until < ?) "
+                "ORDER BY created_at, position LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, leased_until = ? WHERE task_id = ?",
+                (worker, now + JOB_QUEUE_LEASE, row["task_id"])
+            )
+            spec = db.execute("SELECT spec FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone()["spec"]
+            db.execute("COMMIT")
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        return {
+            "task_id": row["task_id"],
+            "job_id": row["job_id"],
+            "position": row["position"],
+            "chunk_start": row["chunk_start"],
+            "chunk_stop": row["chunk_stop"],
+            "attempts": row["attempts"] + 1,
+            "job": json.loads(spec),
+        }
+
+    def _update_owned(self, assignments: str, params: Tuple, task_id: str, worker: str, attempt: int) -> bool:
+        """Apply `assignments` to a running task only while `worker`'s claim `attempt` still holds it"""
+        db = self._connect()
+        try:
+            return db.execute(
+                f"UPDATE tasks SET {assignments} WHERE task_id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                params + (task_id, worker, attempt)
+            ).rowcount > 0
+        finally:
+            db.close()
+
+    def heartbeat(self, task_id: str, worker: str, attempt: int) -> bool:
+        return self._update_owned("leased_until = ?", (time.time() + JOB_QUEUE_LEASE,), task_id, worker, attempt)
+
+    def complete(self, task_id: str, worker: str, attempt: int, result: Dict) -> bool:
+        return self._update_owned(
+            "status = 'done', result = ?, error = NULL, leased_until = NULL",
+            (json.dumps(result),), task_id, worker, attempt
+        )
+
+    def fail(self, task_id: str, worker: str, attempt: int, error: str) -> bool:
+        return self._update_owned(
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, leased_until = NULL",
+            (JOB_QUEUE_MAX_ATTEMPTS, error), task_id, worker, attempt
+        )
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        db = self._connect()
+        try:
+            row = db.execute("SELECT spec, created_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return {**json.loads(row["spec"]), "created_at": row["created_at"]}
+
+    def tasks(self, job_id: str) -> List[Dict]:
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT * FROM tasks WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+        finally:
+            db.close()
+        return [{
+            "position": row["position"],
+            "chunk_start": row["chunk_start"],
+            "chunk_stop": row["chunk_stop"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "worker": row["worker"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        } for row in rows]
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Queue on a Redis-compatible server, for workers on several nodes.
+    Only plain list, hash and sorted-set commands and WATCH/MULTI transactions are
+    used (no scripts), so servers that implement the Redis protocol partially work as well.
+
+    Keys: {prefix}:pending (list of task ids, claimed from the right), {prefix}:processing
+    (claimed task ids), {prefix}:leases (sorted set task id -> lease expiry),
+    {prefix}:task:{id} and {prefix}:job:{id} (hashes), {prefix}:job:{id}:tasks (list).
+    """
+
+    def __init__(self, url: str = None, client=None, prefix: str = JOB_QUEUE_PREFIX):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("redis:// job queues require the 'redis' package")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def create_job(self, job_id: str, spec: Dict, chunks: List[Tuple[int, int]]) -> bool:
+        job_key = self._key("job", job_id)
+        # HSETNX claims the id, so two API processes cannot both create the job
+        if not self.client.hsetnx(job_key, "spec", json.dumps(spec)):
+            return False
+        self.client.hset(job_key, "created_at", time.time())
+        task_ids = []
+        for position, (start, stop) in enumerate(chunks):
+            task_id = str(uuid.uuid4())
+            self.client.hset(self._key("task", task_id), mapping={
+                "job_id": job_id,
+                "position": position,
+                "chunk_start": start,
+                "chunk_stop": stop,
+                "status": "pending",
+                "attempts": 0,
+            })
+            task_ids.append(task_id)
+        if task_ids:
+            self.client.rpush(self._key("job", job_id, "tasks"), *task_ids)
+            # Claims pop from the right, so the first chunk goes in last
+            self.client.lpush(self._key("pending"), *task_ids)
+        return True
+
+    def _recover_expired(self):
+        """Put tasks of workers whose lease ran out back on the queue (or give them up)"""
+        now = time.time()
+        for task_id in self.client.lrange(self._key("processing"), 0, -1):
+            lease = self.client.zscore(self._key("leases"), task_id)
+            if lease is None:
+                # Claimed but not leased yet: the claimer may be between RPOPLPUSH and ZADD, so
+                # give it a full lease instead of taking the task. NX keeps the claimer's own lease
+                # if it got there first; if the claimer died, this lease runs out like any other.
+                self.client.zadd(self._key("leases"), {task_id: now + JOB_QUEUE_LEASE}, nx=True)
+                continue
+            if lease >= now:
+                continue
+            # LREM decides which recoverer wins
+            if not self.client.lrem(self._key("processing"), 1, task_id):
+                continue
+            self.client.zrem(self._key("leases"), task_id)
+            task_key = self._key("task", task_id)
+            attempts = int(self.client.hget(task_key, "attempts") or 0)
+            if attempts >= JOB_QUEUE_MAX_ATTEMPTS:
+                self.client.hset(task_key, mapping={"status": "failed", "error": f"Worker lease expired {attempts} times"})
+            else:
+                self.client.hset(task_key, "status", "pending")
+                self.client.rpush(self._key("pending"), task_id)
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        self._recover_expired()
+        task_id = self.client.rpoplpush(self._key("pending"), self._key("processing"))
+        if task_id is None:
+            return None
+        self.client.zadd(self._key("leases"), {task_id: time.time() + JOB_QUEUE_LEASE})
+        task_key = self._key("task", task_id)
+        attempts = self.client.hincrby(task_key, "attempts", 1)
+        self.client.hset(task_key, mapping={"status": "running", "worker": worker})
+        task = self.client.hgetall(task_key)
+        return {
+            "task_id": task_id,
+            "job_id": task["job_id"],
+            "position": int(task["position"]),
+            "chunk_start": int(task["chunk_start"]),
+            "chunk_stop": int(task["chunk_stop"]),
+            "attempts": int(attempts),
+            "job": json.loads(self.client.hget(self._key("job", task["job_id"]), "spec")),
+        }
+
+    def _owned(self, task: Dict, worker: str, attempt: int) -> bool:
+        return task.get("status") == "running" and task.get("worker") == worker and int(task.get("attempts") or 0) == attempt
+
+    def heartbeat(self, task_id: str, worker: str, attempt: int) -> bool:
+        if not self._owned(self.client.hgetall(self._key("task", task_id)), worker, attempt):
+            return False
+        # XX: only extend an existing lease, never re-lease a task that was recovered meanwhile
+        self.client.zadd(self._key("leases"), {task_id: time.time() + JOB_QUEUE_LEASE}, xx=True)
+        return True
+
+    def _finish(self, task_id: str, worker: str, attempt: int, fields) -> bool:
+        """
+        Compare-then-write under WATCH: the task hash is re-checked inside the transaction,
+        so a claim or recovery that changes it in between aborts this update.
+        fields: the new task fields, or a function of the current task hash returning them.
+        """
+        task_key = self._key("task", task_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(task_key)
+                task = pipe.hgetall(task_key)
+                if not self._owned(task, worker, attempt):
+                    return False
+                new_fields = fields(task) if callable(fields) else fields
+                pipe.multi()
+                pipe.hset(task_key, mapping=new_fields)
+                pipe.zrem(self._key("leases"), task_id)
+                pipe.lrem(self._key("processing"), 1, task_id)
+                if new_fields["status"] == "pending":
+                    pipe.rpush(self._key("pending"), task_id)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def complete(self, task_id: str, worker: str, attempt: int, result: Dict) -> bool:
+        return self._finish(task_id, worker, attempt, {"status": "done", "result": json.dumps(result), "error": ""})
+
+    def fail(self, task_id: str, worker: str, attempt: int, error: str) -> bool:
+        def failed(task: Dict) -> Dict:
+            out_of_attempts = int(task.get("attempts") or 0) >= JOB_QUEUE_MAX_ATTEMPTS
+            return {"status": "failed" if out_of_attempts else "pending", "error": error}
+        return self._finish(task_id, worker, attempt, failed)
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        data = self.client.hgetall(self._key("job", job_id))
+        if not data or "spec" not in data:
+            return None
+        return {**json.loads(data["spec"]), "created_at": float(data.get("created_at") or 0)}
+
+    def tasks(self, job_id: str) -> List[Dict]:
+        tasks = []
+        for task_id in self.client.lrange(self._key("job", job_id, "tasks"), 0, -1):
+            task = self.client.hgetall(self._key("task", task_id))
+            tasks.append({
+                "position": int(task["position"]),
+                "chunk_start": int(task["chunk_start"]),
+                "chunk_stop": int(task["chunk_stop"]),
+                "status": task["status"],
+                "attempts": int(task["attempts"]),
+                "worker": task.get("worker"),
+                "result": json.loads(task["result"]) if task.get("result") else None,
+                "error": task.get("error") or None,
+            })
+        return tasks
+
+
+def create_job_queue(url: Optional[str] = None) -> JobQueue:
+    """Open the queue at `url` (JOB_QUEUE_URL by default)"""
+    url = url or JOB_QUEUE_URL
+    if url.startswith("sqlite:///"):
+        return SQLiteJobQueue(Path(url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(url)
+    raise ValueError(f"Unsupported JOB_QUEUE_URL '{url}'; use sqlite:///path or redis://host:port/db")
@@ -0,0 +1,160 @@
+import os
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter
+
+from services.startup import lazy_module
+
+fitz = lazy_module("fitz")  # Renders grayscale pages straight into an 8-bit buffer
+PYMUPDF_AVAILABLE = fitz is not None
+pdf2image = lazy_module("pdf2image")
+
+# Pixel format handed to Tesseract:
+#   "rgb"    - full-color pages from pdf2image (the original pipeline)
+#   "gray"   - 8-bit grayscale from the renderer, a third of the bytes of RGB
+#   "binary" - 1-bit after adaptive thresholding, 1/24 of the bytes of RGB
+OCR_RASTER_MODE = os.getenv("OCR_RASTER_MODE", "gray").lower()
+# Crop blank page margins before OCR; word coordinates are shifted back onto the page
+OCR_CROP_MARGINS = os.getenv("OCR_CROP_MARGINS", "true").lower() in ("1", "true", "yes")
+# Pixels lighter than this count as blank when finding margins
+OCR_MARGIN_THRESHOLD = 245
+# White border kept around the content, in inches; Tesseract reads text touching the edge poorly
+OCR_MARGIN_PADDING_INCHES = 0.1
+# A pixel is ink when it is this much darker than the mean of its neighbourhood
+OCR_BINARIZE_OFFSET = int(os.getenv("OCR_BINARIZE_OFFSET", "12"))
+# Neighbourhood radius for the local mean, in inches (about one line of body text)
+OCR_BINARIZE_RADIUS_INCHES = 0.08
+
+RASTER_MODES = ("rgb", "gray", "binary")
+
+
+class PageRaster:
+    """
+    An OCR-ready page image plus where it sits on the full page.
+    `image` may be cropped to the page's content; (offset_x, offset_y) is its top-left
+    corner and (width, height) the size of the whole page, both in pixels at `dpi`.
+    """
+
+    __slots__ = ("image", "dpi", "offset_x", "offset_y", "width", "height")
+
+    def __init__(self, image: Image.Image, dpi: int, offset_x: int = 0, offset_y: int = 0,
+                 width: Optional[int] = None, height: Optional[int] = None):
+        self.image = image
+        self.dpi = dpi
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.width = image.width if width is None else width
+        self.height = image.height if height is None else height
+
+    @property
+    def nbytes(self) -> int:
+        bits = {"1": 1, "L": 8}.get(self.image.mode, 24)
+        return self.image.width * self.image.height * bits // 8
+
+
+def raster_mode(mode: Optional[str] = None) -> str:
+    mode = (mode or OCR_RASTER_MODE).lower()
+    if mode not in RASTER_MODES:
+        print(f"Warning: Unknown OCR_RASTER_MODE '{mode}', using gray")
+        return "gray"
+    return mode
+
+
+def page_count(pdf_path: str) -> int:
+    if PYMUPDF_AVAILABLE:
+        doc = fitz.open(pdf_path)
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+    return int(pdf2image.pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_pages(pdf_path: str, dpi: int, mode: str, pages: Optional[List[int]] = None) -> List[Image.Image]:
+    """
+    Rasterize all pages (or only `pages`, 0-based) in the renderer's pixel format for `mode`.
+    Grayscale comes straight from the renderer rather than converting RGB afterwards.
+    """
+    if mode != "rgb" and PYMUPDF_AVAILABLE:
+        doc = fitz.open(pdf_path)
+        try:
+            images = []
+            for number in (range(doc.page_count) if pages is None else pages):
+                pix = doc[number].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+                images.append(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+            return images
+        finally:
+            doc.close()
+    grayscale = mode != "rgb"
+    if pages is None:
+        return pdf2image.convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale, thread_count=2)
+    if pages and list(pages) == list(range(pages[0], pages[-1] + 1)):
+        # A run of consecutive pages is one poppler call
+        return pdf2image.convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale, thread_count=2,
+                                           first_page=pages[0] + 1, last_page=pages[-1] + 1)
+    return [
+        pdf2image.convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale, first_page=number + 1, last_page=number + 1)[0]
+        for number in pages
+    ]
+
+
+def render_clip(page, clip, dpi: int, mode: str, display_list=None) -> Image.Image:
+    """
+    Rasterize a clip of a PyMuPDF page in the pixel format for `mode`.
+    Pass the page's display list when rendering several clips, so the page's
+    content is interpreted once instead of once per clip.
+    """
+    source = display_list if display_list is not None else page
+    matrix = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    if mode == "rgb":
+        pix = source.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    pix = source.get_pixmap(matrix=matrix, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return binarize(image, dpi) if mode == "binary" else image
+
+
+def binarize(gray: Image.Image, dpi: int) -> Image.Image:
+    """
+    Adaptive threshold: ink is whatever is clearly darker than its local mean,
+    so uneven backgrounds (scans, shaded boxes) do not turn into black blobs.
+    """
+    if gray.mode != "L":
+        gray = gray.convert("L")
+    radius = max(2, int(round(dpi * OCR_BINARIZE_RADIUS_INCHES)))
+    local_mean = gray.filter(ImageFilter.BoxBlur(radius))
+    # mean - pixel, clipped at 0: how much darker each pixel is than its surroundings
+    darker = ImageChops.subtract(local_mean, gray)
+    offset = OCR_BINARIZE_OFFSET
+    return darker.point(lambda v: 0 if v > offset else 255, mode="1")
+
+
+def content_box(image: Image.Image, dpi: int) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the non-blank pixels plus padding, or None for a blank page"""
+    if image.mode == "1":
+        ink = ImageChops.invert(image.convert("L"))
+    else:
+        gray = image if image.mode == "L" else image.convert("L")
+        threshold = OCR_MARGIN_THRESHOLD
+        ink = gray.point(lambda v: 255 if v < threshold else 0)
+    box = ink.getbbox()
+    if box is None:
+        return None
+    pad = int(round(dpi * OCR_MARGIN_PADDING_INCHES))
+    return (max(0, box[0] - pad), max(0, box[1] - pad),
+            min(image.width, box[2] + pad), min(image.height, box[3] + pad))
+
+
+def prepare(image: Image.Image, dpi: int, mode: str, crop: bool = OCR_CROP_MARGINS) -> PageRaster:
+    """Turn a rendered page into a PageRaster: threshold for "binary" mode and crop blank margins"""
+    width, height = image.width, image.height
+    if mode == "binary":
+        image = binarize(image, dpi)
+    elif mode == "gray" and image.mode != "L":
+        image = image.convert("L")
+    if not crop:
+        return PageRaster(image, dpi)
+    box = content_box(image, dpi)
+    if box is None or box == (0, 0, width, height):
+        return PageRaster(image, dpi)
+    return PageRaster(image.crop(box), dpi, box[0], box[1], width, height)
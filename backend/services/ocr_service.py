@@ -1,25 +1,122 @@
-import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from pathlib import Path
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
+import json
+import math
 import os
 import shutil
+from services import profiling_service
+from services.admission_service import Cost, estimate_ocr
+from services.coordinates import DEFAULT_OCR_DPI, pixels_to_points, points_to_pixels
+from services.startup import lazy_module, SERVER_WORKERS
+from services.tesseract_engine import TesseractEngine
+from services.ocr_raster import OCR_CROP_MARGINS, PageRaster, page_count, prepare, raster_mode, render_clip, render_pages
+from services.page_hash import cached_page_hashes
+from services.section_store import carry_over_ids
+
+# Only used for the version check during Tesseract discovery
+pytesseract = lazy_module("pytesseract")
+pdf2image = lazy_module("pdf2image")
+
+fitz = lazy_module("fitz")  # PyMuPDF renders page regions without rasterizing the whole page
+PYMUPDF_AVAILABLE = fitz is not None
+
+# Resolution limits for per-request DPI
+OCR_MIN_DPI = 72
+OCR_MAX_DPI = 600
+# First-pass resolution when the DPI is chosen automatically
+OCR_AUTO_BASE_DPI = int(os.getenv("OCR_AUTO_BASE_DPI", "150"))
+# Pages whose median word height falls below OCR_MIN_TEXT_PX are re-rasterized
+# at the DPI that brings it to OCR_TARGET_TEXT_PX. Word boxes span the ink, so 9-12pt
+# body text measures 14-19px at 150 DPI and reads fine; only print of about 6pt and
+# below is re-rendered, everything else relies on the region retries below
+OCR_MIN_TEXT_PX = int(os.getenv("OCR_MIN_TEXT_PX", "10"))
+OCR_TARGET_TEXT_PX = int(os.getenv("OCR_TARGET_TEXT_PX", "20"))
+# Words below OCR_RETRY_CONFIDENCE are re-read from an OCR_RETRY_DPI render of their region
+# (0 retries per page turns this off)
+OCR_RETRY_DPI = int(os.getenv("OCR_RETRY_DPI", "300"))
+OCR_RETRY_CONFIDENCE = int(os.getenv("OCR_RETRY_CONFIDENCE", "60"))
+OCR_MAX_RETRIES_PER_PAGE = int(os.getenv("OCR_MAX_RETRIES_PER_PAGE", "8"))
+# Words at or below this confidence are dropped
+OCR_MIN_CONFIDENCE = 30
+# A horizontal gap wider than this many word heights splits a line into separate sections (columns)
+OCR_COLUMN_GAP_FACTOR = float(os.getenv("OCR_COLUMN_GAP_FACTOR", "2.0"))
+# Default resolution for region-of-interest re-scans
+OCR_REGION_DPI = int(os.getenv("OCR_REGION_DPI", "300"))
+# Pages rasterized together; the next batch renders while the current one is OCR'd
+OCR_RENDER_BATCH = max(1, int(os.getenv("OCR_RENDER_BATCH", "4")))
+# Threads running OCR (each holds its own in-process engine when tesserocr is used),
+# split between the server processes by default
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, 4 // SERVER_WORKERS))))
+# OCR page rasters waiting to be written to the preview cache; OCR waits for the oldest beyond this
+OCR_RASTER_STORE_PENDING = 4
+# Result of Tesseract discovery (tessdata location, version), reused while the binary is unchanged
+TESSERACT_DISCOVERY_CACHE = Path(os.getenv("TESSERACT_DISCOVERY_CACHE", "tesseract_discovery.json"))
 
 class OCRService:
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=4)
-        # Configure Tesseract data path
+        self.executor = ThreadPoolExecutor(max_workers=OCR_WORKERS)
+        # Optional PageRenderService that keeps OCR page rasters for preview rendering
+        self.raster_cache = None
+        # Rasters are PNG-encoded on their own thread, so saving them does not take an OCR thread
+        self.raster_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-raster")
+        self._raster_stores = set()
+        # Pixel format of page rasters handed to Tesseract (OCR_RASTER_MODE)
+        self.raster_mode = raster_mode()
+        # Tesseract discovery runs subprocesses, so its result is cached across restarts
+        discovery = self._load_tesseract_discovery()
+        if discovery is None:
+            discovery = self._discover_tesseract()
+        elif discovery.get("tessdata_prefix") and not os.environ.get("TESSDATA_PREFIX"):
+            os.environ["TESSDATA_PREFIX"] = discovery["tessdata_prefix"]
+            print(f"Set TESSDATA_PREFIX to: {discovery['tessdata_prefix']} (cached)")
+        if discovery.get("version"):
+            print(f"Tesseract OCR is available (version: {discovery['version']})")
+        else:
+            print(f"Warning: Tesseract OCR check failed: {discovery.get('error')}")
+            print("Make sure Tesseract is installed and in PATH")
+        # In-process engines (when tesserocr is installed) are loaded on the OCR threads now
+        self.engine = TesseractEngine()
+        self.engine.warm(self.executor, OCR_WORKERS)
+    
+    @staticmethod
+    def _tesseract_fingerprint() -> Dict:
+        """Identifies the Tesseract install; the cached discovery is reused while it is unchanged"""
+        tesseract_cmd = shutil.which("tesseract")
+        try:
+            mtime = os.stat(tesseract_cmd).st_mtime_ns if tesseract_cmd else None
+        except OSError:
+            mtime = None
+        return {"tesseract_cmd": tesseract_cmd, "mtime_ns": mtime, "env_tessdata_prefix": os.environ.get("TESSDATA_PREFIX")}
+    
+    def _load_tesseract_discovery(self) -> Optional[Dict]:
+        try:
+            with open(TESSERACT_DISCOVERY_CACHE, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("fingerprint") != self._tesseract_fingerprint():
+            return None
+        return cached
+    
+    def _discover_tesseract(self) -> Dict:
+        """Locate tessdata and check the Tesseract version, then cache the result"""
+        fingerprint = self._tesseract_fingerprint()
         self._configure_tesseract()
-        # Check if Tesseract is available
+        discovery = {"fingerprint": fingerprint, "tessdata_prefix": os.environ.get("TESSDATA_PREFIX"), "version": None}
         try:
-            version = pytesseract.get_tesseract_version()
-            print(f"Tesseract OCR is available (version: {version})")
+            discovery["version"] = str(pytesseract.get_tesseract_version())
         except Exception as e:
-            print(f"Warning: Tesseract OCR check failed: {e}")
-            print("Make sure Tesseract is installed and in PATH")
+            discovery["error"] = str(e)
+        try:
+            tmp_path = TESSERACT_DISCOVERY_CACHE.with_name(TESSERACT_DISCOVERY_CACHE.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(discovery, f)
+            os.replace(tmp_path, TESSERACT_DISCOVERY_CACHE)
+        except OSError as e:
+            print(f"Warning: Could not cache Tesseract discovery: {e}")
+        return discovery
     
     def _configure_tesseract(self):
         """Configure Tesseract data path for different environments"""
@@ -86,88 +183,20 @@ class OCRService:
         
         print("Warning: Could not automatically detect TESSDATA_PREFIX. Tesseract may not work correctly.")
     
-    async def process_pdf(self, pdf_path: Path) -> List[Dict]:
-        """Process PDF with OCR and return text sections with coordinates"""
+    async def process_pdf(self, pdf_path: Path, dpi: Optional[int] = None, pages: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Process PDF with OCR and return text sections with coordinates.
+        dpi: rasterization resolution; when omitted it is chosen per page from
+             the text size found in a low-resolution first pass.
+        pages: 0-based pages to OCR (all pages if omitted)
+        Section coordinates are pixels at the section's own "dpi", and each
+        section carries its page size in PDF points ("page_width"/"page_height").
+        """
         try:
             print(f"Starting OCR processing for: {pdf_path}")
-            loop = asyncio.get_event_loop()
-            
-            # Convert PDF to images
-            print("Converting PDF to images...")
-            images = await loop.run_in_executor(
-                self.executor,
-                self._convert_pdf_to_images,
-                str(pdf_path)
-            )
-            print(f"Converted {len(images)} pages to images")
-            
             sections = []
-            
-            for page_num, image in enumerate(images):
-                # Get OCR data with bounding boxes
-                # Specify language explicitly (default to 'eng' for English)
-                ocr_data = await loop.run_in_executor(
-                    self.executor,
-                    lambda img: pytesseract.image_to_data(
-                        img,
-                        lang='eng',  # Explicitly set language
-                        output_type=pytesseract.Output.DICT
-                    ),
-                    image
-                )
-                
-                # Process OCR results
-                current_text = ""
-                current_x = 0
-                current_y = 0
-                current_width = 0
-                current_height = 0
-                
-                for i in range(len(ocr_data['text'])):
-                    text = ocr_data['text'][i].strip()
-                    if text:
-                        conf = int(ocr_data['conf'][i])
-                        if conf > 30:  # Confidence threshold
-                            x = ocr_data['left'][i]
-                            y = ocr_data['top'][i]
-                            w = ocr_data['width'][i]
-                            h = ocr_data['height'][i]
-                            
-                            # Group nearby text into sections
-                            if current_text and abs(y - current_y) < 10:
-                                current_text += " " + text
-                                current_width = max(current_width, x + w - current_x)
-                                current_height = max(current_height, y + h - current_y)
-                            else:
-                                if current_text:
-                                    sections.append({
-                                        "id": f"section_{len(sections)}",
-                                        "text": current_text,
-                                        "x": current_x,
-                                        "y": current_y,
-                                        "width": current_width,
-                                        "height": current_height,
-                                        "page": page_num
-                                    })
-                                
-                                current_text = text
-                                current_x = x
-                                current_y = y
-                                current_width = w
-                                current_height = h
-                
-                # Add last section
-                if current_text:
-                    sections.append({
-                        "id": f"section_{len(sections)}",
-                        "text": current_text,
-                        "x": current_x,
-                        "y": current_y,
-                        "width": current_width,
-                        "height": current_height,
-                        "page": page_num
-                    })
-            
+            async for _page_num, page_sections in self.iter_pages(pdf_path, dpi=dpi, pages=pages):
+                sections.extend(page_sections)
             print(f"OCR processing complete. Found {len(sections)} text sections")
             return sections
         except Exception as e:
@@ -176,17 +205,524 @@ class OCRService:
             print(f"Traceback: {traceback.format_exc()}")
             raise
     
-    def _convert_pdf_to_images(self, pdf_path: str):
-        """Convert PDF to images with error handling"""
+    async def iter_pages(self, pdf_path: Path, dpi: Optional[int] = None, pages: Optional[List[int]] = None,
+                         start_index: int = 0) -> AsyncIterator[Tuple[int, List[Dict]]]:
+        """
+        Yield (page number, sections) for each page as soon as it is OCR'd, in page order.
+        Pages are rasterized OCR_RENDER_BATCH at a time, the next batch while the current
+        one is read, so the first page is ready without rendering the whole document.
+        Arguments are as for process_pdf; section ids are numbered from `start_index`.
+        """
+        loop = asyncio.get_event_loop()
+        auto_dpi = dpi is None
+        base_dpi = OCR_AUTO_BASE_DPI if auto_dpi else self._clamp_dpi(dpi)
+        if pages is None:
+            pages = list(range(await loop.run_in_executor(self.executor, page_count, str(pdf_path))))
+        batches = [list(pages[i:i + OCR_RENDER_BATCH]) for i in range(0, len(pages), OCR_RENDER_BATCH)]
+        print(f"Converting {len(pages)} pages to {self.raster_mode} images at {base_dpi} DPI{' (auto)' if auto_dpi else ''}, {OCR_RENDER_BATCH} at a time...")
+        
+        def render(batch):
+            return loop.run_in_executor(
+                self.executor,
+                profiling_service.bind(self._convert_pdf_to_images),
+                str(pdf_path),
+                base_dpi,
+                batch
+            )
+        
+        section_index = start_index
+        next_render = render(batches[0]) if batches else None
+        for batch_index, batch in enumerate(batches):
+            with profiling_service.stage("ocr.rasterize"):
+                images = await next_render
+            next_render = render(batches[batch_index + 1]) if batch_index + 1 < len(batches) else None
+            
+            for index, page_num in enumerate(batch):
+                # Drop each full page render as soon as it is prepared to keep peak memory down
+                image, images[index] = images[index], None
+                page_dpi = base_dpi
+                raster = prepare(image, page_dpi, self.raster_mode)
+                words = await self._ocr_raster(raster)
+                
+                # Small text OCRs poorly at the base resolution: re-rasterize just this page
+                if auto_dpi:
+                    target_dpi = self._select_page_dpi(words, base_dpi)
+                    if target_dpi > base_dpi:
+                        print(f"  Page {page_num + 1}: small text detected, re-rasterizing at {target_dpi} DPI")
+                        with profiling_service.stage("ocr.rasterize"):
+                            image = await loop.run_in_executor(
+                                self.executor,
+                                profiling_service.bind(self._convert_page_to_image),
+                                str(pdf_path),
+                                page_num,
+                                target_dpi
+                            )
+                        page_dpi = target_dpi
+                        raster = prepare(image, page_dpi, self.raster_mode)
+                        words = await self._ocr_raster(raster)
+                
+                if self.raster_cache is not None:
+                    # The unthresholded render: grayscale unless OCR_RASTER_MODE=rgb
+                    await self._store_raster(pdf_path, page_num, page_dpi, image)
+                page_width = pixels_to_points(raster.width, page_dpi)
+                page_height = pixels_to_points(raster.height, page_dpi)
+                del image, raster
+                words = await self._retry_low_confidence(pdf_path, page_num, words, page_dpi)
+                page_sections = self._group_words(words, page_num, section_index, page_dpi, page_width, page_height)
+                section_index += len(page_sections)
+                yield page_num, page_sections
+    
+    async def _store_raster(self, pdf_path: Path, page_num: int, dpi: int, image):
+        """Hand a page raster to the preview cache in the background; OCR only waits when too many are queued"""
+        self._raster_stores = {future for future in self._raster_stores if not future.done()}
+        while len(self._raster_stores) >= OCR_RASTER_STORE_PENDING:
+            await asyncio.wait([asyncio.wrap_future(future) for future in self._raster_stores],
+                               return_when=asyncio.FIRST_COMPLETED)
+            self._raster_stores = {future for future in self._raster_stores if not future.done()}
+        future = self.raster_executor.submit(self.raster_cache.store_raster, pdf_path, page_num, dpi, image)
+        future.add_done_callback(self._raster_stored)
+        self._raster_stores.add(future)
+    
+    @staticmethod
+    def _raster_stored(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Warning: Could not cache OCR raster: {future.exception()}")
+    
+    def estimate_cost(self, pdf_path: Path, dpi: Optional[int] = None) -> Cost:
+        """Memory and CPU an OCR run of this PDF is expected to hold, for admission control"""
+        if dpi is None:
+            # Pages with small text are re-rendered at a higher DPI; OCR_RETRY_DPI is the usual ceiling
+            base_dpi, peak_dpi = OCR_AUTO_BASE_DPI, max(OCR_AUTO_BASE_DPI, self._clamp_dpi(OCR_RETRY_DPI))
+        else:
+            base_dpi = peak_dpi = self._clamp_dpi(dpi)
+        # The batch being OCR'd and the next one being rendered
+        return estimate_ocr(pdf_path, base_dpi, peak_dpi, self.raster_mode, OCR_WORKERS, 2 * OCR_RENDER_BATCH)
+    
+    def ocr_settings(self, dpi: Optional[int] = None) -> str:
+        """The settings that affect OCR results; page hashes are salted with them"""
+        return f"dpi={dpi or 'auto'}|raster={self.raster_mode}|crop={OCR_CROP_MARGINS}|lang={self.engine.lang}"
+    
+    async def process_pdf_incremental(
+        self,
+        pdf_path: Path,
+        dpi: Optional[int] = None,
+        previous_sections: Optional[List[Dict]] = None,
+        previous_hashes: Optional[List[str]] = None
+    ) -> Dict:
+        """
+        Like process_pdf, but pages whose content hash matches a page of a previous
+        version (previous_sections/previous_hashes, as saved for that version) reuse its
+        sections instead of being OCR'd again. Sections of re-OCR'd pages keep the ids of
+        matching sections of the previous version where possible.
+        Returns {"sections", "page_hashes", "reused_pages", "ocr_pages"}; without PyMuPDF
+        page_hashes and ocr_pages are None and every page is OCR'd.
+        """
+        sections = []
+        async for event in self.iter_incremental(pdf_path, dpi, previous_sections, previous_hashes):
+            if event["event"] == "start":
+                result = {key: event[key] for key in ("page_hashes", "reused_pages", "ocr_pages")}
+            elif event["event"] == "page":
+                sections.extend(event["sections"])
+        # Stable sort: sections keep their order within a page
+        sections.sort(key=lambda section: section.get("page", 0))
+        return {"sections": sections, **result}
+    
+    async def iter_incremental(
+        self,
+        pdf_path: Path,
+        dpi: Optional[int] = None,
+        previous_sections: Optional[List[Dict]] = None,
+        previous_hashes: Optional[List[str]] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        process_pdf_incremental as a stream of events:
+          {"event": "start", "pages", "page_hashes", "reused_pages", "ocr_pages"}
+          {"event": "page", "page", "sections", "reused", "completed", "total"} once per page:
+              reused pages first, then each OCR'd page as soon as it is done
+        """
+        loop = asyncio.get_event_loop()
+        with profiling_service.stage("ocr.page_hash"):
+            hashes = await loop.run_in_executor(
+                self.executor, profiling_service.bind(cached_page_hashes), pdf_path, self.ocr_settings(dpi)
+            )
+        if hashes is None:
+            total = await loop.run_in_executor(self.executor, page_count, str(pdf_path))
+            yield {"event": "start", "pages": total, "page_hashes": None, "reused_pages": [], "ocr_pages": None}
+            completed = 0
+            async for page_num, page_sections in self.iter_pages(pdf_path, dpi=dpi):
+                completed += 1
+                yield {"event": "page", "page": page_num, "sections": page_sections, "reused": False,
+                       "completed": completed, "total": total}
+            return
+        
+        # Match pages to previous pages by hash; a page may have moved
+        unmatched: Dict[str, List[int]] = {}
+        if previous_sections is not None and previous_hashes:
+            for previous_page, page_hash in enumerate(previous_hashes):
+                unmatched.setdefault(page_hash, []).append(previous_page)
+        reused: Dict[int, int] = {}
+        for page_num, page_hash in enumerate(hashes):
+            if unmatched.get(page_hash):
+                reused[page_num] = unmatched[page_hash].pop(0)
+        changed = [page_num for page_num in range(len(hashes)) if page_num not in reused]
+        print(f"Incremental OCR: {len(reused)} unchanged pages reused, {len(changed)} to OCR")
+        total = len(hashes)
+        yield {"event": "start", "pages": total, "page_hashes": hashes, "reused_pages": sorted(reused), "ocr_pages": changed}
+        
+        completed = 0
+        taken = set()
+        if reused:
+            by_page: Dict[int, List[Dict]] = {}
+            for section in previous_sections:
+                by_page.setdefault(section.get("page", 0), []).append(section)
+            for page_num, previous_page in reused.items():
+                page_sections = [{**section, "page": page_num} for section in by_page.get(previous_page, [])]
+                taken.update(section["id"] for section in page_sections)
+                completed += 1
+                yield {"event": "page", "page": page_num, "sections": page_sections, "reused": True,
+                       "completed": completed, "total": total}
+        
+        if changed:
+            counterparts = {}
+            if previous_sections:
+                # A changed page's counterpart is next to the previous page of a reused neighbour
+                reused_previous = set(reused.values())
+                for page_num in changed:
+                    if page_num - 1 in reused:
+                        counterpart = reused[page_num - 1] + 1
+                    elif page_num + 1 in reused:
+                        counterpart = reused[page_num + 1] - 1
+                    else:
+                        counterpart = page_num
+                    if 0 <= counterpart < len(previous_hashes or []) and counterpart not in reused_previous:
+                        counterparts[page_num] = counterpart
+            async for page_num, page_sections in self.iter_pages(pdf_path, dpi=dpi, pages=changed):
+                if previous_sections:
+                    page_sections = carry_over_ids(page_sections, previous_sections, counterparts, taken)
+                    taken.update(section["id"] for section in page_sections)
+                completed += 1
+                yield {"event": "page", "page": page_num, "sections": page_sections, "reused": False,
+                       "completed": completed, "total": total}
+    
+    async def process_region(self, pdf_path: Path, page_num: int, rect: Tuple[float, float, float, float], dpi: Optional[int] = None) -> List[Dict]:
+        """
+        OCR only a rectangle of one page at high DPI.
+        rect: (x0, top, x1, bottom) in PDF points from the top-left of the page
+        Returns sections in the same shape as process_pdf, with pixel
+        coordinates relative to the whole page at the region's DPI.
+        """
+        loop = asyncio.get_event_loop()
+        dpi = self._clamp_dpi(dpi or OCR_REGION_DPI)
+        print(f"OCR re-scan of page {page_num + 1} region {tuple(round(v, 1) for v in rect)} at {dpi} DPI")
+        
+        page_width, page_height = await loop.run_in_executor(
+            self.executor, self._page_size, str(pdf_path), page_num
+        )
+        x0, top, x1, bottom = rect
+        rect = (max(0.0, x0), max(0.0, top), min(page_width, x1), min(page_height, bottom))
+        if rect[2] <= rect[0] or rect[3] <= rect[1]:
+            raise ValueError("Region does not overlap the page")
+        
+        with profiling_service.stage("ocr.rasterize"):
+            region = await loop.run_in_executor(
+                self.executor,
+                profiling_service.bind(self._render_region),
+                str(pdf_path),
+                page_num,
+                rect,
+                dpi
+            )
+        words = await self._ocr_words(region)
+        
+        # Shift crop-relative pixels onto the page
+        offset_x = int(round(points_to_pixels(rect[0], dpi)))
+        offset_y = int(round(points_to_pixels(rect[1], dpi)))
+        for word in words:
+            word["left"] += offset_x
+            word["top"] += offset_y
+        sections = self._group_words(words, page_num, 0, dpi, page_width, page_height)
+        print(f"Region re-scan found {len(sections)} sections")
+        return sections
+    
+    def _page_size(self, pdf_path: str, page_num: int) -> Tuple[float, float]:
+        """Size of a page in PDF points"""
+        if PYMUPDF_AVAILABLE:
+            doc = fitz.open(pdf_path)
+            try:
+                if not 0 <= page_num < len(doc):
+                    raise ValueError(f"Page {page_num} does not exist")
+                rect = doc[page_num].rect
+                return rect.width, rect.height
+            finally:
+                doc.close()
+        if not 0 <= page_num < int(pdf2image.pdfinfo_from_path(pdf_path).get("Pages", 0)):
+            raise ValueError(f"Page {page_num} does not exist")
+        # At 72 DPI one pixel is one point
+        image = self._convert_page_to_image(pdf_path, page_num, 72)
+        return float(image.width), float(image.height)
+    
+    @staticmethod
+    def _clamp_dpi(dpi: int) -> int:
+        return max(OCR_MIN_DPI, min(int(dpi), OCR_MAX_DPI))
+    
+    async def _ocr_raster(self, raster: PageRaster) -> List[Dict]:
+        """OCR a prepared page raster, with word boxes in whole-page pixels"""
+        words = await self._ocr_words(raster.image)
+        if raster.offset_x or raster.offset_y:
+            for word in words:
+                word["left"] += raster.offset_x
+                word["top"] += raster.offset_y
+        return words
+    
+    async def _ocr_words(self, image, config: str = "") -> List[Dict]:
+        """Run Tesseract on an image and return its recognized words"""
+        loop = asyncio.get_event_loop()
+        # Get OCR data with bounding boxes
+        with profiling_service.stage("ocr.tesseract"):
+            ocr_data = await loop.run_in_executor(
+                self.executor,
+                profiling_service.bind(self.engine.image_to_data),
+                image,
+                config
+            )
+        
+        # Walk Tesseract's columnar output in one zip instead of indexing each list per word
+        count = len(ocr_data['text'])
+        blocks = ocr_data.get('block_num') or [0] * count
+        pars = ocr_data.get('par_num') or [0] * count
+        lines = ocr_data.get('line_num') or [None] * count
+        words = []
+        for text, conf, left, top, width, height, block, par, line in zip(
+            ocr_data['text'], ocr_data['conf'], ocr_data['left'], ocr_data['top'],
+            ocr_data['width'], ocr_data['height'], blocks, pars, lines
+        ):
+            text = text.strip()
+            if text:
+                words.append({
+                    "text": text,
+                    "conf": int(float(conf)),
+                    "left": left,
+                    "top": top,
+                    "width": width,
+                    "height": height,
+                    "block_num": block,
+                    "par_num": par,
+                    "line_num": line,
+                })
+        return words
+    
+    def _select_page_dpi(self, words: List[Dict], dpi: int) -> int:
+        """Pick the DPI at which this page's typical word height reaches OCR_TARGET_TEXT_PX"""
+        heights = sorted(w["height"] for w in words if w["conf"] > OCR_MIN_CONFIDENCE)
+        if not heights:
+            # Nothing legible at the base resolution: the text may simply be too small
+            return self._clamp_dpi(OCR_RETRY_DPI) if words else dpi
+        median_height = heights[len(heights) // 2]
+        if median_height >= OCR_MIN_TEXT_PX:
+            return dpi
+        target = dpi * OCR_TARGET_TEXT_PX / max(median_height, 1)
+        # Round up to a multiple of 50 so renders are reusable across pages
+        return self._clamp_dpi(int(math.ceil(target / 50.0) * 50))
+    
+    async def _retry_low_confidence(self, pdf_path: Path, page_num: int, words: List[Dict], page_dpi: int) -> List[Dict]:
+        """
+        Re-OCR low-confidence words from a higher-DPI render of just their region.
+        Retried words replace the original ones when Tesseract is more confident,
+        and are mapped back to page_dpi pixels so the page keeps a single scale.
+        """
+        retry_dpi = self._clamp_dpi(OCR_RETRY_DPI)
+        if page_dpi >= retry_dpi:
+            return words
+        candidates = [w for w in words if 0 <= w["conf"] < OCR_RETRY_CONFIDENCE]
+        candidates = sorted(candidates, key=lambda w: w["conf"])[:OCR_MAX_RETRIES_PER_PAGE]
+        if not candidates:
+            return words
+        
+        print(f"  Page {page_num + 1}: retrying {len(candidates)} low-confidence words at {retry_dpi} DPI")
+        loop = asyncio.get_event_loop()
+        rects = []
+        for word in candidates:
+            pad = word["height"] * 0.5
+            rects.append((
+                pixels_to_points(max(0, word["left"] - pad), page_dpi),
+                pixels_to_points(max(0, word["top"] - pad), page_dpi),
+                pixels_to_points(word["left"] + word["width"] + pad, page_dpi),
+                pixels_to_points(word["top"] + word["height"] + pad, page_dpi),
+            ))
+        try:
+            # All regions of the page in one call, from one interpretation of the page
+            with profiling_service.stage("ocr.retry_rasterize"):
+                regions = await loop.run_in_executor(
+                    self.executor,
+                    profiling_service.bind(self._render_regions),
+                    str(pdf_path),
+                    page_num,
+                    rects,
+                    retry_dpi
+                )
+        except Exception as e:
+            print(f"    Retry rendering failed: {e}")
+            return words
+        # A single padded word is best read as one text line
+        results = await asyncio.gather(
+            *(self._ocr_words(region, config="--psm 7") for region in regions),
+            return_exceptions=True
+        )
+        
+        replacements = {}
+        scale = page_dpi / retry_dpi
+        for word, rect, retried in zip(candidates, rects, results):
+            if isinstance(retried, Exception):
+                print(f"    Retry failed for '{word['text']}': {retried}")
+                continue
+            if not retried or max(w["conf"] for w in retried) <= word["conf"]:
+                continue
+            offset_x = points_to_pixels(rect[0], page_dpi)
+            offset_y = points_to_pixels(rect[1], page_dpi)
+            # Retried words stay on the original word's Tesseract line
+            replacements[id(word)] = [{
+                **w,
+                "block_num": word["block_num"],
+                "par_num": word["par_num"],
+                "line_num": word["line_num"],
+                "left": int(round(offset_x + w["left"] * scale)),
+                "top": int(round(offset_y + w["top"] * scale)),
+                "width": int(round(w["width"] * scale)),
+                "height": int(round(w["height"] * scale)),
+            } for w in retried]
+        
+        if not replacements:
+            return words
+        print(f"    Improved {len(replacements)} words with high-DPI retry")
+        merged = []
+        for word in words:
+            merged.extend(replacements.get(id(word), [word]))
+        return merged
+    
+    def _group_words(self, words: List[Dict], page_num: int, start_index: int, dpi: int, page_width: float, page_height: float) -> List[Dict]:
+        """
+        Group words on one page into text sections.
+        Words are sorted once by Tesseract's (block, paragraph, line) layout and
+        left edge, then swept left to right: a section ends at a line change or
+        at a horizontal gap wide enough to be a column break.
+        """
+        with profiling_service.stage("ocr.group"):
+            words = [w for w in words if w["conf"] > OCR_MIN_CONFIDENCE]  # Confidence threshold
+            if not words:
+                return []
+            if any(w.get("line_num") is None for w in words):
+                self._assign_lines(words)
+            words.sort(key=lambda w: (w["block_num"], w["par_num"], w["line_num"], w["left"]))
+            
+            sections = []
+            current = None
+            for word in words:
+                key = (word["block_num"], word["par_num"], word["line_num"])
+                right = word["left"] + word["width"]
+                bottom = word["top"] + word["height"]
+                if (
+                    current is not None
+                    and key == current["key"]
+                    and word["left"] - current["right"] <= OCR_COLUMN_GAP_FACTOR * max(current["line_height"], word["height"])
+                ):
+                    current["words"].append(word["text"])
+                    current["right"] = max(current["right"], right)
+                    current["top"] = min(current["top"], word["top"])
+                    current["bottom"] = max(current["bottom"], bottom)
+                    current["line_height"] = max(current["line_height"], word["height"])
+                    continue
+                if current is not None:
+                    sections.append(current)
+                current = {
+                    "key": key,
+                    "words": [word["text"]],
+                    "left": word["left"],
+                    "top": word["top"],
+                    "right": right,
+                    "bottom": bottom,
+                    "line_height": word["height"],
+                }
+            sections.append(current)
+            
+            return [{
+                "id": f"section_{start_index + i}",
+                "text": " ".join(section["words"]),
+                "x": section["left"],
+                "y": section["top"],
+                "width": section["right"] - section["left"],
+                "height": section["bottom"] - section["top"],
+                "page": page_num,
+                "dpi": dpi,
+                "page_width": round(page_width, 2),
+                "page_height": round(page_height, 2)
+            } for i, section in enumerate(sections)]
+    
+    @staticmethod
+    def _assign_lines(words: List[Dict]):
+        """
+        Cluster words into lines by vertical position when the OCR output has no
+        line numbers: sort by vertical centre and start a new line whenever a word's
+        centre is more than half a word height below the current line's.
+        """
+        ordered = sorted(words, key=lambda w: w["top"] + w["height"] / 2)
+        line = -1
+        line_center = None
+        for word in ordered:
+            center = word["top"] + word["height"] / 2
+            if line_center is None or center - line_center > word["height"] / 2:
+                line += 1
+                line_center = center
+            word["block_num"] = word.get("block_num") or 0
+            word["par_num"] = word.get("par_num") or 0
+            word["line_num"] = line
+    
+    def _convert_pdf_to_images(self, pdf_path: str, dpi: int = DEFAULT_OCR_DPI, pages: Optional[List[int]] = None):
+        """Convert PDF pages (all, or the 0-based `pages`) to images with error handling"""
         try:
             # Check if poppler is available
-            images = convert_from_path(
-                pdf_path,
-                dpi=200,  # Lower DPI for faster processing
-                thread_count=2
-            )
-            return images
+            return render_pages(pdf_path, dpi, self.raster_mode, pages)
         except Exception as e:
             print(f"Error converting PDF to images: {e}")
             raise Exception(f"Failed to convert PDF to images. Make sure poppler-utils is installed. Error: {str(e)}")
-
+    
+    def _convert_page_to_image(self, pdf_path: str, page_num: int, dpi: int):
+        """Rasterize a single page (0-based) at the given DPI"""
+        try:
+            return render_pages(pdf_path, dpi, self.raster_mode, [page_num])[0]
+        except Exception as e:
+            print(f"Error converting page {page_num + 1} to image: {e}")
+            raise Exception(f"Failed to convert page {page_num + 1} to image. Error: {str(e)}")
+    
+    def _render_regions(self, pdf_path: str, page_num: int, rects: List[Tuple[float, float, float, float]], dpi: int) -> List:
+        """Rasterize several rectangles of one page (see _render_region), opening and interpreting the page once"""
+        if PYMUPDF_AVAILABLE:
+            doc = fitz.open(pdf_path)
+            try:
+                page = doc[page_num]
+                display_list = page.get_displaylist()
+                return [render_clip(page, fitz.Rect(*rect) & page.rect, dpi, self.raster_mode, display_list) for rect in rects]
+            finally:
+                doc.close()
+        image = self._convert_page_to_image(pdf_path, page_num, dpi)
+        return [
+            prepare(image.crop(tuple(int(round(points_to_pixels(v, dpi))) for v in rect)), dpi, self.raster_mode, crop=False).image
+            for rect in rects
+        ]
+    
+    def _render_region(self, pdf_path: str, page_num: int, rect: Tuple[float, float, float, float], dpi: int):
+        """
+        Rasterize only a rectangle of a page.
+        rect: (x0, top, x1, bottom) in PDF points from the top-left of the page
+        """
+        if PYMUPDF_AVAILABLE:
+            doc = fitz.open(pdf_path)
+            try:
+                page = doc[page_num]
+                clip = fitz.Rect(*rect) & page.rect
+                return render_clip(page, clip, dpi, self.raster_mode)
+            finally:
+                doc.close()
+        # Without PyMuPDF, render the whole page and crop it
+        image = self._convert_page_to_image(pdf_path, page_num, dpi)
+        box = tuple(int(round(points_to_pixels(v, dpi))) for v in rect)
+        return prepare(image.crop(box), dpi, self.raster_mode, crop=False).image
@@ -0,0 +1,90 @@
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from services.job_checkpoint import is_valid_job_id
+
+# Generation outputs (copies, checkpoints, manifests, ZIPs) are deleted this many hours
+# after the last write to their job (0 keeps them forever)
+OUTPUT_RETENTION_HOURS = float(os.getenv("OUTPUT_RETENTION_HOURS", "24"))
+# Seconds between sweeps of the output directory
+OUTPUT_SWEEP_INTERVAL = float(os.getenv("OUTPUT_SWEEP_INTERVAL", "3600"))
+
+# Leftovers of an interrupted write or the cached ETag of a file go with the file
+_SIDECARS = r"(?:\.etag)?(?:\.[0-9a-f]+)?(?:\.tmp)?$"
+# Files named after a job id: its checkpoint, shard manifest and shards
+_JOB_FILE = re.compile(r"^(?P<job>[A-Za-z0-9_-]{1,64}?)(?:\.checkpoint\.json|\.manifest\.json|_part_\d{4}\.zip)" + _SIDECARS)
+# Files that stand alone: the last ZIP of a template, batch ZIPs, recent-job indexes and
+# copies written before copies were kept per job
+_OTHER_FILE = re.compile(r"^(?P<file>generated_.+\.zip|batch_.+\.zip|.+\.jobs\.json|.+_copy_\d+\.pdf)" + _SIDECARS)
+
+
+def _group(entry: Path) -> Optional[str]:
+    """Key of the artifacts that are kept or deleted together, or None for anything the sweep must not touch"""
+    if entry.is_dir():
+        return f"job:{entry.name}" if is_valid_job_id(entry.name) else None
+    match = _JOB_FILE.match(entry.name)
+    if match:
+        return f"job:{match.group('job')}"
+    match = _OTHER_FILE.match(entry.name)
+    if match:
+        return f"file:{match.group('file')}"
+    return None
+
+
+def _last_modified(entry: Path) -> float:
+    """Latest write to a file, or to a job directory and the copies in it"""
+    mtime = entry.stat().st_mtime
+    if entry.is_dir():
+        for child in entry.iterdir():
+            try:
+                mtime = max(mtime, child.stat().st_mtime)
+            except FileNotFoundError:
+                pass
+    return mtime
+
+
+def sweep_outputs(directory: Path, max_age: float, active_jobs: Iterable[str] = (), now: Optional[float] = None) -> int:
+    """
+    Delete generation outputs in `directory` untouched for more than `max_age` seconds.
+    A job's copies, checkpoint, manifest and shards go together, and only once none of
+    them has been written for `max_age`, so a long job keeps its early shards. Jobs in
+    `active_jobs` are kept regardless. Queue and cache databases are never touched.
+    Returns the number of files and directories removed.
+    """
+    cutoff = (time.time() if now is None else now) - max_age
+    protected = {f"job:{job_id}" for job_id in active_jobs}
+    groups: Dict[str, List[Path]] = {}
+    newest: Dict[str, float] = {}
+    for entry in Path(directory).iterdir():
+        try:
+            key = _group(entry)
+            if key is None:
+                continue
+            newest[key] = max(newest.get(key, 0.0), _last_modified(entry))
+        except FileNotFoundError:
+            # Removed by another process meanwhile
+            continue
+        groups.setdefault(key, []).append(entry)
+
+    removed = 0
+    for key, entries in groups.items():
+        if newest[key] >= cutoff or key in protected:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    shutil.rmtree(entry)
+                else:
+                    entry.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Warning: Could not remove expired output {entry.name}: {e}")
+    if removed:
+        print(f"Output sweep: removed {removed} expired files and job directories from {directory}")
+    return removed
@@ -0,0 +1,107 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from services.shared_store import cached, digest
+from services.startup import lazy_module
+
+fitz = lazy_module("fitz")
+PYMUPDF_AVAILABLE = fitz is not None
+
+_REFERENCE = re.compile(r"(\d+)\s+(\d+)\s+R\b")
+# Entries that change between saves without changing what the page looks like.
+# /Parent and /P (annotation -> page) are dropped so the walk stays within the page.
+_VOLATILE_ENTRIES = re.compile(
+    r"/(?:Parent|P|Metadata|Thumb|PieceInfo)\s*\d+\s+\d+\s+R"
+    r"|/(?:StructParents)\s*\d+"
+    r"|/LastModified\s*\([^)]*\)"
+)
+# Names used by operators in a content stream (/F1 Tf, /Im0 Do, /GS0 gs, ...)
+_CONTENT_NAME = re.compile(rb"/([^\s/\[\]()<>{}%]+)")
+_RESOURCE_CATEGORIES = ("Font", "XObject", "ExtGState", "ColorSpace", "Pattern", "Shading", "Properties")
+
+
+def page_hashes(pdf_path: Path, salt: str = "") -> Optional[List[str]]:
+    """
+    One hash per page over everything that affects how the page renders: its decoded
+    content, the resources that content uses (fonts, images, forms...), annotations
+    and page boxes.
+
+    Objects are hashed by content, with references replaced by the hash of the object
+    they point to, so a page keeps its hash when other pages are added, removed or
+    edited and objects are renumbered. Only resources the page names are included,
+    so a resource dictionary shared by all pages can grow without touching every
+    page's hash. `salt` separates results computed with different OCR settings.
+    Returns None without PyMuPDF.
+    """
+    if not PYMUPDF_AVAILABLE:
+        return None
+    doc = fitz.open(str(pdf_path))
+    try:
+        memo: Dict[int, str] = {}
+        hashes = []
+        for page in doc:
+            content = page.read_contents()
+            digest = hashlib.sha256(salt.encode("utf-8"))
+            digest.update(f"{tuple(page.mediabox)}|{tuple(page.cropbox)}|{page.rotation}|".encode("utf-8"))
+            digest.update(hashlib.sha256(content).digest())
+            holder = resource_holder(doc, page.xref)
+            if holder is not None:
+                names = sorted({name.decode("latin-1") for name in _CONTENT_NAME.findall(content)})
+                for category in _RESOURCE_CATEGORIES:
+                    if doc.xref_get_key(holder, f"Resources/{category}")[0] == "null":
+                        continue
+                    for name in names:
+                        kind, value = doc.xref_get_key(holder, f"Resources/{category}/{name}")
+                        if kind != "null":
+                            digest.update(f"{category}/{name}={_normalize(doc, value, memo, set())}|".encode("utf-8"))
+            kind, annots = doc.xref_get_key(page.xref, "Annots")
+            if kind != "null":
+                digest.update(f"Annots={_normalize(doc, annots, memo, {page.xref})}".encode("utf-8"))
+            hashes.append(digest.hexdigest())
+        return hashes
+    finally:
+        doc.close()
+
+
+def cached_page_hashes(pdf_path: Path, salt: str = "") -> Optional[List[str]]:
+    """page_hashes(), computed once per file version for all server processes"""
+    return cached("page_hashes", digest(str(pdf_path), salt), Path(pdf_path), lambda: page_hashes(pdf_path, salt))[0]
+
+
+def resource_holder(doc, xref: int) -> Optional[int]:
+    """The page, or the nearest ancestor it inherits /Resources from"""
+    seen = set()
+    while xref not in seen:
+        seen.add(xref)
+        if doc.xref_get_key(xref, "Resources")[0] != "null":
+            return xref
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            return None
+        xref = int(parent.split()[0])
+    return None
+
+
+def _normalize(doc, source: str, memo: Dict[int, str], active: set) -> str:
+    """Object source with volatile entries dropped and references replaced by content hashes"""
+    source = _VOLATILE_ENTRIES.sub("", source)
+    return _REFERENCE.sub(lambda m: "<" + _object_digest(doc, int(m.group(1)), memo, active) + ">", source)
+
+
+def _object_digest(doc, xref: int, memo: Dict[int, str], active: set) -> str:
+    if xref in memo:
+        return memo[xref]
+    if xref in active or not 0 < xref < doc.xref_length():
+        # Reference cycle (e.g. an annotation pointing back at its page) or a dangling reference
+        return "cycle"
+    active.add(xref)
+    try:
+        digest = hashlib.sha256(_normalize(doc, doc.xref_object(xref, compressed=True), memo, active).encode("utf-8"))
+        if doc.xref_is_stream(xref):
+            digest.update(doc.xref_stream_raw(xref) or b"")
+    finally:
+        active.discard(xref)
+    memo[xref] = digest.hexdigest()
+    return memo[xref]
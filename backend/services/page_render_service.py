@@ -0,0 +1,186 @@
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from services.coordinates import pixels_to_points
+from services.download_service import content_etag
+from services.startup import lazy_module
+
+fitz = lazy_module("fitz")
+PYMUPDF_AVAILABLE = fitz is not None
+
+PAGE_CACHE_DIR = Path(os.getenv("PAGE_CACHE_DIR", "page_cache"))
+# Disk budget of the render cache; least recently used renders are evicted beyond it
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PAGE_ZOOM_MIN = 0.1
+PAGE_ZOOM_MAX = 8.0
+# Upper bound on rendered pixels, so a huge page at a high zoom cannot exhaust memory
+PAGE_RENDER_MAX_PIXELS = int(os.getenv("PAGE_RENDER_MAX_PIXELS", "40000000"))
+RENDER_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+_RASTER_NAME = re.compile(r"_r(\d+)\.png$")
+
+
+class PageRenderService:
+    """
+    Renders PDF pages to PNG/WebP images for the frontend, with an LRU disk cache.
+
+    Renders are keyed by (PDF content hash, page, zoom, format). Page rasters
+    produced during OCR are kept in the same cache and downscaled for previews
+    at or below their resolution instead of rendering the page again.
+    """
+
+    def __init__(self, cache_dir: Path = PAGE_CACHE_DIR, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def normalize_zoom(zoom: float) -> float:
+        """Clamp and round a zoom factor so nearby zooms share cache entries"""
+        return round(min(PAGE_ZOOM_MAX, max(PAGE_ZOOM_MIN, zoom)), 2)
+
+    def _key(self, pdf_path: Path) -> str:
+        return content_etag(pdf_path).strip('"')[:32]
+
+    def render(self, pdf_path: Path, page_num: int, zoom: float = 1.0, fmt: str = "png") -> Tuple[Path, str]:
+        """
+        Return (cached image path, media type) for a 0-based page at `zoom` (1.0 = 72 DPI).
+        Raises ValueError for an unknown format, a page out of range or an oversized render.
+        """
+        if fmt not in RENDER_FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}'. Use one of: {', '.join(RENDER_FORMATS)}")
+        zoom = self.normalize_zoom(zoom)
+        key = self._key(pdf_path)
+        path = self.cache_dir / f"{key}_p{page_num}_z{zoom:.2f}.{fmt}"
+        if path.exists():
+            self._touch(path)
+            return path, RENDER_FORMATS[fmt]
+
+        image = self._from_raster(key, page_num, zoom)
+        if image is not None:
+            print(f"Page {page_num + 1} preview at zoom {zoom} scaled from OCR raster")
+            self._store(path, lambda tmp: image.save(tmp, format=fmt.upper()))
+        elif PYMUPDF_AVAILABLE:
+            doc = fitz.open(str(pdf_path))
+            try:
+                if not 0 <= page_num < doc.page_count:
+                    raise ValueError(f"Page {page_num} out of range (document has {doc.page_count} pages)")
+                page = doc[page_num]
+                self._check_size(page.rect.width * zoom, page.rect.height * zoom)
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            finally:
+                doc.close()
+            if fmt == "png":
+                self._store(path, lambda tmp: pix.save(str(tmp), output="png"))
+            else:
+                image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                self._store(path, lambda tmp: image.save(tmp, format="WEBP"))
+        else:
+            from pdf2image import convert_from_path, pdfinfo_from_path
+            page_count = pdfinfo_from_path(str(pdf_path)).get("Pages", 0)
+            if not 0 <= page_num < page_count:
+                raise ValueError(f"Page {page_num} out of range (document has {page_count} pages)")
+            image = convert_from_path(str(pdf_path), dpi=zoom * 72, first_page=page_num + 1, last_page=page_num + 1)[0]
+            self._check_size(image.width, image.height)
+            self._store(path, lambda tmp: image.save(tmp, format=fmt.upper()))
+        return path, RENDER_FORMATS[fmt]
+
+    def store_raster(self, pdf_path: Path, page_num: int, dpi: int, image):
+        """Keep a page raster rendered for OCR so previews can reuse it"""
+        try:
+            path = self.cache_dir / f"{self._key(pdf_path)}_p{page_num}_r{int(dpi)}.png"
+            if path.exists():
+                self._touch(path)
+                return
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            # Fast, lightly compressed PNG: this runs alongside OCR
+            self._store(path, lambda tmp: image.save(tmp, format="PNG", compress_level=1))
+        except Exception as e:
+            print(f"Warning: Could not cache OCR raster of page {page_num + 1}: {e}")
+
+    def _from_raster(self, key: str, page_num: int, zoom: float) -> Optional[Image.Image]:
+        """Downscale the smallest cached OCR raster with at least the requested resolution"""
+        best = None
+        for path in self.cache_dir.glob(f"{key}_p{page_num}_r*.png"):
+            match = _RASTER_NAME.search(path.name)
+            if not match:
+                continue
+            dpi = int(match.group(1))
+            if dpi / 72.0 >= zoom and (best is None or dpi < best[0]):
+                best = (dpi, path)
+        if best is None:
+            return None
+        dpi, path = best
+        try:
+            with Image.open(path) as raster:
+                width = max(1, round(pixels_to_points(raster.width, dpi) * zoom))
+                height = max(1, round(pixels_to_points(raster.height, dpi) * zoom))
+                self._check_size(width, height)
+                image = raster.convert("RGB").resize((width, height), Image.LANCZOS)
+            self._touch(path)
+            return image
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Warning: Could not reuse OCR raster {path.name}: {e}")
+            return None
+
+    @staticmethod
+    def _check_size(width: float, height: float):
+        if width * height > PAGE_RENDER_MAX_PIXELS:
+            raise ValueError(f"Render of {int(width)}x{int(height)} pixels exceeds the limit; use a smaller zoom")
+
+    def _touch(self, path: Path):
+        # Modification time doubles as the LRU timestamp
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _store(self, path: Path, write):
+        """Write a cache entry atomically, then evict old entries if over budget"""
+        tmp_path = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(p.stat().st_size for p in self.cache_dir.iterdir() if p.is_file() and p.suffix not in (".tmp", ".etag"))
+            else:
+                self._size += path.stat().st_size
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+
+    def _evict(self, keep: Path):
+        """Delete least recently used entries until the cache fits its budget (caller holds the lock)"""
+        entries = []
+        for p in self.cache_dir.iterdir():
+            try:
+                stat = p.stat()
+            except OSError:
+                continue
+            # ETag sidecars of served renders are removed with their render
+            if p.is_file() and p != keep and p.suffix not in (".tmp", ".etag"):
+                entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries) + keep.stat().st_size
+        evicted = 0
+        for _, size, p in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+                p.with_name(p.name + ".etag").unlink(missing_ok=True)
+                self._size -= size
+                evicted += 1
+            except OSError:
+                pass
+        if evicted:
+            print(f"Page cache: evicted {evicted} renders ({self._size} bytes in use)")
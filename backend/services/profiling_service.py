@@ -0,0 +1,250 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+# Profiling is opt-in per request, but the server must allow it first
+PROFILING_ENABLED = os.getenv("ENABLE_PROFILING", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000.0
+
+# The profiler of the request currently being handled, if any
+_current_profiler: contextvars.ContextVar[Optional["RequestProfiler"]] = contextvars.ContextVar(
+    "current_profiler", default=None
+)
+# cProfile hooks are per interpreter thread, so only one request is profiled at a time
+_profile_slot = threading.Lock()
+
+
+class RequestProfiler:
+    """Collects a cProfile or sampling profile plus per-stage timings for one request"""
+
+    def __init__(self, endpoint: str, target_id: str, mode: str = "cprofile"):
+        self.profile_id = str(uuid.uuid4())
+        self.endpoint = endpoint
+        self.target_id = target_id
+        self.mode = mode if mode in PROFILE_MODES else "cprofile"
+        self.started_at = None
+        self.wall_time = 0.0
+        self.stages: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._start = 0.0
+        self._token = None
+        self._thread_profiles = []
+        self._sample_threads = set()
+        self._samples = Counter()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    def start(self):
+        """
+        Attach to the current request. Only the request's executor work (see bind) is
+        profiled: the event loop thread is shared with every other request, so hooking
+        it would slow them down and mix their coroutines into this profile. Time the
+        request spends on the loop still shows up in the stage timings and wall time.
+        """
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self._start = time.perf_counter()
+        self._token = _current_profiler.set(self)
+        if self.mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.profile_id[:8]}", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        """Stop profiling and detach from the request context"""
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+        self.wall_time = time.perf_counter() - self._start
+        if self._token is not None:
+            _current_profiler.reset(self._token)
+            self._token = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a named stage; repeated stages are aggregated"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                entry = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+                entry["count"] += 1
+                entry["total_ms"] += elapsed
+                entry["max_ms"] = max(entry["max_ms"], elapsed)
+
+    def run_in_thread(self, fn: Callable, *args):
+        """Run `fn` in a worker thread while including it in this profile"""
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return fn(*args)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._thread_profiles.append(profile)
+        ident = threading.get_ident()
+        with self._lock:
+            self._sample_threads.add(ident)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._sample_threads.discard(ident)
+
+    def _sample_loop(self):
+        """Record collapsed stacks of the request's threads at a fixed interval"""
+        while not self._stop_sampling.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self._lock:
+                idents = list(self._sample_threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self._samples[";".join(reversed(stack))] += 1
+
+    def save(self) -> Dict:
+        """Write the profile artifacts to PROFILE_DIR and return the summary"""
+        PROFILE_DIR.mkdir(exist_ok=True)
+        artifacts = {}
+        top_functions = []
+        if self.mode == "cprofile":
+            stats = pstats.Stats(*self._thread_profiles)
+            prof_path = PROFILE_DIR / f"{self.profile_id}.prof"
+            stats.dump_stats(str(prof_path))
+            artifacts["prof"] = prof_path.name
+
+            report = io.StringIO()
+            # Report from memory: a request with no executor work leaves an empty .prof, which pstats cannot reload
+            stats.stream = report
+            stats.sort_stats("cumulative").print_stats(60)
+            txt_path = PROFILE_DIR / f"{self.profile_id}.txt"
+            txt_path.write_text(report.getvalue())
+            artifacts["txt"] = txt_path.name
+
+            ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            for (filename, line, func), (_, ncalls, tottime, cumtime, _) in ranked[:25]:
+                top_functions.append({
+                    "function": f"{os.path.basename(filename)}:{line}({func})",
+                    "calls": ncalls,
+                    "tottime_ms": round(tottime * 1000, 3),
+                    "cumtime_ms": round(cumtime * 1000, 3),
+                })
+        else:
+            collapsed_path = PROFILE_DIR / f"{self.profile_id}.collapsed"
+            collapsed_path.write_text("".join(f"{stack} {count}\n" for stack, count in self._samples.most_common()))
+            artifacts["collapsed"] = collapsed_path.name
+
+        summary = {
+            "profile_id": self.profile_id,
+            "endpoint": self.endpoint,
+            "target_id": self.target_id,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "wall_ms": round(self.wall_time * 1000, 3),
+            "stages": {
+                name: {"count": s["count"], "total_ms": round(s["total_ms"], 3), "max_ms": round(s["max_ms"], 3)}
+                for name, s in self.stages.items()
+            },
+            "top_functions": top_functions,
+            "samples": sum(self._samples.values()),
+            "artifacts": artifacts,
+        }
+        summary_path = PROFILE_DIR / f"{self.profile_id}.json"
+        summary_path.write_text(json.dumps(summary, indent=2))
+        print(f"Saved {self.mode} profile {self.profile_id} for {self.endpoint} ({summary['wall_ms']}ms)")
+        return summary
+
+
+def start_request_profile(endpoint: str, target_id: str, requested: Optional[str]) -> Optional[RequestProfiler]:
+    """
+    Start a profiler if profiling is enabled and the request asked for it.
+    `requested` is the raw header/query value: "1"/"true"/"cprofile" or "sample".
+    Returns None when profiling is off, not requested, or another request holds the slot.
+    """
+    if not PROFILING_ENABLED or not requested:
+        return None
+    requested = requested.strip().lower()
+    if requested in ("0", "false", "no", "off", ""):
+        return None
+    if not _profile_slot.acquire(blocking=False):
+        print(f"Profiling requested for {endpoint} but another request is being profiled, skipping")
+        return None
+    mode = requested if requested in PROFILE_MODES else "cprofile"
+    profiler = RequestProfiler(endpoint, target_id, mode)
+    profiler.start()
+    return profiler
+
+
+def finish_request_profile(profiler: Optional[RequestProfiler]) -> Optional[Dict]:
+    """Stop a profiler started by start_request_profile and persist its artifacts"""
+    if profiler is None:
+        return None
+    try:
+        profiler.stop()
+        return profiler.save()
+    except Exception as e:
+        print(f"Error saving profile {profiler.profile_id}: {e}")
+        return None
+    finally:
+        _profile_slot.release()
+
+
+def current_profiler() -> Optional[RequestProfiler]:
+    return _current_profiler.get()
+
+
+def stage(name: str):
+    """Time a stage of the current request; a no-op when it is not being profiled"""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    Wrap a function that will run in an executor thread so it is profiled with
+    the current request. Executors do not propagate context variables, so the
+    request context is captured here and re-entered in the worker thread.
+    """
+    profiler = _current_profiler.get()
+    if profiler is None:
+        return fn
+    context = contextvars.copy_context()
+
+    def run(*args):
+        return context.run(profiler.run_in_thread, fn, *args)
+
+    return run
+
+
+def profile_artifact_path(profile_id: str, artifact: str) -> Optional[Path]:
+    """Resolve a saved artifact ("json", "prof", "txt" or "collapsed") for download"""
+    if artifact not in ("json", "prof", "txt", "collapsed"):
+        return None
+    try:
+        uuid.UUID(profile_id)
+    except ValueError:
+        return None
+    path = PROFILE_DIR / f"{profile_id}.{artifact}"
+    return path if path.exists() else None
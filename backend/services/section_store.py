@@ -0,0 +1,141 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.coordinates import section_rect_points
+
+
+def next_section_index(sections: List[Dict]) -> int:
+    """First "section_<n>" number not used by `sections`"""
+    next_index = 0
+    for section in sections:
+        suffix = str(section.get("id", "")).rsplit("_", 1)[-1]
+        if suffix.isdigit():
+            next_index = max(next_index, int(suffix) + 1)
+    return next_index
+
+
+def carry_over_ids(sections: List[Dict], previous_sections: List[Dict], counterparts: Dict[int, int], taken: Set[str]) -> List[Dict]:
+    """
+    Give freshly OCR'd sections the ids of the matching sections of a previous version,
+    so rules saved against that version keep working.
+    A section inherits the id of a previous section with the same text, preferring its
+    page's counterpart in the previous version (`counterparts`: page -> previous page)
+    and then the closest position. Ids in `taken` (e.g. of reused pages) are not handed
+    out again, and sections without a match get new ids.
+    """
+    taken = set(taken)
+    by_text: Dict[str, List[Dict]] = {}
+    for section in previous_sections:
+        if section.get("id") not in taken:
+            by_text.setdefault(section.get("text", "").strip(), []).append(section)
+
+    def distance(a: Dict, b: Dict) -> float:
+        ax0, atop, ax1, abottom = section_rect_points(a)
+        bx0, btop, bx1, bbottom = section_rect_points(b)
+        return abs((ax0 + ax1) - (bx0 + bx1)) + abs((atop + abottom) - (btop + bbottom))
+
+    next_index = next_section_index(previous_sections)
+    result = []
+    for section in sections:
+        candidates = [c for c in by_text.get(section.get("text", "").strip(), []) if c["id"] not in taken]
+        counterpart = counterparts.get(section.get("page"))
+        pool = [c for c in candidates if c.get("page") == counterpart] or candidates
+        if pool:
+            section_id = min(pool, key=lambda c: distance(section, c))["id"]
+        else:
+            # Skip ids already handed out, e.g. by an earlier call for another page
+            while f"section_{next_index}" in taken:
+                next_index += 1
+            section_id = f"section_{next_index}"
+            next_index += 1
+        taken.add(section_id)
+        result.append({**section, "id": section_id})
+    return result
+
+
+class SectionStore:
+    """Persists the OCR section list of each uploaded PDF next to the upload"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+
+    def _path(self, pdf_id: str) -> Path:
+        return self.directory / f"{pdf_id}.sections.json"
+
+    def _hashes_path(self, pdf_id: str) -> Path:
+        return self.directory / f"{pdf_id}.pages.json"
+
+    def load(self, pdf_id: str) -> Optional[List[Dict]]:
+        """Return the cached sections for a PDF, or None if it was never OCR'd"""
+        path = self._path(pdf_id)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read cached sections for {pdf_id}: {e}")
+            return None
+
+    def save(self, pdf_id: str, sections: List[Dict], page_hashes: Optional[List[str]] = None):
+        """Replace the cached sections for a PDF, and the page hashes they were computed for if given"""
+        path = self._path(pdf_id)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(sections, f)
+        # Atomic rename so readers never see a partially written list
+        os.replace(tmp_path, path)
+        hashes_path = self._hashes_path(pdf_id)
+        if page_hashes is None:
+            hashes_path.unlink(missing_ok=True)
+            return
+        tmp_path = hashes_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(page_hashes, f)
+        os.replace(tmp_path, hashes_path)
+
+    def load_page_hashes(self, pdf_id: str) -> Optional[List[str]]:
+        """Page hashes the cached sections belong to (see page_hash.page_hashes), or None"""
+        path = self._hashes_path(pdf_id)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read page hashes for {pdf_id}: {e}")
+            return None
+
+    def merge_region(self, pdf_id: str, page: int, rect: Tuple[float, float, float, float], new_sections: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Replace the cached sections whose centre falls inside `rect` on `page`
+        with `new_sections`, giving the new ones ids that do not collide.
+        rect: (x0, top, x1, bottom) in PDF points
+        Returns (merged section list, new sections with their final ids).
+        """
+        sections = self.load(pdf_id) or []
+        x0, top, x1, bottom = rect
+
+        def inside(section: Dict) -> bool:
+            if section.get("page") != page:
+                return False
+            sx0, stop, sx1, sbottom = section_rect_points(section)
+            cx, cy = (sx0 + sx1) / 2, (stop + sbottom) / 2
+            return x0 <= cx <= x1 and top <= cy <= bottom
+
+        kept = [s for s in sections if not inside(s)]
+        next_index = next_section_index(sections)
+
+        added = []
+        for section in new_sections:
+            added.append({**section, "id": f"section_{next_index}"})
+            next_index += 1
+
+        merged = sorted(kept + added, key=lambda s: (s.get("page", 0), section_rect_points(s)[1], section_rect_points(s)[0]))
+        # Region results refine the same page versions, so the page hashes stay valid
+        self.save(pdf_id, merged, self.load_page_hashes(pdf_id))
+        print(f"Merged {len(added)} region sections into {pdf_id} (replaced {len(sections) - len(kept)})")
+        return merged, added
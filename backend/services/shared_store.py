@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+# Cache derived template data (replacement plans, page text index, page hashes and sizes)
+# in a SQLite file shared by all server and worker processes; false keeps it per process
+SHARED_CACHE = os.getenv("SHARED_CACHE", "true").lower() in ("1", "true", "yes")
+SHARED_CACHE_PATH = Path(os.getenv("SHARED_CACHE_PATH", "outputs/shared_cache.db"))
+# Entries kept per kind (plans, page indexes, ...); the oldest are dropped first
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "2000"))
+# Seconds a cross-process lease (e.g. OCR of one PDF) outlives its holder's last renewal;
+# holders renew every third of this, so it only bounds how long a crashed holder blocks others
+SHARED_LEASE_TTL = float(os.getenv("SHARED_LEASE_TTL", "60"))
+# Seconds a request waits for a lease held by another request before giving up
+SHARED_LEASE_WAIT = float(os.getenv("SHARED_LEASE_WAIT", "300"))
+# Seconds between attempts to take a lease held by another process
+SHARED_LEASE_POLL = 0.2
+# Puts between pruning passes
+_PRUNE_EVERY = 64
+
+
+class LeaseTimeout(Exception):
+    """A lease stayed held by another request for longer than the caller would wait"""
+
+    def __init__(self, name: str, waited: float):
+        super().__init__(f"Timed out after {waited:.0f}s waiting for {name}, held by another request")
+        self.name = name
+        self.retry_after = max(1, int(SHARED_LEASE_TTL))
+
+
+def fingerprint(source: Path) -> Optional[str]:
+    """Size and modification time of a file; an entry derived from it is stale once this changes"""
+    try:
+        stat = Path(source).stat()
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def digest(*parts: Any) -> str:
+    """Short stable key for structured values (texts, OCR coordinates, settings...)"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SharedStore:
+    """
+    Key-value cache in a SQLite file, shared by every process of the server.
+
+    Each entry records the file it was derived from (`source`) and that file's
+    fingerprint; a read that finds the file changed or gone drops the entry
+    instead of returning it, so all processes see an update at the same time.
+    Also provides leases, so only one process at a time does a piece of work.
+    """
+
+    def __init__(self, path: Path = SHARED_CACHE_PATH, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._puts = 0
+        self._lock = threading.Lock()
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    source TEXT,
+                    fingerprint TEXT,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                );
+                CREATE INDEX IF NOT EXISTS entries_by_source ON entries (source);
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    token TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            """)
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: callers run on many threads and in many processes
+        db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        # Entries can always be recomputed, so skip the fsync on every write
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, kind: str, key: str, source: Optional[Path] = None) -> Optional[Any]:
+        """Cached value, or None if missing or derived from a version of `source` that has since changed"""
+        db = self._connect()
+        try:
+            row = db.execute("SELECT fingerprint, value FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is None:
+                return None
+            if source is not None and row[0] != fingerprint(source):
+                db.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                return None
+            return json.loads(row[1])
+        finally:
+            db.close()
+
+    def put(self, kind: str, key: str, value: Any, source: Optional[Path] = None, version: Optional[str] = None):
+        """
+        Store a value derived from `source`. Pass the source's fingerprint from before the
+        value was computed as `version`, so a file that changed meanwhile is not vouched for.
+        """
+        if source is not None and version is None:
+            version = fingerprint(source)
+        db = self._connect()
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, str(source) if source is not None else None, version, json.dumps(value), time.time())
+            )
+            with self._lock:
+                self._puts += 1
+                prune = self._puts % _PRUNE_EVERY == 0
+            if prune:
+                db.execute(
+                    "DELETE FROM entries WHERE kind = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM entries WHERE kind = ? ORDER BY created_at DESC LIMIT ?)",
+                    (kind, kind, self.max_entries)
+                )
+        finally:
+            db.close()
+
+    def invalidate(self, source: Path) -> int:
+        """Drop every entry derived from `source`, e.g. before it is replaced or deleted"""
+        db = self._connect()
+        try:
+            return db.execute("DELETE FROM entries WHERE source = ?", (str(source),)).rowcount
+        finally:
+            db.close()
+
+    def try_lease(self, name: str, token: str, ttl: float = SHARED_LEASE_TTL) -> bool:
+        """Take (or renew) the lease `name` for `token` unless another live holder has it"""
+        now = time.time()
+        db = self._connect()
+        try:
+            cursor = db.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE "
+                "SET token = excluded.token, expires_at = excluded.expires_at "
+                "WHERE leases.token = excluded.token OR leases.expires_at < ?",
+                (name, token, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+        finally:
+            db.close()
+
+    def release_lease(self, name: str, token: str):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM leases WHERE name = ? AND token = ?", (name, token))
+        finally:
+            db.close()
+
+    async def _renew(self, name: str, token: str, ttl: float):
+        """Keep a held lease alive for as long as the block using it runs"""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                renewed = await loop.run_in_executor(None, self.try_lease, name, token, ttl)
+            except Exception as e:
+                print(f"Warning: Could not renew {name}: {e}")
+                continue
+            if not renewed:
+                print(f"Warning: Lost {name} to another request")
+                return
+
+    @asynccontextmanager
+    async def lease(self, name: str, ttl: float = SHARED_LEASE_TTL, timeout: float = SHARED_LEASE_WAIT):
+        """
+        Wait until no other process (or request) holds `name`, and hold it for the block,
+        renewing it in the background. Raises LeaseTimeout after waiting `timeout` seconds.
+        """
+        token = str(uuid.uuid4())
+        loop = asyncio.get_event_loop()
+        started = time.monotonic()
+        waited = False
+        while not await loop.run_in_executor(None, self.try_lease, name, token, ttl):
+            if time.monotonic() - started >= timeout:
+                raise LeaseTimeout(name, time.monotonic() - started)
+            if not waited:
+                print(f"Waiting for {name}, held by another request")
+                waited = True
+            await asyncio.sleep(SHARED_LEASE_POLL)
+        renewal = asyncio.ensure_future(self._renew(name, token, ttl))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            await loop.run_in_executor(None, self.release_lease, name, token)
+
+
+_store: Optional[SharedStore] = None
+_store_lock = threading.Lock()
+
+
+def store() -> Optional[SharedStore]:
+    """The process's handle on the shared cache, or None if SHARED_CACHE is off or it cannot be opened"""
+    global _store
+    if not SHARED_CACHE:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = SharedStore()
+                except Exception as e:
+                    print(f"Warning: Shared cache unavailable, caching per process: {e}")
+                    return None
+    return _store
+
+
+def cached(kind: str, key: str, source: Path, compute, encode=None, decode=None) -> Tuple[Any, bool]:
+    """
+    Value of `compute()` for (kind, key), taken from the shared cache when another
+    process already computed it for the current version of `source`.
+    encode/decode convert values that are not plain JSON (sets, tuples...).
+    Returns (value, whether it came from the cache).
+    """
+    shared = store()
+    version = fingerprint(source)
+    if shared is not None:
+        try:
+            value = shared.get(kind, key, source)
+            if value is not None:
+                return (decode(value) if decode else value), True
+        except Exception as e:
+            print(f"Warning: Could not read {kind} from shared cache: {e}")
+    value = compute()
+    if shared is not None and value is not None:
+        try:
+            shared.put(kind, key, encode(value) if encode else value, source, version)
+        except Exception as e:
+            print(f"Warning: Could not write {kind} to shared cache: {e}")
+    return value, False
+
+
+@asynccontextmanager
+async def lease(name: str, ttl: float = SHARED_LEASE_TTL, timeout: float = SHARED_LEASE_WAIT):
+    """Cross-process lease `name` (see SharedStore.lease); without the shared cache the block runs unguarded"""
+    shared = store()
+    if shared is None:
+        yield
+        return
+    async with shared.lease(name, ttl, timeout):
+        yield
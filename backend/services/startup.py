@@ -0,0 +1,182 @@
+import importlib
+import importlib.util
+import os
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Server processes started by start_server.py (uvicorn workers); per-process
+# budgets such as admission control and generation pools are divided between them
+SERVER_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Reference point for the startup report: when the first service module is imported
+_STARTED = time.perf_counter()
+_ready_at: Optional[float] = None
+_steps: List[Dict] = []
+_steps_lock = threading.Lock()
+_services: Dict[str, "LazyService"] = {}
+_modules: Dict[str, "LazyModule"] = {}
+
+
+def _record(kind: str, name: str, seconds: float, error: Optional[str] = None):
+    step = {
+        "kind": kind,
+        "name": name,
+        "seconds": round(seconds, 4),
+        "at": round(time.perf_counter() - _STARTED, 4),
+    }
+    if error:
+        step["error"] = error
+    with _steps_lock:
+        _steps.append(step)
+
+
+@contextmanager
+def step(name: str, kind: str = "init"):
+    """Time a startup step and add it to the report"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        _record(kind, name, time.perf_counter() - start, str(e))
+        raise
+    _record(kind, name, time.perf_counter() - start)
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a heavy module that is imported on first attribute access.
+    Lets `fitz.open(...)`-style code stay unchanged while import time moves
+    from process start to the first request that needs the module.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def load(self) -> types.ModuleType:
+        module = self._lazy_module
+        if module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    with step(self.__name__, kind="import"):
+                        self._lazy_module = importlib.import_module(self.__name__)
+                module = self._lazy_module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self._lazy_module is not None
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not set on the stand-in itself
+        return getattr(self.load(), attr)
+
+
+def lazy_module(name: str) -> Optional[LazyModule]:
+    """
+    Deferred import of `name`, or None if the module is not installed.
+    Only the module's location is looked up now, which is much cheaper than importing it.
+    """
+    module = _modules.get(name)
+    if module is not None:
+        return module
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    if not found:
+        return None
+    module = _modules.setdefault(name, LazyModule(name))
+    return module
+
+
+class LazyService:
+    """
+    A service constructed on first use and shared afterwards.
+    Attribute access is forwarded to the instance, so `service.method(...)` works
+    as with the instance itself. A failed construction is retried on the next use.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object]):
+        self.name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        _services[name] = self
+
+    def get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    try:
+                        with step(self.name, kind="service"):
+                            self._instance = self._factory()
+                        print(f"{self.name} initialized")
+                    except Exception as e:
+                        print(f"Error initializing {self.name}: {e}")
+                        import traceback
+                        traceback.print_exc()
+                        raise
+                instance = self._instance
+        return instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.get(), attr)
+
+
+def mark_ready():
+    """Record the moment the app started accepting requests"""
+    global _ready_at
+    if _ready_at is None:
+        _ready_at = time.perf_counter() - _STARTED
+
+
+def warm_up(services: List[LazyService], modules: Optional[List[str]] = None):
+    """Construct services and import modules now, typically from a background thread after startup"""
+    for name in modules or list(_modules):
+        module = _modules.get(name)
+        if module is None:
+            continue
+        try:
+            module.load()
+        except Exception as e:
+            print(f"Warning: Could not import {name} during warm-up: {e}")
+    for service in services:
+        try:
+            service.get()
+        except Exception:
+            # Already logged; the first request will retry
+            pass
+    print(f"Warm-up complete {time.perf_counter() - _STARTED:.2f}s after startup began")
+
+
+def report() -> Dict:
+    """Startup timing: time until ready, each timed step, and which services/modules are loaded"""
+    with _steps_lock:
+        steps = list(_steps)
+    return {
+        "ready_after_seconds": round(_ready_at, 4) if _ready_at is not None else None,
+        "uptime_seconds": round(time.perf_counter() - _STARTED, 4),
+        "steps": steps,
+        "services": {name: service.initialized for name, service in _services.items()},
+        "modules": {name: module.loaded for name, module in _modules.items()},
+    }
+
+
+def print_report():
+    data = report()
+    print(f"Startup report: ready after {data['ready_after_seconds']}s")
+    for item in data["steps"]:
+        print(f"  {item['kind']:8} {item['name']:24} {item['seconds'] * 1000:8.1f} ms (at {item['at']:.3f}s)")
+    deferred = [name for name, loaded in {**data["services"], **data["modules"]}.items() if not loaded]
+    if deferred:
+        print(f"  Deferred until first use: {', '.join(deferred)}")
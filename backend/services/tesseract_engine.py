@@ -0,0 +1,169 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from services.startup import lazy_module
+
+# Imported on first OCR request rather than at startup
+pytesseract = lazy_module("pytesseract")
+# In-process bindings to libtesseract (optional)
+tesserocr = lazy_module("tesserocr")
+
+# "auto" uses tesserocr when it is installed and falls back to pytesseract;
+# "tesserocr" or "pytesseract" force one backend
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# Columns of Tesseract's TSV output, as returned by pytesseract.image_to_data
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+_PSM_CONFIG = re.compile(r"^\s*--psm\s+(\d+)\s*$")
+# Tesseract's own default page segmentation (fully automatic)
+_DEFAULT_PSM = 3
+
+
+def import_bindings():
+    """
+    Import tesserocr if installed. Its import installs signal handlers, which only
+    works on the main thread, so call this there before OCR starts on other threads.
+    """
+    if tesserocr is not None and not tesserocr.loaded and OCR_ENGINE != "pytesseract":
+        try:
+            tesserocr.load()
+        except Exception as e:
+            print(f"Warning: Could not import tesserocr: {e}")
+
+
+class TesseractEngine:
+    """
+    Runs Tesseract on PIL images for OCRService.
+
+    With tesserocr installed, each worker thread keeps its own initialized
+    PyTessBaseAPI, so the language model is loaded once per thread and images
+    are passed in memory. Otherwise every call goes through pytesseract, which
+    writes the image to a temp file and starts a `tesseract` process.
+    Both backends return pytesseract's image_to_data dict format.
+    """
+
+    def __init__(self, lang: str = OCR_LANG, backend: str = OCR_ENGINE):
+        self.lang = lang
+        self._local = threading.local()
+        self._apis = []
+        self._lock = threading.Lock()
+        self.backend = self._choose_backend(backend)
+        print(f"OCR engine: {self.backend}")
+
+    def _choose_backend(self, backend: str) -> str:
+        if backend == "pytesseract":
+            return "pytesseract"
+        if tesserocr is None:
+            if backend == "tesserocr":
+                print("Warning: OCR_ENGINE=tesserocr but tesserocr is not installed; using pytesseract")
+            return "pytesseract"
+        try:
+            tesserocr.load()
+        except Exception as e:
+            # e.g. first imported off the main thread (see import_bindings)
+            print(f"Warning: Could not import tesserocr ({e}); using pytesseract")
+            return "pytesseract"
+        return "tesserocr"
+
+    def _api(self):
+        """This thread's engine, created on the thread's first call"""
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": self.lang}
+            tessdata = os.environ.get("TESSDATA_PREFIX")
+            if tessdata:
+                kwargs["path"] = tessdata.rstrip("/\\") + os.sep
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def _fall_back(self, error: Exception):
+        with self._lock:
+            if self.backend == "pytesseract":
+                return
+            self.backend = "pytesseract"
+        print(f"Warning: Could not initialize tesserocr ({error}); using pytesseract")
+
+    def warm(self, executor, workers: int):
+        """Load an engine on each of the executor's threads ahead of the first page"""
+        if self.backend != "tesserocr":
+            return
+        # Every task waits for the others, so each one runs on a different thread
+        barrier = threading.Barrier(workers)
+
+        def init():
+            try:
+                self._api()
+            except Exception as e:
+                self._fall_back(e)
+            try:
+                barrier.wait(timeout=30)
+            except threading.BrokenBarrierError:
+                pass
+
+        for _ in range(workers):
+            executor.submit(init)
+
+    def image_to_data(self, image, config: str = "") -> Dict[str, List]:
+        """Recognize words in `image`; config supports "" and "--psm N" in-process, anything else via pytesseract"""
+        if self.backend == "tesserocr":
+            psm = self._psm(config)
+            if psm is not None:
+                try:
+                    api = self._api()
+                except Exception as e:
+                    self._fall_back(e)
+                else:
+                    return self._image_to_data_in_process(api, image, psm)
+        return pytesseract.image_to_data(
+            image,
+            lang=self.lang,
+            config=config,
+            output_type=pytesseract.Output.DICT
+        )
+
+    @staticmethod
+    def _psm(config: str) -> Optional[int]:
+        if not config.strip():
+            return _DEFAULT_PSM
+        match = _PSM_CONFIG.match(config)
+        return int(match.group(1)) if match else None
+
+    def _image_to_data_in_process(self, api, image, psm: int) -> Dict[str, List]:
+        try:
+            api.SetPageSegMode(psm)
+            api.SetImage(image)
+            tsv = api.GetTSVText(0)
+        finally:
+            # Drop the image and results; the loaded model stays for the next call
+            api.Clear()
+        return self.parse_tsv(tsv)
+
+    @staticmethod
+    def parse_tsv(tsv: str) -> Dict[str, List]:
+        """Tesseract TSV (with or without the header row) -> image_to_data dict of columns"""
+        data = {column: [] for column in TSV_COLUMNS}
+        for line in tsv.splitlines():
+            fields = line.split("\t", len(TSV_COLUMNS) - 1)
+            if len(fields) < len(TSV_COLUMNS) - 1 or fields[0] == "level":
+                continue
+            fields += [""] * (len(TSV_COLUMNS) - len(fields))
+            for column, value in zip(TSV_COLUMNS, fields):
+                # Same conversion as pytesseract: numbers (including conf) become ints
+                data[column].append(value if column == "text" else int(float(value)))
+        return data
+
+    def close(self):
+        with self._lock:
+            apis, self._apis = self._apis, []
+        for api in apis:
+            try:
+                api.End()
+            except Exception:
+                pass
@@ -6,9 +6,12 @@ import uvicorn
 if __name__ == "__main__":
     # Get port from environment variable (Railway sets this)
     port = int(os.environ.get("PORT", 8000))
+    # Server processes; they share OCR results, replacement plans and template
+    # metadata through files in uploads/ and outputs/ (see services/shared_store.py)
+    workers = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
     
     # Print startup info for debugging
-    print(f"Starting server on port {port}")
+    print(f"Starting server on port {port} with {workers} worker process{'es' if workers > 1 else ''}")
     print(f"PORT environment variable: {os.environ.get('PORT', 'NOT SET')}")
     
     try:
@@ -16,6 +19,7 @@ if __name__ == "__main__":
             "main:app",
             host="0.0.0.0",
             port=port,
+            workers=workers,
             log_level="info"
         )
     except Exception as e:
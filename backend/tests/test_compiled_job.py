@@ -0,0 +1,45 @@
+"""Rule compilation and per-copy values (compiled_job)"""
+import random
+
+from services.compiled_job import CompiledJob
+
+
+def values(rules, start=0, stop=3, rows=None):
+    job = CompiledJob(rules)
+    return job.value_columns(start, stop, random.Random(1), rows)
+
+
+def test_serial_and_formats():
+    assert values([{"original_text": "INV-1", "type": "serial", "start_value": 7, "format": "%04d", "prefix": "INV-"}],
+                  start=2, stop=4) == [["INV-0009", "INV-0010"]]
+
+
+def test_random_values_stay_in_range_and_shared_fields_match():
+    job = CompiledJob([
+        {"original_text": "A", "type": "random", "random_min": 5, "random_max": 9, "field": "order"},
+        {"original_text": "B", "type": "random", "random_min": 5, "random_max": 9, "field": "order", "prefix": "#"},
+    ])
+    first, second = job.value_columns(0, 50, random.Random(3))
+    assert all(5 <= int(value) <= 9 for value in first)
+    assert second == ["#" + value for value in first]
+
+
+def test_dataset_values():
+    rows = [{"name": "Zed"}, {"name": ""}, {"name": "7"}]
+    assert values([{"original_text": "X", "type": "dataset", "column": "name", "format": "%03d"}], rows=rows) == [
+        ["Zed", "", "007"]
+    ]
+
+
+def test_custom_rule_falls_back_to_serial_and_says_so(capsys):
+    columns = values([{"original_text": "REF", "type": "custom", "start_value": 100, "suffix": "-X"}])
+    assert columns == [["100-X", "101-X", "102-X"]]
+    assert "type 'custom' falls back to serial values from 100" in capsys.readouterr().out
+
+
+def test_unknown_type_and_missing_text_produce_no_replacement(capsys):
+    job = CompiledJob([{"original_text": "A", "type": "mystery"}, {"original_text": "", "type": "serial"}])
+    columns = job.value_columns(0, 2, random.Random(1))
+    assert columns == [["", ""]]
+    assert job.replacements(columns, 0) == {}
+    assert "unknown type 'mystery'" in capsys.readouterr().out
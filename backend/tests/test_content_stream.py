@@ -0,0 +1,212 @@
+"""Text replacement by content stream rewriting (content_stream)"""
+import pytest
+
+from services import pdf_service, shared_store
+from services.content_stream import (
+    SimpleFontCodec, TextRewriter, codec_for_font, fitz_font_codec, hex_value, literal_token,
+    literal_value, shared_content_streams, tokenize
+)
+
+WIN_ANSI = SimpleFontCodec("cp1252")
+
+
+def rewrite(data, old_text, new_text, expected=None, codec=WIN_ANSI):
+    rewriter = TextRewriter([data], lambda name: codec if name == "F1" else None)
+    count = rewriter.replace(old_text, new_text, expected)
+    return count, rewriter.changed_parts().get(0)
+
+
+@pytest.mark.parametrize("raw, value", [
+    (rb"(plain)", b"plain"),
+    (rb"(a\(b\)c)", b"a(b)c"),
+    (rb"(nested (parens) ok)", b"nested (parens) ok"),
+    (rb"(\101\102C)", b"ABC"),                 # octal escapes
+    (rb"(\0053)", b"\x053"),                   # at most three octal digits
+    (rb"(\7)", b"\x07"),
+    (rb"(tab\there\\)", b"tab\there\\"),
+    (rb"(unknown \q escape)", b"unknown q escape"),
+    (b"(split \\\r\nline)", b"split line"),   # line continuation
+    (b"(cr\rlf)", b"cr\nlf"),
+])
+def test_literal_strings(raw, value):
+    assert literal_value(raw) == value
+    assert [kind for kind, _start, _end in tokenize(raw + b" Tj")] == ["string", "op"]
+
+
+def test_literal_token_round_trip():
+    value = b"a(b)\\c\rd"
+    assert literal_value(literal_token(value)) == value
+
+
+@pytest.mark.parametrize("raw, value", [
+    (b"<48656C6C6F>", b"Hello"),
+    (b"<48 65 6c\n6C 6F>", b"Hello"),
+    (b"<414>", b"A@"),                         # odd digit count: a trailing 0 is implied
+    (b"<>", b""),
+])
+def test_hex_strings(raw, value):
+    assert hex_value(raw) == value
+
+
+def test_tokenizer_skips_comments_and_inline_images():
+    data = b"BI /W 1 ID \x00(\xff) EI % (not a string) Tj\n(real) Tj"
+    tokens = [(kind, data[start:end]) for kind, start, end in tokenize(data)]
+    assert ("inline", b"\x00(\xff)") in tokens
+    assert [value for kind, value in tokens if kind == "string"] == [b"(real)"]
+
+
+def test_replaces_escaped_literal_and_escapes_the_result():
+    data = b"BT /F1 12 Tf (Ref \\(\\101\\)) Tj ET"
+    count, out = rewrite(data, "Ref (A)", "Ref (B)", expected=1)
+    assert count == 1
+    assert out == b"BT /F1 12 Tf (Ref \\(B\\)) Tj ET"
+
+
+def test_replaces_hex_string_as_hex():
+    data = b"BT /F1 12 Tf [<494E562D303031>] TJ ET"
+    count, out = rewrite(data, "INV-001", "INV-042", expected=1)
+    assert count == 1
+    assert out == b"BT /F1 12 Tf [<494E562D303432>] TJ ET"
+
+
+def test_match_split_by_tj_kerning():
+    data = b"BT /F1 12 Tf [(Tot) -20 (al: 2) 15 (50.00) (!)] TJ ET"
+    count, out = rewrite(data, "Total: 250.00", "Total: 999.99", expected=1)
+    assert count == 1
+    # The strings and kerning inside the match collapse into one string; the rest is kept
+    assert out == b"BT /F1 12 Tf [(Total: 999.99) (!)] TJ ET"
+    count, out = rewrite(data, "al: 2", "AL: 3")
+    assert count == 1
+    assert out == b"BT /F1 12 Tf [(Tot) -20 (AL: 3) 15 (50.00) (!)] TJ ET"
+
+
+def test_font_is_tracked_through_q_and_q():
+    data = b"BT /F1 12 Tf q /F2 9 Tf (Total) Tj Q (Total) Tj ET"
+    count, out = rewrite(data, "Total", "Sum")
+    # Only the string shown in F1 (restored by Q) is rewritable
+    assert count == 1
+    assert out == b"BT /F1 12 Tf q /F2 9 Tf (Total) Tj Q (Sum) Tj ET"
+
+
+def test_expected_count_mismatch_changes_nothing():
+    data = b"BT /F1 12 Tf (Total) Tj (Total) Tj ET"
+    assert rewrite(data, "Total", "Sum", expected=1) == (0, None)
+    assert rewrite(data, "Total", "Sum", expected=3) == (0, None)
+    assert rewrite(data, "Missing", "Sum", expected=1) == (0, None)
+    assert rewrite(data, "Total", "Sum", expected=2)[0] == 2
+
+
+def test_occurrence_in_unrewritable_font_blocks_the_rule():
+    # One occurrence is in F2, which has no codec: the found count still matches, but not all can be rewritten
+    data = b"BT /F1 12 Tf (Total) Tj /F2 12 Tf (Total) Tj ET"
+    assert rewrite(data, "Total", "Sum", expected=1) == (1, b"BT /F1 12 Tf (Sum) Tj /F2 12 Tf (Total) Tj ET")
+
+
+def test_missing_glyphs_fall_back():
+    data = b"BT /F1 12 Tf (Total: 250) Tj ET"
+    # Not in the encoding
+    assert rewrite(data, "250", "250 ₽", expected=1) == (0, None)
+    # A subset font: only digits and the colon have widths
+    subset = SimpleFontCodec("cp1252", widths=(48, [500] * 11))
+    assert rewrite(data, "250", "975", expected=1, codec=subset)[0] == 1
+    assert rewrite(data, "250", "97A", expected=1, codec=subset) == (0, None)
+    # The embedded font program lacks a glyph
+    no_x = SimpleFontCodec("cp1252", glyph_check=lambda text: "X" not in text)
+    assert rewrite(data, "250", "X", expected=1, codec=no_x) == (0, None)
+    assert rewrite(data, "250", "Y", expected=1, codec=no_x)[0] == 1
+
+
+@pytest.mark.parametrize("subtype, base_font, encoding, differences, flags, embedded", [
+    ("Type0", "Helvetica", "WinAnsiEncoding", False, None, False),
+    ("Type3", None, "WinAnsiEncoding", False, None, False),
+    ("Type1", "Helvetica", "WinAnsiEncoding", True, None, False),       # /Differences
+    ("TrueType", "Arial", "WinAnsiEncoding", False, 4, True),           # symbolic
+    ("Type1", "ABCDEF+Helvetica", None, False, None, True),             # embedded, built-in encoding
+    ("Type1", "Frutiger", None, False, None, False),                    # not a base-14 font
+    ("TrueType", "Helvetica", None, False, None, False),
+    ("Type1", "Helvetica", "Identity-H", False, None, False),
+])
+def test_unrewritable_fonts(subtype, base_font, encoding, differences, flags, embedded):
+    assert codec_for_font(subtype, base_font, encoding, differences, flags, embedded) is None
+
+
+def test_rewritable_fonts():
+    assert codec_for_font("Type1", "Helvetica", "WinAnsiEncoding", False, 32, False).encoding == "cp1252"
+    assert codec_for_font("Type1", "Times-Roman", None, False, None, False).encoding == "standard"
+    assert codec_for_font("TrueType", "Arial", "MacRomanEncoding", False, None, True).encoding == "mac_roman"
+
+
+def test_standard_encoding():
+    codec = codec_for_font("Type1", "Courier", None, False, None, False)
+    assert codec.decode(b"It's") == "It�s"
+    assert codec.encode("Total 5") == b"Total 5" and codec.encode("it's") is None
+
+
+fitz = pytest.importorskip("fitz")
+
+
+def make_page(text="Invoice INV-001"):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), text, fontname="helv", fontsize=12)
+    return doc, page
+
+
+def test_fitz_font_codec_reads_font_dictionary():
+    doc, page = make_page()
+    assert fitz_font_codec(doc, page.xref, "helv").encoding == "cp1252"
+    assert fitz_font_codec(doc, page.xref, "nope") is None
+    assert fitz_font_codec(doc, None, "helv") is None
+
+
+@pytest.mark.parametrize("key, value", [
+    ("Encoding", "<</BaseEncoding/WinAnsiEncoding/Differences[73/B]>>"),
+    ("Subtype", "/Type0"),
+    ("Encoding", "/Identity-H"),
+])
+def test_fitz_font_codec_falls_back(key, value):
+    doc, page = make_page()
+    font_xref = page.get_fonts()[0][0]
+    doc.xref_set_key(font_xref, key, value)
+    assert fitz_font_codec(doc, page.xref, "helv") is None
+    # The page is left to redaction: nothing is rewritten
+    rewriter = TextRewriter([doc.xref_stream(page.get_contents()[0])],
+                            lambda name: fitz_font_codec(doc, page.xref, name))
+    assert rewriter.replace("INV-001", "INV-042", expected=1) == 0
+
+
+def test_shared_content_streams_are_not_rewritten(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store, "SHARED_CACHE", False)
+    doc, _page = make_page("Total: 250.00")
+    doc.new_page().insert_text((72, 100), "Other", fontname="helv", fontsize=12)
+    doc[1].set_contents(doc[0].get_contents()[0])
+    path = tmp_path / "shared.pdf"
+    doc.save(str(path))
+    doc.close()
+
+    doc = fitz.open(str(path))
+    assert shared_content_streams(doc) == set(doc[0].get_contents())
+    service = pdf_service.PDFService()
+    pending = [("250.00", "999.99", "exact", [fitz.Rect(0, 0, 1, 1)], [None])]
+    assert service._rewrite_text(doc, doc[0], pending, None, shared_content_streams(doc)) == pending
+    doc.close()
+
+    out = fitz.open(stream=service.replace_text_in_pdf(path, {"250.00": "999.99"}), filetype="pdf")
+    # Both pages went through redaction, each replaced exactly once
+    assert [page.get_text().count("999.99") for page in out] == [1, 1]
+    assert all("250.00" not in page.get_text() for page in out)
+    out.close()
+
+
+def test_rewrite_in_document_keeps_font_and_position(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store, "SHARED_CACHE", False)
+    doc, page = make_page()
+    path = tmp_path / "single.pdf"
+    doc.save(str(path))
+    doc.close()
+    out = fitz.open(stream=pdf_service.PDFService().replace_text_in_pdf(path, {"INV-001": "INV-042"}), filetype="pdf")
+    assert out[0].get_text().strip() == "Invoice INV-042"
+    # Rewritten in place: no redaction, no extra font
+    assert [font[3] for font in out[0].get_fonts()] == ["Helvetica"]
+    assert b"INV-042".hex().upper().encode() in out.xref_stream(out[0].get_contents()[0])
+    out.close()
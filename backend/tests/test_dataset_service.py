@@ -0,0 +1,72 @@
+"""Dataset uploads (dataset_service)"""
+import asyncio
+import io
+
+import pytest
+
+from services.dataset_service import DatasetService
+
+
+class Upload:
+    """The parts of UploadFile that save_upload uses"""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._data = io.BytesIO(data)
+
+    async def read(self, size):
+        return self._data.read(size)
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    return DatasetService(tmp_path)
+
+
+def save(datasets, filename, data):
+    return asyncio.run(datasets.save_upload(Upload(filename, data)))
+
+
+def rows(datasets, saved):
+    return list(datasets.iter_rows(datasets.get_path(saved["dataset_id"])))
+
+
+def test_csv(datasets):
+    saved = save(datasets, "people.csv", b"\xef\xbb\xbfname, num\nAlice,7\n,\nBob,\n")
+    assert saved["format"] == "csv" and saved["columns"] == ["name", "num"]
+    assert rows(datasets, saved) == [{"name": "Alice", "num": "7"}, {"name": "Bob", "num": ""}]
+
+
+def test_jsonl_rows_follow_first_record_columns(datasets):
+    saved = save(datasets, "people.jsonl", b'{"name": "Zed", "num": 3, "note": null}\n\n{"num": 4.5, "name": "Yan"}\n')
+    assert saved["format"] == "jsonl" and saved["columns"] == ["name", "num", "note"]
+    # Keys left out of a later record read as empty values
+    assert rows(datasets, saved) == [
+        {"name": "Zed", "num": "3", "note": ""},
+        {"name": "Yan", "num": "4.5", "note": ""},
+    ]
+
+
+def test_jsonl_record_with_unknown_key_is_rejected(datasets, tmp_path):
+    data = b'{"name": "Zed"}\n{"name": "Yan"}\n{"name": "Xi", "num": 5}\n'
+    with pytest.raises(ValueError, match=r"Line 3 .*\['num'\]"):
+        save(datasets, "people.jsonl", data)
+    # The rejected upload is not kept
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("filename, data, message", [
+    ("people.txt", b"name\n", "Unsupported dataset type"),
+    ("people.csv", b"", "no header"),
+    ("people.jsonl", b"\n\n", "no records"),
+    ("people.jsonl", b'{"name": "Zed"}\nnot json\n', "Invalid JSON on line 2"),
+    ("people.ndjson", b'["Zed"]\n', "not a JSON object"),
+])
+def test_invalid_uploads(datasets, filename, data, message):
+    with pytest.raises(ValueError, match=message):
+        save(datasets, filename, data)
+
+
+def test_get_path_rejects_non_uuid_ids(datasets):
+    assert datasets.get_path("../people") is None
+    assert datasets.get_path("00000000-0000-0000-0000-000000000000") is None
@@ -0,0 +1,90 @@
+"""Conditional and ranged downloads (download_service)"""
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from services.download_service import _etag_matches, content_etag, file_download, parse_range
+
+CONTENT = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=1000-", (1000, 1023)),          # open-ended
+    ("bytes=1000-5000", (1000, 1023)),      # end clamped to the file
+    ("bytes=-100", (924, 1023)),            # suffix: the last 100 bytes
+    ("bytes=-5000", (0, 1023)),             # suffix longer than the file
+    ("bytes=0-1,5-6", None),                # multiple ranges: whole file
+    ("bytes=-", None),
+    ("items=0-10", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=-0", "bytes=10-5"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, len(CONTENT))
+
+
+def test_etag_matching():
+    etag = '"abc"'
+    assert _etag_matches('"abc"', etag, weak=True)
+    assert _etag_matches('"x", W/"abc"', etag, weak=True)
+    assert _etag_matches("*", etag, weak=True)
+    assert not _etag_matches('"abd"', etag, weak=True)
+    # If-Range: a single strong tag, compared exactly
+    assert _etag_matches(' "abc" ', etag, weak=False)
+    assert not _etag_matches('W/"abc"', etag, weak=False)
+    assert not _etag_matches("*", etag, weak=False)
+    assert not _etag_matches('"x", "abc"', etag, weak=False)
+    assert not _etag_matches("Wed, 21 Oct 2015 07:28:00 GMT", etag, weak=False)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "out.zip"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def download(request: Request):
+        return await file_download(request.headers, path, media_type="application/zip", filename="out.zip")
+
+    return TestClient(app), content_etag(path)
+
+
+def test_full_download_and_revalidation(client):
+    client, etag = client
+    response = client.get("/file")
+    assert response.status_code == 200 and response.content == CONTENT
+    assert response.headers["etag"] == etag and response.headers["accept-ranges"] == "bytes"
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_range_requests(client):
+    client, etag = client
+    response = client.get("/file", headers={"Range": "bytes=-24"})
+    assert response.status_code == 206 and response.content == CONTENT[-24:]
+    assert response.headers["content-range"] == "bytes 1000-1023/1024"
+    response = client.get("/file", headers={"Range": "bytes=1000-"})
+    assert response.status_code == 206 and response.content == CONTENT[1000:]
+    response = client.get("/file", headers={"Range": "bytes=0-1,5-6"})
+    assert response.status_code == 200 and response.content == CONTENT
+    response = client.get("/file", headers={"Range": "bytes=4096-"})
+    assert response.status_code == 416 and response.headers["content-range"] == "bytes */1024"
+
+
+def test_if_range(client):
+    client, etag = client
+    response = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": etag})
+    assert response.status_code == 206 and response.content == CONTENT[10:20]
+    # The client's partial copy is of another version: the whole current file is sent
+    response = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.content == CONTENT
+    response = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": f"W/{etag}"})
+    assert response.status_code == 200
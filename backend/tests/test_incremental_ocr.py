@@ -0,0 +1,144 @@
+"""Incremental OCR: page hashes, reuse of unchanged pages and section-id carry-over"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from services import shared_store
+from services.ocr_service import OCRService
+from services.page_hash import page_hashes
+from services.section_store import carry_over_ids
+
+
+def make_pdf(path, pages):
+    """One page per list of (text, y) lines"""
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page(width=612, height=792)
+        for text, y in lines:
+            page.insert_text((72, y), text, fontsize=12)
+    doc.save(str(path))
+    doc.close()
+    return path
+
+
+def section(section_id, text, page, y=100):
+    return {"id": section_id, "text": text, "x": 150, "y": y, "width": 200, "height": 30,
+            "page": page, "dpi": 150, "page_width": 612.0, "page_height": 792.0}
+
+
+COVER = [("Cover", 100)]
+TERMS = [("Terms", 100), ("Signature", 600)]
+PRICES = [("Prices", 100)]
+
+
+@pytest.fixture(autouse=True)
+def no_shared_cache(monkeypatch):
+    monkeypatch.setattr(shared_store, "SHARED_CACHE", False)
+
+
+@pytest.fixture
+def ocr():
+    service = OCRService.__new__(OCRService)  # skips Tesseract discovery
+    service.executor = ThreadPoolExecutor(max_workers=1)
+    service.engine = type("Engine", (), {"lang": "eng"})()
+    service.raster_mode = "gray"
+    service.ocr_calls = []
+
+    async def iter_pages(pdf_path, dpi=None, pages=None, start_index=0):
+        """Stand-in for Tesseract: one section per text line of the page"""
+        doc = fitz.open(str(pdf_path))
+        try:
+            for page_num in (range(doc.page_count) if pages is None else pages):
+                service.ocr_calls.append(page_num)
+                blocks = doc[page_num].get_text("blocks")
+                sections = [section(f"section_{start_index + i}", b[4].strip(), page_num, y=b[1] * 150 / 72)
+                            for i, b in enumerate(blocks)]
+                start_index += len(sections)
+                yield page_num, sections
+        finally:
+            doc.close()
+
+    service.iter_pages = iter_pages
+    yield service
+    service.executor.shutdown()
+
+
+def run(ocr, pdf_path, previous_sections=None, previous_hashes=None):
+    async def collect():
+        return [event async for event in ocr.iter_incremental(pdf_path, 150, previous_sections, previous_hashes)]
+    events = asyncio.run(collect())
+    start, pages = events[0], events[1:]
+    sections = [s for event in sorted(pages, key=lambda e: e["page"]) for s in event["sections"]]
+    return start, sections
+
+
+def test_page_hashes_follow_content_not_position(tmp_path):
+    original = page_hashes(make_pdf(tmp_path / "a.pdf", [COVER, TERMS, PRICES]))
+    reordered = page_hashes(make_pdf(tmp_path / "b.pdf", [PRICES, COVER, [("Terms v2", 100), ("Signature", 600)]]))
+    assert len(set(original)) == 3
+    assert reordered[0] == original[2] and reordered[1] == original[0]
+    assert reordered[2] != original[1]
+    # Results computed with other OCR settings are not reused
+    assert page_hashes(tmp_path / "a.pdf", salt="dpi=300") != original
+
+
+def test_unchanged_pages_are_reused_and_changed_pages_ocrd(ocr, tmp_path):
+    first_start, first = run(ocr, make_pdf(tmp_path / "a.pdf", [COVER, TERMS, PRICES]))
+    assert first_start["reused_pages"] == [] and first_start["ocr_pages"] == [0, 1, 2]
+    ocr.ocr_calls.clear()
+
+    # A page is inserted in front and the last page is edited
+    start, sections = run(ocr, make_pdf(tmp_path / "b.pdf", [[("Preface", 100)], COVER, TERMS, [("Prices 2027", 100)]]),
+                          first, first_start["page_hashes"])
+    assert start["reused_pages"] == [1, 2] and start["ocr_pages"] == [0, 3]
+    assert sorted(ocr.ocr_calls) == [0, 3]
+    by_text = {s["text"]: s for s in sections}
+    previous = {s["text"]: s for s in first}
+    # Reused sections keep their ids and boxes and follow their page to its new position
+    for text in ("Cover", "Terms", "Signature"):
+        assert by_text[text]["id"] == previous[text]["id"]
+        assert by_text[text]["y"] == previous[text]["y"]
+    assert by_text["Cover"]["page"] == 1 and by_text["Signature"]["page"] == 2
+    assert len({s["id"] for s in sections}) == len(sections)
+    assert by_text["Preface"]["id"] not in {s["id"] for s in first}
+
+
+def test_changed_page_keeps_ids_of_unchanged_text(ocr, tmp_path):
+    first_start, first = run(ocr, make_pdf(tmp_path / "a.pdf", [COVER, TERMS]))
+    start, sections = run(ocr, make_pdf(tmp_path / "b.pdf", [COVER, [("Terms", 100), ("Signed by", 600)]]),
+                          first, first_start["page_hashes"])
+    assert start["ocr_pages"] == [1]
+    previous = {s["text"]: s["id"] for s in first}
+    current = {s["text"]: s["id"] for s in sections}
+    assert current["Terms"] == previous["Terms"]
+    assert current["Signed by"] not in previous.values()
+
+
+def test_no_previous_version_ocrs_everything(ocr, tmp_path):
+    start, sections = run(ocr, make_pdf(tmp_path / "a.pdf", [COVER, TERMS]), None, None)
+    assert start["reused_pages"] == [] and start["ocr_pages"] == [0, 1]
+    assert [s["id"] for s in sections] == ["section_0", "section_1", "section_2"]
+
+
+def test_carry_over_prefers_counterpart_page_then_nearest():
+    previous = [
+        section("section_0", "Total", 0, y=100),
+        section("section_1", "Total", 1, y=100),
+        section("section_2", "Total", 1, y=700),
+        section("section_3", "Date", 1, y=50),
+    ]
+    fresh = [section("new_0", "Total", 2, y=650), section("new_1", "Total", 2, y=120), section("new_2", "Notes", 2)]
+    result = carry_over_ids(fresh, previous, {2: 1}, taken=set())
+    assert [s["id"] for s in result] == ["section_2", "section_1", "section_4"]
+    assert [s["text"] for s in result] == ["Total", "Total", "Notes"]
+
+
+def test_carry_over_skips_taken_ids():
+    previous = [section("section_0", "Total", 0), section("section_1", "Total", 1)]
+    fresh = [section("new_0", "Total", 1), section("new_1", "Other", 1)]
+    # section_1 already belongs to a reused page; section_2 was handed out for another page
+    result = carry_over_ids(fresh, previous, {1: 1}, taken={"section_1", "section_2"})
+    assert [s["id"] for s in result] == ["section_0", "section_3"]
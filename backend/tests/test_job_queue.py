@@ -0,0 +1,147 @@
+"""Job queues: SQLite, and Redis against fakeredis (an in-process Redis stand-in, see requirements-dev.txt)"""
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from services import job_queue
+from services.job_queue import RedisJobQueue, SQLiteJobQueue
+
+SPEC = {"job_id": "job1", "pdf_id": "pdf1", "num_copies": 6, "seed": 1}
+RESULT = {"copies": 2, "errors": {}, "file": "job1_part_0001.zip", "size": 10, "pdf_bytes": 20}
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def queue(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_MAX_ATTEMPTS", 2)
+    if request.param == "sqlite":
+        queue = SQLiteJobQueue(tmp_path / "queue.db")
+    else:
+        queue = RedisJobQueue(client=fakeredis.FakeRedis(decode_responses=True))
+    assert queue.create_job("job1", SPEC, [(0, 2), (2, 4), (4, 6)])
+    return queue
+
+
+def expire_lease(queue, task_id):
+    if isinstance(queue, RedisJobQueue):
+        queue.client.zadd(queue._key("leases"), {task_id: time.time() - 1})
+    else:
+        queue._update_owned("leased_until = ?", (time.time() - 1,), task_id, *owner(queue, task_id))
+
+
+def owner(queue, task_id):
+    """(worker, attempts) of a running task"""
+    if isinstance(queue, RedisJobQueue):
+        task = queue.client.hgetall(queue._key("task", task_id))
+        return task["worker"], int(task["attempts"])
+    db = queue._connect()
+    try:
+        row = db.execute("SELECT worker, attempts FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+    finally:
+        db.close()
+    return row["worker"], row["attempts"]
+
+
+def complete(queue, task, worker, result=RESULT):
+    return queue.complete(task["task_id"], worker, task["attempts"], result)
+
+
+def fail(queue, task, worker, error="boom"):
+    return queue.fail(task["task_id"], worker, task["attempts"], error)
+
+
+def test_create_job_is_idempotent(queue):
+    assert not queue.create_job("job1", SPEC, [(0, 6)])
+    assert [task["status"] for task in queue.tasks("job1")] == ["pending"] * 3
+
+
+def test_claims_in_copy_order(queue):
+    claimed = [queue.claim(f"w{i}") for i in range(3)]
+    assert [task["position"] for task in claimed] == [0, 1, 2]
+    assert claimed[0]["chunk_start"] == 0 and claimed[0]["chunk_stop"] == 2
+    assert claimed[0]["job"]["seed"] == 1 and claimed[0]["attempts"] == 1
+    assert queue.claim("w3") is None
+    assert queue.summary("job1")["workers"] == ["w0", "w1", "w2"]
+
+
+def test_complete(queue):
+    task = queue.claim("w1")
+    assert queue.heartbeat(task["task_id"], "w1", task["attempts"])
+    assert complete(queue, task, "w1")
+    summary = queue.summary("job1")
+    assert summary["completed"] == [[0, 2]]
+    assert summary["chunks"] == {"pending": 2, "running": 0, "done": 1, "failed": 0}
+    assert queue.manifest("job1")["shards"][0]["file"] == "job1_part_0001.zip"
+    # A finished task is no longer anyone's to report
+    assert not complete(queue, task, "w1")
+    assert not queue.heartbeat(task["task_id"], "w1", task["attempts"])
+
+
+def test_fail_retries_then_gives_up(queue):
+    task = queue.claim("w1")
+    assert fail(queue, task, "w1")
+    retry = queue.claim("w2")
+    assert retry["task_id"] == task["task_id"] and retry["attempts"] == 2
+    assert fail(queue, retry, "w2", "boom again")
+    assert queue.tasks("job1")[0]["status"] == "failed"
+    assert queue.summary("job1")["errors"]["1"] == "Chunk failed: boom again"
+    assert queue.claim("w3")["position"] == 1
+
+
+def test_recovers_expired_lease(queue):
+    task = queue.claim("w1")
+    expire_lease(queue, task["task_id"])
+    recovered = queue.claim("w2")
+    assert recovered["task_id"] == task["task_id"] and recovered["attempts"] == 2
+    expire_lease(queue, task["task_id"])
+    # Out of attempts: given up instead of handed out again
+    assert queue.claim("w3")["position"] == 1
+    assert queue.tasks("job1")[0]["status"] == "failed"
+
+
+def test_stale_worker_cannot_touch_reclaimed_task(queue):
+    stale = queue.claim("w1")
+    expire_lease(queue, stale["task_id"])
+    current = queue.claim("w2")
+    assert current["task_id"] == stale["task_id"]
+    assert not queue.heartbeat(stale["task_id"], "w1", stale["attempts"])
+    assert not fail(queue, stale, "w1")
+    assert not complete(queue, stale, "w1")
+    # The new owner's claim is intact: still running, leased, and not queued a second time
+    assert queue.tasks("job1")[0]["status"] == "running"
+    assert queue.claim("w3")["position"] == 1
+    assert queue.claim("w4")["position"] == 2
+    assert queue.claim("w5") is None
+    assert complete(queue, current, "w2")
+    assert queue.tasks("job1")[0]["status"] == "done"
+
+
+def test_same_worker_new_attempt_is_a_different_claim(queue):
+    stale = queue.claim("w1")
+    expire_lease(queue, stale["task_id"])
+    current = queue.claim("w1")
+    assert current["task_id"] == stale["task_id"]
+    assert not fail(queue, stale, "w1")
+    assert complete(queue, current, "w1")
+
+
+def test_redis_heartbeat_does_not_lease_recovered_task():
+    queue = RedisJobQueue(client=fakeredis.FakeRedis(decode_responses=True))
+    queue.create_job("job1", SPEC, [(0, 6)])
+    task = queue.claim("w1")
+    expire_lease(queue, task["task_id"])
+    queue._recover_expired()
+    assert not queue.heartbeat(task["task_id"], "w1", task["attempts"])
+    assert queue.client.zscore(queue._key("leases"), task["task_id"]) is None
+
+
+def test_redis_does_not_recover_task_being_claimed():
+    queue = RedisJobQueue(client=fakeredis.FakeRedis(decode_responses=True))
+    queue.create_job("job1", SPEC, [(0, 2), (2, 4)])
+    # A claimer between RPOPLPUSH and ZADD: its task has no lease yet
+    task_id = queue.client.rpoplpush(queue._key("pending"), queue._key("processing"))
+    assert queue.claim("w2")["task_id"] != task_id
+    # If that claimer died, the task comes back once the provisional lease runs out
+    expire_lease(queue, task_id)
+    assert queue.claim("w3")["task_id"] == task_id
@@ -0,0 +1,97 @@
+"""Word grouping of OCRService on synthetic Tesseract image_to_data output"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.ocr_service import OCRService
+
+
+class FakeEngine:
+    lang = "eng"
+
+    def __init__(self, data):
+        self.data = data
+
+    def image_to_data(self, image, config=""):
+        return self.data
+
+
+def tesseract_dict(words, layout=True):
+    """Columnar image_to_data output from (text, conf, left, top, width, height, block, par, line) tuples"""
+    keys = ["text", "conf", "left", "top", "width", "height"] + (["block_num", "par_num", "line_num"] if layout else [])
+    return {key: [word[i] for word in words] for i, key in enumerate(keys)}
+
+
+@pytest.fixture
+def ocr():
+    service = OCRService.__new__(OCRService)  # skips Tesseract discovery
+    service.executor = ThreadPoolExecutor(max_workers=1)
+    yield service
+    service.executor.shutdown()
+
+
+def group(ocr, data, page_num=0, start_index=0):
+    ocr.engine = FakeEngine(data)
+    words = asyncio.run(ocr._ocr_words(None))
+    return ocr._group_words(words, page_num, start_index, 150, 612.0, 792.0)
+
+
+def test_words_of_a_line_form_one_section(ocr):
+    sections = group(ocr, tesseract_dict([
+        ("Invoice", "95", 100, 50, 60, 20, 1, 1, 1),
+        ("No:", "91.5", 168, 52, 30, 18, 1, 1, 1),
+        ("INV-001", "90", 205, 49, 70, 21, 1, 1, 1),
+    ]))
+    assert len(sections) == 1
+    section = sections[0]
+    assert section["text"] == "Invoice No: INV-001"
+    assert (section["x"], section["y"], section["width"], section["height"]) == (100, 49, 175, 21)
+    assert (section["id"], section["page"], section["dpi"]) == ("section_0", 0, 150)
+    assert (section["page_width"], section["page_height"]) == (612.0, 792.0)
+
+
+def test_wide_gap_splits_columns(ocr):
+    # Gap of 200px against 20px words: more than OCR_COLUMN_GAP_FACTOR line heights
+    sections = group(ocr, tesseract_dict([
+        ("Name", "95", 100, 50, 50, 20, 1, 1, 1),
+        ("Total", "95", 350, 50, 50, 20, 1, 1, 1),
+        ("Due", "95", 405, 50, 40, 20, 1, 1, 1),
+    ]))
+    assert [s["text"] for s in sections] == ["Name", "Total Due"]
+
+
+def test_lines_and_paragraphs_are_kept_apart_and_ordered(ocr):
+    # Out of order, as after high-DPI retries are merged in
+    sections = group(ocr, tesseract_dict([
+        ("world", "95", 170, 50, 50, 20, 1, 1, 1),
+        ("Second", "95", 100, 80, 60, 20, 1, 1, 2),
+        ("Hello", "95", 100, 50, 60, 20, 1, 1, 1),
+        ("Footer", "95", 100, 700, 60, 20, 2, 1, 1),
+        ("Next", "95", 100, 120, 50, 20, 1, 2, 1),
+    ]), page_num=3, start_index=10)
+    assert [s["text"] for s in sections] == ["Hello world", "Second", "Next", "Footer"]
+    assert [s["id"] for s in sections] == ["section_10", "section_11", "section_12", "section_13"]
+    assert all(s["page"] == 3 for s in sections)
+
+
+def test_low_confidence_and_blank_words_are_dropped(ocr):
+    sections = group(ocr, tesseract_dict([
+        ("", "-1", 0, 0, 612, 792, 1, 0, 0),
+        ("   ", "95", 10, 10, 5, 5, 1, 1, 1),
+        ("smudge", "30", 100, 50, 50, 20, 1, 1, 1),
+        ("Amount", "31", 160, 50, 60, 20, 1, 1, 1),
+    ]))
+    assert [s["text"] for s in sections] == ["Amount"]
+    assert group(ocr, tesseract_dict([("noise", "12", 0, 0, 10, 10, 1, 1, 1)])) == []
+
+
+def test_lines_are_inferred_without_layout_columns(ocr):
+    # Engines that return no block/paragraph/line numbers are clustered by vertical centre
+    sections = group(ocr, tesseract_dict([
+        ("Total", "95", 300, 104, 50, 20),
+        ("Invoice", "95", 100, 50, 60, 20),
+        ("No:", "95", 165, 54, 30, 16),
+        ("Due", "95", 355, 100, 40, 24),
+    ], layout=False))
+    assert [s["text"] for s in sections] == ["Invoice No:", "Total Due"]
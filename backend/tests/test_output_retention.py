@@ -0,0 +1,102 @@
+"""Expiry of generation outputs and the recent-job index"""
+import os
+import time
+
+import pytest
+
+from services.generator_service import GeneratorService
+from services.output_retention import sweep_outputs
+
+NOW = time.time()
+HOUR = 3600
+
+
+def touch(path, age_hours, data=b"x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    mtime = NOW - age_hours * HOUR
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def age_dir(path, age_hours):
+    mtime = NOW - age_hours * HOUR
+    os.utime(path, (mtime, mtime))
+
+
+def names(directory):
+    return sorted(path.name for path in directory.iterdir())
+
+
+def test_sweep_removes_expired_jobs_together(tmp_path):
+    # An expired sharded job: copies, checkpoint, manifest, shards and their ETag sidecars
+    touch(tmp_path / "old-job" / "tpl_copy_1.pdf", 30)
+    age_dir(tmp_path / "old-job", 30)
+    for name in ("old-job.checkpoint.json", "old-job.manifest.json", "old-job_part_0001.zip",
+                 "old-job_part_0001.zip.etag", "old-job_part_0002.zip.3f2a9c.tmp"):
+        touch(tmp_path / name, 30)
+    # A long job whose first shard is old but which wrote its checkpoint recently
+    touch(tmp_path / "long_job_part_0001.zip", 30)
+    touch(tmp_path / "long_job.checkpoint.json", 1)
+    # Stand-alone outputs
+    touch(tmp_path / "generated_tpl.zip", 30)
+    touch(tmp_path / "generated_tpl.zip.etag", 30)
+    touch(tmp_path / "batch_b1.zip", 1)
+    touch(tmp_path / "tpl.jobs.json", 30)
+    touch(tmp_path / "tpl_copy_3.pdf", 30)
+    # Never touched: databases and unknown files
+    touch(tmp_path / "job_queue.db", 30)
+    touch(tmp_path / "shared_cache.db-wal", 30)
+    touch(tmp_path / "notes.txt", 30)
+
+    removed = sweep_outputs(tmp_path, 24 * HOUR, now=NOW)
+    assert removed == 10
+    assert names(tmp_path) == [
+        "batch_b1.zip", "job_queue.db", "long_job.checkpoint.json", "long_job_part_0001.zip",
+        "notes.txt", "shared_cache.db-wal",
+    ]
+
+
+def test_job_directory_is_kept_while_copies_are_written(tmp_path):
+    touch(tmp_path / "running" / "tpl_copy_1.pdf", 30)
+    touch(tmp_path / "running" / "tpl_copy_2.pdf", 0)
+    age_dir(tmp_path / "running", 30)
+    touch(tmp_path / "bad id!" / "tpl_copy_1.pdf", 30)
+    age_dir(tmp_path / "bad id!", 30)
+    assert sweep_outputs(tmp_path, 24 * HOUR, now=NOW) == 0
+    assert names(tmp_path) == ["bad id!", "running"]
+
+
+def test_active_jobs_are_kept(tmp_path):
+    touch(tmp_path / "bg.checkpoint.json", 30)
+    touch(tmp_path / "bg_part_0001.zip", 30)
+    assert sweep_outputs(tmp_path, 24 * HOUR, active_jobs={"bg"}, now=NOW) == 0
+    assert sweep_outputs(tmp_path, 24 * HOUR, now=NOW) == 2
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return GeneratorService()
+
+
+def test_recent_jobs_index(generator, monkeypatch):
+    from services import generator_service
+    monkeypatch.setattr(generator_service, "RECENT_JOBS_PER_PDF", 3)
+    assert generator.recent_jobs("tpl") == []
+    for job_id in ("j1", "j2", "j1", "j3", "j4"):
+        generator._record_job("tpl", job_id)
+    assert generator.recent_jobs("tpl") == ["j4", "j3", "j1"]
+    assert generator.recent_jobs("other") == []
+    assert not list(generator.output_dir.glob("*.tmp"))
+
+
+def test_latest_copy_prefers_the_newest_job_that_has_it(generator):
+    for job_id, copies in (("old", 3), ("new", 1)):
+        generator._record_job("tpl", job_id)
+        for number in range(1, copies + 1):
+            touch(generator.job_dir(job_id) / f"tpl_copy_{number}.pdf", 0)
+    assert generator.latest_copy("tpl", 1) == generator.job_dir("new") / "tpl_copy_1.pdf"
+    assert generator.latest_copy("tpl", 3) == generator.job_dir("old") / "tpl_copy_3.pdf"
+    assert generator.latest_copy("tpl", 4) is None
+    assert generator.latest_copy("other", 1) is None
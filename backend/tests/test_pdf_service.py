@@ -0,0 +1,51 @@
+"""Text replacement in PDFService"""
+import contextlib
+import io
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from services import pdf_service, shared_store
+
+
+@pytest.fixture
+def chain_pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store, "SHARED_CACHE", False)
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "Order ALPHA", fontname="helv", fontsize=12)
+    page.insert_text((72, 140), "Ref BETA", fontname="helv", fontsize=12)
+    path = tmp_path / "chain.pdf"
+    doc.save(str(path))
+    doc.close()
+    return path
+
+
+def page_lines(pdf_bytes):
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        words = doc[0].get_text("words")
+    finally:
+        doc.close()
+    lines = {}
+    for x0, y0, _x1, _y1, text, *_rest in words:
+        lines.setdefault(round(y0 / 20), []).append((x0, text))
+    return [" ".join(text for _x, text in sorted(line)) for _y, line in sorted(lines.items())]
+
+
+@pytest.mark.parametrize("rewrite", [True, False], ids=["content-stream", "redaction"])
+@pytest.mark.parametrize("planned", [False, True], ids=["searched", "planned"])
+@pytest.mark.parametrize("replacements", [
+    {"ALPHA": "BETA", "BETA": "GAMMA"},
+    {"BETA": "GAMMA", "ALPHA": "BETA"},
+])
+def test_rules_are_resolved_before_the_page_is_modified(chain_pdf, monkeypatch, rewrite, planned, replacements):
+    # Searching after each replacement (the behaviour before plans) let BETA -> GAMMA also match
+    # the BETA that ALPHA -> BETA had just inserted, giving "Order GAMMA"
+    monkeypatch.setattr(pdf_service, "CONTENT_STREAM_REWRITE", rewrite)
+    service = pdf_service.PDFService()
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan = service.get_plan(chain_pdf, list(replacements)) if planned else None
+        output = service.replace_text_in_pdf(chain_pdf, replacements, plan=plan)
+    assert page_lines(output) == ["Order BETA", "Ref GAMMA"]
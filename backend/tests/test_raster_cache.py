@@ -0,0 +1,58 @@
+"""OCR page rasters reused for page previews"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from services import ocr_service
+from services.ocr_service import OCRService
+from services.page_render_service import PageRenderService
+
+
+def test_gray_ocr_raster_serves_previews(tmp_path):
+    pdf_path = tmp_path / "template.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 not rendered: the preview comes from the raster")
+    cache = PageRenderService(cache_dir=tmp_path / "cache")
+    # A US Letter page rendered for OCR at 150 DPI in the default gray mode
+    cache.store_raster(pdf_path, 0, 150, Image.new("L", (1275, 1650), 200))
+
+    path, media_type = cache.render(pdf_path, 0, zoom=1.0, fmt="png")
+    assert media_type == "image/png"
+    with Image.open(path) as preview:
+        assert preview.size == (612, 792)
+        assert preview.getpixel((300, 400))[:3] == (200, 200, 200)
+
+
+def test_raster_stores_run_in_background_and_are_bounded(monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_RASTER_STORE_PENDING", 2)
+    release = threading.Event()
+    stored = []
+
+    class SlowCache:
+        def store_raster(self, pdf_path, page_num, dpi, image):
+            release.wait(5)
+            stored.append(page_num)
+            if page_num == 1:
+                raise OSError("disk full")
+
+    service = OCRService.__new__(OCRService)  # skips Tesseract discovery
+    service.raster_cache = SlowCache()
+    service.raster_executor = ThreadPoolExecutor(max_workers=1)
+    service._raster_stores = set()
+
+    async def run():
+        image = Image.new("L", (10, 10))
+        await service._store_raster("a.pdf", 0, 150, image)
+        await service._store_raster("a.pdf", 1, 150, image)
+        # Two stores pending: OCR of the next page goes on only once one has finished
+        third = asyncio.ensure_future(service._store_raster("a.pdf", 2, 150, image))
+        await asyncio.sleep(0.05)
+        assert not third.done() and stored == []
+        release.set()
+        await third
+
+    asyncio.run(run())
+    service.raster_executor.shutdown(wait=True)
+    # A failed store is logged by the done callback and does not stop the others
+    assert stored == [0, 1, 2]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Generation worker: renders chunks of distributed generation jobs from the job queue.
+
+    python worker.py                 # one worker process
+    python worker.py --processes 4   # four worker processes on this node
+    python worker.py --burst         # exit once the queue is empty
+
+Run it from the backend directory (like start_server.py) on every node that should
+render copies. All nodes need the same JOB_QUEUE_URL and the same uploads/ and
+outputs/ directories, e.g. on a shared volume.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+from services.dataset_service import DatasetService
+from services.generator_service import GeneratorService
+from services.job_queue import JOB_QUEUE_LEASE, TaskLost, create_job_queue, worker_name
+
+# Seconds to wait before polling an empty queue again
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+# Worker processes started by one `python worker.py`
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+UPLOAD_DIR = Path("uploads")
+
+_stopping = False
+
+
+def _stop(signum, frame):
+    # Finish the chunk in hand, then exit; an unfinished chunk would only wait out its lease
+    global _stopping
+    _stopping = True
+    print(f"Worker {worker_name()}: stopping after the current chunk")
+
+
+def run_worker(burst: bool = False) -> int:
+    """Claim and render chunks until stopped (or, with burst, until the queue is empty). Returns chunks done."""
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    name = worker_name()
+    queue = create_job_queue()
+    generator = GeneratorService()
+    datasets = DatasetService(UPLOAD_DIR)
+    print(f"Worker {name} started")
+    done = 0
+    while not _stopping:
+        task = queue.claim(name)
+        if task is None:
+            if burst:
+                break
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+
+        last_beat = time.monotonic()
+
+        def heartbeat():
+            # Renew well before the lease runs out, without a queue write per copy
+            nonlocal last_beat
+            if time.monotonic() - last_beat > JOB_QUEUE_LEASE / 4:
+                if not queue.heartbeat(task["task_id"], name, task["attempts"]):
+                    raise TaskLost(f"chunk {task['position'] + 1} of job {task['job_id']} was claimed by another worker")
+                last_beat = time.monotonic()
+
+        spec = task["job"]
+        try:
+            dataset_rows = datasets.iter_rows(Path(spec["dataset_path"])) if spec.get("dataset_path") else None
+            result = generator.run_chunk(
+                spec, task["position"], task["chunk_start"], task["chunk_stop"], dataset_rows, heartbeat
+            )
+            if not queue.complete(task["task_id"], name, task["attempts"], result):
+                raise TaskLost(f"chunk {task['position'] + 1} of job {task['job_id']} was claimed by another worker")
+            done += 1
+        except TaskLost as e:
+            # The new owner renders and reports the chunk; this claim must not touch it
+            print(f"Worker {name}: dropping {e}")
+        except Exception as e:
+            import traceback
+            print(f"Error in chunk {task['position'] + 1} of job {task['job_id']}: {str(e)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            if not queue.fail(task["task_id"], name, task["attempts"], str(e)):
+                print(f"Worker {name}: chunk {task['position'] + 1} of job {task['job_id']} was claimed by another worker")
+    print(f"Worker {name} exiting after {done} chunks")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render queued PDF generation chunks")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES, help="worker processes to run")
+    parser.add_argument("--burst", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    try:
+        if args.processes <= 1:
+            run_worker(args.burst)
+        else:
+            processes = [
+                multiprocessing.Process(target=run_worker, args=(args.burst,), name=f"worker-{i + 1}")
+                for i in range(args.processes)
+            ]
+            for process in processes:
+                process.start()
+
+            def forward(signum, frame):
+                # Each worker finishes its chunk before exiting
+                for process in processes:
+                    if process.is_alive():
+                        os.kill(process.pid, signal.SIGTERM)
+
+            signal.signal(signal.SIGTERM, forward)
+            signal.signal(signal.SIGINT, forward)
+            for process in processes:
+                process.join()
+    except Exception as e:
+        print(f"Error running worker: {e}", file=sys.stderr)
+        sys.exit(1)
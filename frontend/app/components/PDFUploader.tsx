@@ -16,6 +16,7 @@ export default function PDFUploader({ onUploaded, onSectionsDetected }: PDFUploa
     const [processing, setProcessing] = useState(false)
     const [uploadedFile, setUploadedFile] = useState<string | null>(null)
     const [pdfId, setPdfId] = useState<string | null>(null)
+    const [progress, setProgress] = useState<{ completed: number, total: number } | null>(null)
 
     const handleFileChange = async (e: React.ChangeEvent<HTMLInputElement>) => {
         const file = e.target.files?.[0]
@@ -40,32 +41,60 @@ export default function PDFUploader({ onUploaded, onSectionsDetected }: PDFUploa
             onUploaded(id)
             setUploading(false)
 
-            // Step 2: Process OCR
+            // Step 2: Process OCR, streamed page by page so sections show up as each page finishes
             try {
                 setProcessing(true)
-                const ocrResponse = await axios.post(`${apiUrl}/api/ocr/${id}`, {}, {
-                    timeout: 300000 // 5 minute timeout for OCR processing
+                setProgress(null)
+                const ocrResponse = await fetch(`${apiUrl}/api/ocr/${id}/stream`, {
+                    method: 'POST',
+                    headers: { Accept: 'application/x-ndjson' }
                 })
-                
-                if (ocrResponse.data && ocrResponse.data.sections) {
-                    onSectionsDetected(ocrResponse.data.sections)
-                } else {
-                    console.warn('OCR response missing sections:', ocrResponse.data)
-                    alert('PDF uploaded successfully, but OCR processing returned unexpected format. Please try again.')
+                if (!ocrResponse.ok || !ocrResponse.body) {
+                    const body = await ocrResponse.json().catch(() => null)
+                    throw new Error(body?.detail || `HTTP ${ocrResponse.status}`)
+                }
+
+                const reader = ocrResponse.body.getReader()
+                const decoder = new TextDecoder()
+                const sections: any[] = []
+                let buffer = ''
+                let finished = false
+                const handleEvent = (event: any) => {
+                    if (event.event === 'start') {
+                        setProgress({ completed: 0, total: event.pages })
+                    } else if (event.event === 'page') {
+                        sections.push(...event.sections)
+                        setProgress({ completed: event.completed, total: event.total })
+                        onSectionsDetected([...sections])
+                    } else if (event.event === 'error') {
+                        throw new Error(event.detail)
+                    } else if (event.event === 'done') {
+                        finished = true
+                    }
+                }
+                while (true) {
+                    const { done, value } = await reader.read()
+                    if (value) buffer += decoder.decode(value, { stream: true })
+                    const lines = buffer.split('\n')
+                    buffer = done ? '' : lines.pop() || ''
+                    for (const line of lines) {
+                        if (line.trim()) handleEvent(JSON.parse(line))
+                    }
+                    if (done) break
+                }
+                if (!finished) {
+                    throw new Error('OCR stream ended unexpectedly')
                 }
             } catch (ocrError: any) {
                 console.error('OCR processing error:', ocrError)
-                const ocrErrorMessage = ocrError.response?.data?.detail || ocrError.message || 'Unknown OCR error'
+                const ocrErrorMessage = ocrError.message || 'Unknown OCR error'
                 // Show error in console instead of alert for better debugging
-                console.error('OCR Error Details:', {
-                    message: ocrErrorMessage,
-                    response: ocrError.response?.data,
-                    status: ocrError.response?.status
-                })
+                console.error('OCR Error Details:', { message: ocrErrorMessage })
                 // Still show user-friendly message
                 alert(`PDF uploaded successfully, but OCR processing failed.\n\nError: ${ocrErrorMessage}\n\nCheck browser console (F12) for details.`)
             } finally {
                 setProcessing(false)
+                setProgress(null)
             }
         } catch (error: any) {
             console.error('Upload error:', error)
@@ -108,7 +137,13 @@ export default function PDFUploader({ onUploaded, onSectionsDetected }: PDFUploa
                                 </Button>
                             </div>
                             <p className="text-sm text-muted-foreground">
-                                {uploading ? 'Uploading your file...' : processing ? 'Scanning PDF with OCR...' : 'Choose a PDF file to upload'}
+                                {uploading
+                                    ? 'Uploading your file...'
+                                    : processing
+                                        ? progress
+                                            ? `Scanned ${progress.completed} of ${progress.total} pages - detected sections can already be selected`
+                                            : 'Scanning PDF with OCR...'
+                                        : 'Choose a PDF file to upload'}
                             </p>
                         </div>
                     </label>
@@ -15,6 +15,9 @@ export interface TextSection {
     width: number
     height: number
     page: number
+    dpi?: number  // DPI the pixel coordinates were measured at
+    page_width?: number  // Page size in PDF points
+    page_height?: number
 }
 
 export interface ReplacementRule {